@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+# Assembler throughput benchmark.
+#
+# Generates a synthetic program of the given number of lines, with a label
+# every --every lines and branches and jumps to random labels, and times
+# each pass of mips_assembler over it.
+
+import argparse
+import os.path
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mips_sim import CMDParse
+from mips_assembler import remove_comments, split_labels, resolve_labels
+
+
+def synthetic(lines, every=10, seed=0):
+    rng = np.random.RandomState(seed)
+    labels = max(1, lines // every)
+    out = []
+
+    for i in range(lines):
+        if i % every == 0:
+            out.append("l{}:".format(i // every))
+            continue
+
+        k = rng.randint(5)
+
+        if k == 0:
+            out.append("    beq $t0, $t1, l{}    ; branch".format(rng.randint(labels)))
+        elif k == 1:
+            out.append("    j l{}".format(rng.randint(labels)))
+        elif k == 2:
+            out.append("    lw $t2, {}($sp)".format(4 * rng.randint(100)))
+        else:
+            out.append("    addi $t0, $t0, {}".format(rng.randint(-100, 100)))
+
+    return out
+
+
+def run(source, encode=True):
+    # [(pass, seconds)]
+    times = []
+    t = time.perf_counter()
+
+    lines = remove_comments(source)
+    times.append(("comments", time.perf_counter() - t))
+
+    t = time.perf_counter()
+    prog, labels = split_labels(lines)
+    times.append(("labels", time.perf_counter() - t))
+
+    t = time.perf_counter()
+    prog = resolve_labels(prog, labels)
+    times.append(("resolve", time.perf_counter() - t))
+
+    if encode:
+        t = time.perf_counter()
+
+        for l in prog:
+            CMDParse.parse_cmd(l)
+
+        times.append(("encode", time.perf_counter() - t))
+
+    return times
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='Assembler benchmark',
+                                     description='')
+    parser.add_argument('-l', '--lines', type=int, dest='lines', default=1000000,
+                        help='Lines of assembly to generate.')
+    parser.add_argument('--every', type=int, dest='every', default=10,
+                        help='Lines per label.')
+    parser.add_argument('--no-encode', action='store_false', dest='encode', default=True,
+                        help='Skip the encoding pass.')
+
+    args = parser.parse_args()
+
+    source = synthetic(args.lines, args.every)
+    times = run(source, args.encode)
+
+    for name, t in times:
+        print("{:10} {:>8.3f} s".format(name, t))
+
+    total = sum(t for _, t in times)
+    print("{:10} {:>8.3f} s {:>10.0f} lines/s".format("total", total, args.lines / total))
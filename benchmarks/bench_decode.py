@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+# Decode throughput micro-benchmark.
+#
+# Times Instr.decode over the encoding of one of every instruction form and
+# reports decoded words per second. Run it from the repository root.
+
+import argparse
+import os.path
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mips_sim import CMDParse, Instr
+
+sample = [
+    "add $s0, $t0, $t1",
+    "addi $s1, $t1, -5",
+    "addiu $s2, $t2, 0x0bba",
+    "and $s0, $t0, $t1",
+    "andi $s0, $t0, 63",
+    "beq $s0, $t0, -20",
+    "bgez $s0, 1000",
+    "bne $s0, $t0, 2001",
+    "div $s0, $t0",
+    "j 1000200",
+    "jal 1000201",
+    "jr $ra",
+    "lb $s1, 50($t0)",
+    "lui $s0, 5321",
+    "lw $s1, -4($sp)",
+    "mfhi $s0",
+    "mult $t1, $t2",
+    "noop",
+    "ori $s0, $t1, 500",
+    "sb $s0, 22($s1)",
+    "sll $s0, $t6, 5",
+    "sllv $t0, $t6, $t3",
+    "slt $s0, $t5, $t4",
+    "slti $s0, $t3, -100",
+    "sra $s0, $t5, 6",
+    "srlv $s0, $s1, $s2",
+    "sub $s3, $s0, $s2",
+    "sw $t0, 24($s3)",
+    "syscall",
+    "xori $s4, $t2, 0xFFFF",
+]
+
+
+def run(repeat):
+    words = [CMDParse.parse_cmd(s).bin for s in sample]
+
+    def loop():
+        for w in words:
+            Instr.decode(w)
+
+    best = min(timeit.repeat(loop, number=repeat, repeat=5))
+
+    return len(words) * repeat / best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='Decode micro-benchmark',
+                                     description='')
+    parser.add_argument('-n', '--repeat', type=int, dest='repeat', default=200,
+                        help='Passes over the sample per timing.')
+
+    args = parser.parse_args()
+
+    print("Instr.decode: {:.0f} words/s".format(run(args.repeat)))
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+# Per-opcode micro-benchmarks.
+#
+# For every MIPSI instruction, times the MIPSProcessor._<op> handler on each
+# backend, Instr.decode, Instr.encode and CMDParse.parse_cmd over a sample
+# of randomly generated instances of it, and prints a table of nanoseconds
+# per call. Handlers get the arguments Instr.decode gives them, as when
+# interpreting. Sources are $s registers holding small multiples of 4 and
+# destinations $t registers, so no instance traps (except syscall, which
+# always does) and the operands stay the same from one pass to the next.
+#
+# -o saves the results as JSON, and --compare OLD NEW lists the timings in
+# NEW that are slower than in OLD by more than --threshold.
+
+import argparse
+import json
+import os.path
+import platform
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mips_sim import CMDParse, Instr, MIPSI, MIPSR, SoftwareInterrupt, backends
+
+columns = sorted(backends) + ["decode", "encode", "parse"]
+
+mem_size = 0x10000
+
+
+def random_instr(op, rng):
+    # The assembly of a random instance of op, see the module comment.
+    def s():
+        return "$s{}".format(rng.randint(8))
+
+    def t():
+        return "$t{}".format(rng.randint(8))
+
+    imm = rng.randint(0x8000)
+    offset = rng.randint(-0x8000, 0x8000)
+
+    if op in CMDParse.cat_0:
+        return op
+    if op in CMDParse.cat_1 | CMDParse.cat_2:
+        return "{} {}, {}, {}".format(op, t(), s(), s())
+    if op in CMDParse.cat_3:
+        return "{} {}, {}, {}".format(op, t(), s(), rng.randint(32))
+    if op in CMDParse.cat_4:
+        return "{} {}, {}, {}".format(op, t(), s(), imm)
+    if op in CMDParse.cat_5:
+        return "{} {}, {}({})".format(op, t(), 4 * rng.randint(0x400), s())
+    if op in CMDParse.cat_6:
+        return "{} {}".format(op, s())
+    if op in CMDParse.cat_7:
+        return "{} {}".format(op, rng.randint(1 << 26))
+    if op in CMDParse.cat_8:
+        return "{} {}, {}".format(op, s(), s())
+    if op in CMDParse.cat_9:
+        return "{} {}".format(op, t())
+    if op in CMDParse.cat_10:
+        return "{} {}, {}".format(op, t(), imm)
+    if op in CMDParse.cat_11:
+        return "{} {}, {}".format(op, s(), offset)
+
+    return "{} {}, {}, {}".format(op, s(), s(), offset)
+
+
+def best_ns(loop, calls, number):
+    return min(timeit.repeat(loop, number=number, repeat=5)) / (calls * number) * 1e9
+
+
+def time_handlers(proc, instrs, number):
+    calls = [proc.decode_entry(i.op, i.args)[:2] for i in instrs]
+
+    if instrs[0].op == "syscall":
+        def loop():
+            for h, args in calls:
+                try:
+                    h(*args)
+                except SoftwareInterrupt:
+                    pass
+    else:
+        def loop():
+            for h, args in calls:
+                h(*args)
+
+    return best_ns(loop, len(calls), number)
+
+
+def run(samples=64, number=20, seed=0):
+    # {op: {column: ns per call}}
+    rng = np.random.RandomState(seed)
+    procs = {}
+
+    for name in sorted(backends):
+        p = backends[name](mem_size)
+
+        for r in range(MIPSR.S0.value, MIPSR.S7.value + 1):
+            p.reg[r] = 4 * rng.randint(1, 0x2000)
+
+        procs[name] = p
+
+    results = {}
+
+    for op in MIPSI:
+        name = op.name.lower()
+        source = [random_instr(name, rng) for i in range(samples)]
+        parsed = [CMDParse.parse_cmd(l) for l in source]
+        words = [i.bin for i in parsed]
+        instrs = [Instr.decode(w) for w in words]
+
+        row = {k: time_handlers(p, instrs, number) for k, p in procs.items()}
+
+        def decode():
+            for w in words:
+                Instr.decode(w)
+
+        def encode():
+            for i in parsed:
+                i.encode()
+
+        def parse():
+            for l in source:
+                CMDParse.parse_cmd(l)
+
+        row["decode"] = best_ns(decode, samples, number)
+        row["encode"] = best_ns(encode, samples, number)
+        row["parse"] = best_ns(parse, samples, number)
+
+        results[name] = row
+
+    return results
+
+
+def table(results, sort="numpy"):
+    lines = ["{:8}".format("op") + "".join("{:>10}".format(c) for c in columns) + "  (ns per call)"]
+
+    for op in sorted(results, key=lambda k: -results[k][sort]):
+        lines.append("{:8}".format(op) + "".join("{:>10.0f}".format(results[op][c]) for c in columns))
+
+    totals = {c: sum(r[c] for r in results.values()) for c in columns}
+    lines.append("{:8}".format("mean") + "".join("{:>10.0f}".format(totals[c] / len(results)) for c in columns))
+
+    return "\n".join(lines)
+
+
+def compare(old, new, threshold=0.1):
+    # [(op, column, old ns, new ns)] of the timings in new more than
+    # threshold (a fraction) slower than in old, worst first.
+    out = []
+
+    for op, row in new.items():
+        for c, t in row.items():
+            base = old.get(op, {}).get(c)
+
+            if base and t > base * (1 + threshold):
+                out.append((op, c, base, t))
+
+    return sorted(out, key=lambda e: -e[3] / e[2])
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)["ops"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='Per-opcode micro-benchmarks',
+                                     description='')
+    parser.add_argument('-n', '--repeat', type=int, dest='repeat', default=20,
+                        help='Passes over the samples per timing.')
+    parser.add_argument('--samples', type=int, dest='samples', default=64,
+                        help='Random instances of each instruction.')
+    parser.add_argument('--seed', type=int, dest='seed', default=0,
+                        help='Seed for the random instances.')
+    parser.add_argument('--sort', choices=columns, dest='sort', default='numpy',
+                        help='Column to sort the table by.')
+    parser.add_argument('-o', '--output', dest='output', default=None,
+                        help='Save the results as JSON.')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), dest='compare', default=None,
+                        help='Compare two saved results instead of running.')
+    parser.add_argument('--threshold', type=float, dest='threshold', default=0.1,
+                        help='Slowdown to flag with --compare, as a fraction.')
+
+    args = parser.parse_args()
+
+    if args.compare:
+        slower = compare(load(args.compare[0]), load(args.compare[1]), args.threshold)
+
+        for op, c, a, b in slower:
+            print("{:8} {:8} {:>10.0f} -> {:>10.0f} ns {:>+8.1%}".format(op, c, a, b, b / a - 1))
+
+        print("{} regressions over {:.0%}".format(len(slower), args.threshold))
+        sys.exit(1 if slower else 0)
+
+    if args.repeat < 1 or args.samples < 1:
+        parser.error("Repeat and samples must be positive.")
+
+    results = run(args.samples, args.repeat, args.seed)
+    print(table(results, args.sort))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "machine": platform.machine(),
+                "samples": args.samples,
+                "repeat": args.repeat,
+                "seed": args.seed,
+                "ops": results,
+            }, f, indent=2)
+            f.write("\n")
@@ -0,0 +1,24 @@
+;
+; Bubble sort, ascending, of the $a1 signed words at $a0.
+;
+
+    addi    $t0, $a1, -1        ; compares per pass
+outer:
+    blez    $t0, end
+    add     $t1, $zero, $a0
+    add     $t2, $zero, $t0
+inner:
+    lw      $t3, 0($t1)
+    lw      $t4, 4($t1)
+    slt     $t5, $t4, $t3
+    beq     $t5, $zero, noswap
+    sw      $t4, 0($t1)
+    sw      $t3, 4($t1)
+noswap:
+    addi    $t1, $t1, 4
+    addi    $t2, $t2, -1
+    bgtz    $t2, inner
+    addi    $t0, $t0, -1
+    j       outer
+end:
+    beq     $zero, $zero, end
@@ -0,0 +1,30 @@
+;
+; Bitwise CRC-32 (as zlib.crc32) of the $a1 bytes at $a0.
+; $v0 = crc
+;
+
+    lui     $s0, 0xedb8
+    ori     $s0, $s0, 0x8320    ; reflected polynomial
+    addi    $s1, $zero, -1
+    add     $v0, $zero, $s1
+    blez    $a1, finish
+byte:
+    lb      $t0, 0($a0)
+    andi    $t0, $t0, 0xff
+    xor     $v0, $v0, $t0
+    addi    $t1, $zero, 8
+shift:
+    andi    $t2, $v0, 1
+    srl     $v0, $v0, 1
+    beq     $t2, $zero, next
+    xor     $v0, $v0, $s0
+next:
+    addi    $t1, $t1, -1
+    bgtz    $t1, shift
+    addi    $a0, $a0, 1
+    addi    $a1, $a1, -1
+    bgtz    $a1, byte
+finish:
+    xor     $v0, $v0, $s1
+end:
+    beq     $zero, $zero, end
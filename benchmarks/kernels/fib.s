@@ -0,0 +1,34 @@
+;
+; Recursive Fibonacci, with the stack at $sp.
+; $v0 = fib($a0)
+;
+; jal links to the instruction after next, hence the noops.
+;
+
+    jal     fib
+    noop
+end:
+    beq     $zero, $zero, end
+fib:
+    addi    $t0, $zero, 2
+    slt     $t1, $a0, $t0
+    beq     $t1, $zero, recurse
+    add     $v0, $zero, $a0
+    jr      $ra
+recurse:
+    addi    $sp, $sp, -12
+    sw      $ra, 0($sp)
+    sw      $a0, 4($sp)
+    addi    $a0, $a0, -1
+    jal     fib
+    noop
+    sw      $v0, 8($sp)
+    lw      $a0, 4($sp)
+    addi    $a0, $a0, -2
+    jal     fib
+    noop
+    lw      $t0, 8($sp)
+    add     $v0, $v0, $t0
+    lw      $ra, 0($sp)
+    addi    $sp, $sp, 12
+    jr      $ra
@@ -0,0 +1,17 @@
+;
+; Nested counting loops, like test.s.
+; $v0 = $a0 * $a1
+;
+
+    xor     $v0, $v0, $v0
+    add     $t3, $zero, $a0
+outer:
+    add     $t1, $zero, $a1
+inner:
+    addi    $v0, $v0, 1
+    addi    $t1, $t1, -1
+    bne     $t1, $zero, inner
+    addi    $t3, $t3, -1
+    bne     $t3, $zero, outer
+end:
+    beq     $zero, $zero, end
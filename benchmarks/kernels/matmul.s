@@ -0,0 +1,38 @@
+;
+; Integer matrix multiply of $a3 x $a3 word matrices, C = A B, modulo 2^32.
+; A at $a0, B at $a1 and C at $a2, row major.
+;
+
+    sll     $s7, $a3, 2         ; bytes per row
+    add     $s0, $zero, $zero   ; i
+    add     $s3, $zero, $a0     ; &A[i][0]
+    add     $s5, $zero, $a2     ; &C[i][0]
+row:
+    add     $s1, $zero, $zero   ; j
+col:
+    add     $t0, $zero, $s3     ; &A[i][k]
+    sll     $t1, $s1, 2
+    add     $t1, $t1, $a1       ; &B[k][j]
+    add     $t2, $zero, $a3
+    add     $v0, $zero, $zero
+dot:
+    lw      $t3, 0($t0)
+    lw      $t4, 0($t1)
+    mult    $t3, $t4
+    mflo    $t5
+    addu    $v0, $v0, $t5
+    addi    $t0, $t0, 4
+    add     $t1, $t1, $s7
+    addi    $t2, $t2, -1
+    bgtz    $t2, dot
+    sll     $t6, $s1, 2
+    add     $t6, $t6, $s5
+    sw      $v0, 0($t6)
+    addi    $s1, $s1, 1
+    bne     $s1, $a3, col
+    add     $s3, $s3, $s7
+    add     $s5, $s5, $s7
+    addi    $s0, $s0, 1
+    bne     $s0, $a3, row
+end:
+    beq     $zero, $zero, end
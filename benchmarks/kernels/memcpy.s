@@ -0,0 +1,21 @@
+;
+; Copy $a2 bytes from $a1 to $a0, four words at a time.
+; Both addresses word aligned and $a2 a multiple of 16.
+;
+
+    blez    $a2, end
+copy:
+    lw      $t0, 0($a1)
+    lw      $t1, 4($a1)
+    lw      $t2, 8($a1)
+    lw      $t3, 12($a1)
+    sw      $t0, 0($a0)
+    sw      $t1, 4($a0)
+    sw      $t2, 8($a0)
+    sw      $t3, 12($a0)
+    addi    $a1, $a1, 16
+    addi    $a0, $a0, 16
+    addi    $a2, $a2, -16
+    bgtz    $a2, copy
+end:
+    beq     $zero, $zero, end
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+# End-to-end simulator benchmark.
+#
+# Assembles each kernel in kernels/, runs it from a fresh processor with its
+# inputs in registers and memory, checks the result against Python and
+# reports instructions per second, wall time and peak RSS as JSON. Timings
+# are the best of --repeat runs and cover execute_prog only, not assembly
+# or setup. Peak RSS is the process's so far, so it only grows from one
+# kernel to the next.
+
+from collections import namedtuple
+import argparse
+import json
+import os.path
+import platform
+import resource
+import sys
+import time
+import zlib
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mips_sim import MIPSR, StopReason, backends
+from mips_assembler import assemble
+
+kernel_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "kernels")
+
+# Code at 0, data above it and the stack at the top.
+mem_size = 0x100000
+data = 0x10000
+
+Kernel = namedtuple("Kernel", ["name", "setup"])
+
+
+def arg(p, name, value):
+    p.reg[MIPSR[name].value] = value
+
+
+def result(p):
+    return int(p.reg[MIPSR.V0.value])
+
+
+def words(p, addr, n):
+    return p.mem[addr:addr + 4 * n].view('uint32')
+
+
+# Each setup writes a kernel's inputs for a problem of the given scale (1 is
+# a few hundred thousand instructions) and returns a check of the result.
+
+def setup_loops(p, scale):
+    a, b = 200, max(1, int(400 * scale))
+    arg(p, "A0", a)
+    arg(p, "A1", b)
+
+    return lambda p: result(p) == a * b
+
+
+def setup_bubble(p, scale):
+    n = max(2, int(200 * scale ** 0.5))
+    values = np.random.RandomState(1).randint(-1000, 1000, n).astype(np.int32)
+    p.mem[data:data + 4 * n] = values.view('uint8')
+    arg(p, "A0", data)
+    arg(p, "A1", n)
+
+    return lambda p: (words(p, data, n).view(np.int32) == np.sort(values)).all()
+
+
+def setup_matmul(p, scale):
+    n = max(1, int(30 * scale ** (1 / 3)))
+    rng = np.random.RandomState(2)
+    a = rng.randint(0, 1 << 16, (n, n)).astype(np.uint32)
+    b = rng.randint(0, 1 << 16, (n, n)).astype(np.uint32)
+    c = data + 8 * n * n
+    p.mem[data:data + 4 * n * n] = a.view('uint8').ravel()
+    p.mem[data + 4 * n * n:c] = b.view('uint8').ravel()
+    arg(p, "A0", data)
+    arg(p, "A1", data + 4 * n * n)
+    arg(p, "A2", c)
+    arg(p, "A3", n)
+
+    expected = (a.astype(np.uint64) @ b.astype(np.uint64)) & 0xffffffff
+
+    return lambda p: (words(p, c, n * n) == expected.ravel()).all()
+
+
+def setup_crc32(p, scale):
+    n = max(1, int(4096 * scale))
+    buf = np.random.RandomState(3).randint(0, 256, n).astype(np.uint8)
+    p.mem[data:data + n] = buf
+    arg(p, "A0", data)
+    arg(p, "A1", n)
+
+    return lambda p: result(p) == zlib.crc32(buf.tobytes())
+
+
+def setup_fib(p, scale):
+    n = max(1, 20 + int(round(np.log(scale) / np.log(1.618))))
+    arg(p, "A0", n)
+    arg(p, "SP", mem_size)
+
+    a, b = 0, 1
+
+    for i in range(n):
+        a, b = b, a + b
+
+    return lambda p: result(p) == a
+
+
+def setup_memcpy(p, scale):
+    n = max(16, int(0x40000 * scale) // 16 * 16)
+    src = np.random.RandomState(4).randint(0, 256, n).astype(np.uint8)
+    dst = data + n
+    p.mem[data:dst] = src
+    arg(p, "A0", dst)
+    arg(p, "A1", data)
+    arg(p, "A2", n)
+
+    return lambda p: (p.mem[dst:dst + n] == src).all()
+
+
+kernels = [
+    Kernel("loops", setup_loops),
+    Kernel("bubble", setup_bubble),
+    Kernel("matmul", setup_matmul),
+    Kernel("crc32", setup_crc32),
+    Kernel("fib", setup_fib),
+    Kernel("memcpy", setup_memcpy),
+]
+
+
+def peak_rss_kb():
+    # ru_maxrss is in KiB on Linux but bytes on macOS.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def run_kernel(kernel, backend="numpy", translate=False, scale=1.0, repeat=1):
+    # Returns the kernel's results as a dict, see main.
+    with open(os.path.join(kernel_dir, kernel.name + ".s")) as f:
+        image, _ = assemble(f, base=0)
+
+    best = None
+    ok = True
+
+    for i in range(repeat):
+        p = backends[backend](mem_size)
+        p.load_program(0, image)
+        check = kernel.setup(p, scale)
+
+        t = time.perf_counter()
+        res = p.execute_prog(0, -1, translate, halt=True)
+        t = time.perf_counter() - t
+
+        ok = ok and res.reason == StopReason.HALT and bool(check(p))
+        best = t if best is None else min(best, t)
+
+    return {
+        "name": kernel.name,
+        "instructions": res.count,
+        "seconds": best,
+        "mips": res.count / best / 1e6,
+        "ok": ok,
+        "peak_rss_kb": peak_rss_kb(),
+    }
+
+
+def main(args):
+    chosen = [k for k in kernels if not args.kernels or k.name in args.kernels]
+    results = []
+
+    for k in chosen:
+        r = run_kernel(k, args.backend, args.translate, args.scale, args.repeat)
+        results.append(r)
+        print("{:8} {:>10} instrs {:>8.3f} s {:>8.3f} MIPS {}".format(
+            r["name"], r["instructions"], r["seconds"], r["mips"], "ok" if r["ok"] else "WRONG"), file=sys.stderr)
+
+    report = {
+        "backend": args.backend,
+        "translate": args.translate,
+        "scale": args.scale,
+        "repeat": args.repeat,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "kernels": results,
+        "peak_rss_kb": peak_rss_kb(),
+    }
+
+    out = json.dumps(report, indent=2)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(out + "\n")
+    else:
+        print(out)
+
+    return all(r["ok"] for r in results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='MIPS kernel benchmarks',
+                                     description='')
+    parser.add_argument('kernels', nargs='*',
+                        help='Kernels to run, all by default: {}.'.format(", ".join(k.name for k in kernels)))
+    parser.add_argument('-b', '--backend', choices=sorted(backends), dest='backend', default='numpy',
+                        help='Processor implementation.')
+    parser.add_argument('-t', '--translate', action='store_true', dest='translate', default=False,
+                        help='Run with the block translator.')
+    parser.add_argument('-s', '--scale', type=float, dest='scale', default=1.0,
+                        help='Problem size, 1 is a few hundred thousand instructions a kernel.')
+    parser.add_argument('-n', '--repeat', type=int, dest='repeat', default=1,
+                        help='Runs per kernel, the fastest is reported.')
+    parser.add_argument('-o', '--output', dest='output', default=None,
+                        help='Write the JSON report here instead of stdout.')
+
+    args = parser.parse_args()
+
+    if args.scale <= 0 or args.repeat < 1:
+        parser.error("Scale and repeat must be positive.")
+
+    for name in args.kernels:
+        if name not in [k.name for k in kernels]:
+            parser.error("No kernel {}.".format(name))
+
+    sys.exit(0 if main(args) else 1)
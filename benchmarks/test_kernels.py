@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+
+# Checks the benchmark kernels at a small scale, so a kernel that stops
+# computing the right thing is caught before it skews a benchmark. Run it
+# from this directory, or through the test runner from the repository root.
+
+import unittest
+
+import run_benchmarks
+
+
+class TestKernels(unittest.TestCase):
+
+    def test_kernels(self):
+
+        for k in run_benchmarks.kernels:
+            for backend, translate in [("numpy", False), ("int", True)]:
+                r = run_benchmarks.run_kernel(k, backend, translate, scale=0.01)
+
+                self.assertTrue(r["ok"], k.name)
+                self.assertGreater(r["instructions"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
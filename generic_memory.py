@@ -1,6 +1,308 @@
 #!/usr/bin/env python3
 
+from collections import namedtuple
+import os
+
 import numpy as np
 
+PAGE_BITS = 12
+PAGE_SIZE = 1 << PAGE_BITS
+PAGE_MASK = PAGE_SIZE - 1
+
+ADDR_MASK = 0xffffffff
+
+PageMap = namedtuple("PageMap", ["pages", "words", "fill_value"])
+
+# Read-only maps of binary files, shared by everything that loads the same
+# unchanged file. Only the most recently used max_mapped_files are kept,
+# maps still in use by an MMem stay alive through its pages.
+mapped_files = {}
+max_mapped_files = 16
+
+
+def map_file(path):
+    # Map a file read-only as a uint8 array.
+    st = os.stat(path)
+    key = (os.path.realpath(path), st.st_size, st.st_mtime_ns)
+    m = mapped_files.pop(key, None)
+
+    if m is None:
+        if st.st_size == 0:
+            m = np.zeros(0, dtype=np.uint8)
+        else:
+            m = np.memmap(path, dtype=np.uint8, mode='r')
+
+        m = np.asarray(m)
+
+        while len(mapped_files) >= max_mapped_files:
+            del mapped_files[next(iter(mapped_files))]
+
+    # Reinserted, so the dict is in least recently used order.
+    mapped_files[key] = m
+
+    return m
+
+
+def as_image(program):
+    # A uint8 array over a program given as an array, a buffer or a path,
+    # without copying it.
+    if isinstance(program, (str, os.PathLike)):
+        return map_file(program)
+
+    if isinstance(program, np.ndarray):
+        if program.dtype != np.uint8:
+            raise ValueError()
+
+        return program
+
+    try:
+        return np.frombuffer(program, dtype=np.uint8)
+    except TypeError:
+        raise ValueError()
+
+
 class MMem:
-    pass
\ No newline at end of file
+    # Sparse byte addressed memory covering the whole 32 bit address space.
+    #
+    # Memory is split into 4 KiB pages that are only allocated the first time
+    # they are written; reading an untouched page gives the fill value without
+    # allocating anything. Addresses wrap at 32 bits.
+    #
+    # Indexing follows the flat uint8 arrays the processor used to hold, so
+    # mem[a] is an np.uint8 and mem[a:b] an np.ndarray, and either can be
+    # assigned to. Slices are always copies, writes have to go through
+    # __setitem__ or write. The word and byte accessors skip the slice
+    # handling and are the fast path for single accesses.
+    #
+    # pages and words hold every page for reading. A page can be a view of
+    # someone else's buffer (see map) or be part of a snapshot, so only the
+    # pages in wpages/wwords may be written in place. Anything else is copied
+    # on its first write. A page that has been handed out is therefore never
+    # modified again, and comparing page objects is enough to tell whether
+    # their contents can differ.
+
+    def __init__(self):
+        self.pages = {}
+        self.words = {}
+        self.wpages = {}
+        self.wwords = {}
+        self.fill_value = 0
+
+    def __len__(self):
+        return ADDR_MASK + 1
+
+    def __repr__(self):
+        return "MMem({} pages)".format(len(self.pages))
+
+    def page(self, n):
+        # The page with number n ready for writing, allocating it if it has
+        # not been touched and copying it if it is shared.
+        p = self.wpages.get(n)
+
+        if p is None:
+            old = self.pages.get(n)
+
+            if old is None:
+                p = np.full(PAGE_SIZE, self.fill_value, dtype=np.uint8)
+            else:
+                p = old.copy()
+
+            self.pages[n] = self.wpages[n] = p
+            self.words[n] = self.wwords[n] = p.view(np.uint32)
+
+        return p
+
+    def fill(self, value):
+        # Set every byte to value, dropping all allocated pages.
+        self.pages.clear()
+        self.words.clear()
+        self.wpages.clear()
+        self.wwords.clear()
+        self.fill_value = int(value) & 0xff
+
+    def snapshot(self):
+        # Capture the current contents. Costs a dict copy of the page table,
+        # the pages themselves are shared until either side writes to them.
+        self.wpages.clear()
+        self.wwords.clear()
+
+        return PageMap(dict(self.pages), dict(self.words), self.fill_value)
+
+    def restore(self, snap):
+        # Return to a snapshot, giving the set of page numbers whose contents
+        # may have changed since it was taken, or None for all of them.
+        pages = self.pages
+        old = snap.pages
+
+        changed = {n for n in pages if old.get(n) is not pages[n]}
+        changed.update(n for n in old if n not in pages)
+
+        self.pages = dict(old)
+        self.words = dict(snap.words)
+        self.wpages = {}
+        self.wwords = {}
+
+        if snap.fill_value != self.fill_value:
+            self.fill_value = snap.fill_value
+            changed = None
+
+        return changed
+
+    def map(self, addr, data):
+        # Place a uint8 array at addr. If data is read-only, whole pages of it
+        # become views of data rather than copies, so a file map is never read
+        # up front and can be shared by any number of MMems. Writable data is
+        # copied first, since the caller could change it behind our back. The
+        # partial pages at either end are copied in.
+        addr &= ADDR_MASK
+
+        if data.flags.writeable:
+            data = data.copy()
+            data.flags.writeable = False
+
+        end = addr + len(data)
+
+        lo = min(end, (addr + PAGE_MASK) & ~PAGE_MASK)
+        hi = max(lo, end & ~PAGE_MASK)
+
+        self.write(addr, data[:lo - addr])
+
+        for a in range(lo, hi, PAGE_SIZE):
+            n = (a >> PAGE_BITS) & (ADDR_MASK >> PAGE_BITS)
+            p = data[a - addr:a - addr + PAGE_SIZE]
+
+            self.pages[n] = p
+            self.words[n] = p.view(np.uint32)
+            self.wpages.pop(n, None)
+            self.wwords.pop(n, None)
+
+        self.write(hi, data[hi - addr:])
+
+    def allocated(self, start=0, end=None):
+        # Yield (address, length) for the allocated parts of [start, end), in
+        # address order.
+        if end is None:
+            end = ADDR_MASK + 1
+
+        for n in sorted(self.pages):
+            lo = max(start, n << PAGE_BITS)
+            hi = min(end, (n + 1) << PAGE_BITS)
+
+            if lo < hi:
+                yield lo, hi - lo
+
+    def __getitem__(self, key):
+        if type(key) is slice:
+            start, stop = self.span(key)
+            return self.read(start, stop - start)
+
+        addr = int(key) & ADDR_MASK
+        p = self.pages.get(addr >> PAGE_BITS)
+
+        if p is None:
+            return np.uint8(self.fill_value)
+
+        return p[addr & PAGE_MASK]
+
+    def __setitem__(self, key, value):
+        if type(key) is slice:
+            start, stop = self.span(key)
+            n = stop - start
+
+            if np.ndim(value) == 0:
+                value = np.full(n, value, dtype=np.uint8)
+            elif len(value) != n:
+                raise ValueError("could not broadcast {} bytes into {}".format(len(value), n))
+
+            self.write(start, value)
+            return
+
+        addr = int(key) & ADDR_MASK
+        self.page(addr >> PAGE_BITS)[addr & PAGE_MASK] = value
+
+    def span(self, key):
+        if key.step not in (None, 1):
+            raise ValueError("MMem slices must be contiguous.")
+
+        if key.start is None or key.stop is None:
+            raise ValueError("MMem slices need explicit bounds.")
+
+        start = int(key.start)
+        stop = int(key.stop)
+
+        return start, max(start, stop)
+
+    def read(self, addr, n):
+        # Copy n bytes starting at addr into a new uint8 array.
+        out = np.empty(n, dtype=np.uint8)
+        done = 0
+
+        while done < n:
+            a = (addr + done) & ADDR_MASK
+            off = a & PAGE_MASK
+            k = min(PAGE_SIZE - off, n - done)
+            p = self.pages.get(a >> PAGE_BITS)
+
+            if p is None:
+                out[done:done + k] = self.fill_value
+            else:
+                out[done:done + k] = p[off:off + k]
+
+            done += k
+
+        return out
+
+    def write(self, addr, data):
+        # Copy a buffer of bytes into memory starting at addr.
+        if type(data) in (bytes, bytearray, memoryview):
+            data = np.frombuffer(data, dtype=np.uint8)
+
+        n = len(data)
+        done = 0
+
+        while done < n:
+            a = (addr + done) & ADDR_MASK
+            off = a & PAGE_MASK
+            k = min(PAGE_SIZE - off, n - done)
+            self.page(a >> PAGE_BITS)[off:off + k] = data[done:done + k]
+            done += k
+
+    def load_byte(self, addr):
+        p = self.pages.get((addr & ADDR_MASK) >> PAGE_BITS)
+
+        if p is None:
+            return self.fill_value
+
+        return int(p[addr & PAGE_MASK])
+
+    def store_byte(self, addr, value):
+        addr &= ADDR_MASK
+        p = self.wpages.get(addr >> PAGE_BITS)
+
+        if p is None:
+            p = self.page(addr >> PAGE_BITS)
+
+        p[addr & PAGE_MASK] = value & 0xff
+
+    def load_word(self, addr):
+        # Little endian word at addr, unaligned reads take the slow path.
+        if addr & 3:
+            return int(self.read(addr, 4).view(np.uint32)[0])
+
+        w = self.words.get((addr & ADDR_MASK) >> PAGE_BITS)
+
+        if w is None:
+            return self.fill_value * 0x01010101
+
+        return int(w[(addr & PAGE_MASK) >> 2])
+
+    def store_word(self, addr, value):
+        # Little endian word at a 4 byte aligned address.
+        addr &= ADDR_MASK
+        w = self.wwords.get(addr >> PAGE_BITS)
+
+        if w is None:
+            self.page(addr >> PAGE_BITS)
+            w = self.wwords[addr >> PAGE_BITS]
+
+        w[(addr & PAGE_MASK) >> 2] = value & 0xffffffff
@@ -1,13 +1,27 @@
 #!/usr/bin/env python3
 
-from mips_sim import CMDParse, Instr, MIPSR, MIPSI, IllegalInstructionError
+# Assembles the CMDParse syntax into a .bin for mips_sim.py.
+#
+# Labels may stand in for the offset of a branch or the target of j and jal.
+# Branches get the offset in words from the instruction after them, so they
+# work wherever the program is loaded. j and jal get the label's absolute
+# word address, as the simulator (like MIPS) takes their target, so a binary
+# only runs correctly at the base it was assembled for: --base, by default
+# 12 where mips_sim.py loads binaries. Jump labels used to be resolved as
+# relative offsets like branches, which jumped to the wrong place.
+
+from mips_sim import CMDParse
 import os.path
 import argparse
 import re
-import sys
+
+import numpy as np
 
 debug = False
 
+# Where mips_sim.py loads binaries, which absolute jump targets depend on.
+default_base = 12
+
 
 def dprint(s):
     if debug:
@@ -39,52 +53,96 @@ def remove_comments(file):
     return list(filter(None, out))
 
 
-def attempt_assemble(filename):
+def split_labels(lines):
+    # Separate "name:" lines from instructions. Returns the instructions and
+    # {name: index of the instruction it labels}.
+    label = re.compile('(.+):$')
+    label_dict = {}
+    label_less_prog = []
+
+    for l in lines:
+
+        m = label.match(l)
+        if m:
+            label_dict[m.group(1)] = len(label_less_prog)
+            continue
+
+        label_less_prog.append(l)
 
+    return label_less_prog, label_dict
+
+
+def read_labels(filename, base=0):
+    # {name: address} of the labels in an assembly file whose binary is
+    # loaded at base, e.g. for naming hot spots in a profile.
     with open(filename) as ifile:
-        in_file = ifile.readlines()
+        _, label_dict = split_labels(remove_comments(ifile.readlines()))
 
-    # 1st pass
-    in_file = remove_comments(in_file)
+    return {k: base + 4 * v for k, v in label_dict.items()}
+
+
+def resolve_labels(label_less_prog, label_dict, base=default_base):
+    # Replace labels with branch offsets, or with the word address j and
+    # jal need for a program loaded at base. Each operand is looked up in
+    # label_dict once, so this is linear in the size of the program however
+    # many labels there are.
+    prog = []
+    jump_base = base >> 2
 
-    out_file_name = os.path.splitext(filename)[0] + ".bin"
+    for i, l in enumerate(label_less_prog):
+        words = l.replace(",", " ").split()
+        found = False
 
-    with open(out_file_name, 'wb') as ofile:
-        print(in_file)
+        for n in range(1, len(words)):
+            v = label_dict.get(words[n])
 
-        label = re.compile('(.+):$')
-        label_dict = {}
-        label_less_prog = []
-        prog = []
+            if v is not None:
+                words[n] = str((jump_base + v) & 0x3ffffff if words[0] in CMDParse.cat_7 else v - i - 1)
+                found = True
 
-        # 2nd pass
-        for l in in_file:
+        if found:
+            l = "{} {}".format(words[0], ", ".join(words[1:]))
 
-            m = label.match(l)
-            if m:
-                print("Found label: {}".format(m.group(1)))
-                label_dict[m.group(1)] = len(label_less_prog)
-                continue
+        prog.append(l)
 
-            label_less_prog.append(l)
+    return prog
 
-        # 3rd pass
-        for i in range(len(label_less_prog)):
-            l = label_less_prog[i]
 
-            for k, v in label_dict.items():
-                if k in l.split():
-                    rel_jmp = int(v) - i - 1
-                    l = l.replace(k, "{}".format(rel_jmp))
+def assemble(source, base=default_base):
+    # Assemble source, a string or an iterable of lines, for loading at
+    # base. Returns the program as a uint8 array, ready for
+    # MIPSProcessor.load_program, and {label: address}.
+    if isinstance(source, str):
+        source = source.splitlines()
 
-            prog.append(l)
+    # 1st pass
+    lines = remove_comments(source)
+    dprint(lines)
+
+    # 2nd pass
+    label_less_prog, label_dict = split_labels(lines)
+
+    for k in label_dict:
+        dprint("Found label: {}".format(k))
+
+    # 3rd pass
+    prog = resolve_labels(label_less_prog, label_dict, base)
+
+    out = np.empty(len(prog), dtype=np.uint32)
 
-        for p in prog:
-            ofile.write(CMDParse.parse_cmd(p).bin)
+    for i, p in enumerate(prog):
+        out[i] = CMDParse.parse_cmd(p).bin
+
+    return out.view(np.uint8), {k: base + 4 * v for k, v in label_dict.items()}
+
+
+def attempt_assemble(filename, base=default_base):
+
+    with open(filename) as ifile:
+        image, _ = assemble(ifile.readlines(), base)
 
-        pass
+    image.tofile(os.path.splitext(filename)[0] + ".bin")
 
-    pass
 
 if __name__ == "__main__":
 
@@ -94,8 +152,11 @@ if __name__ == "__main__":
                         help="Files")
     parser.add_argument('-d', '--debug', action='store_true', dest='debug', default=False,
                         help='Debug mode.')
+    parser.add_argument('--base', type=lambda s: int(s, 0), dest='base', default=default_base,
+                        help='Load address, for j and jal targets.')
 
     args = parser.parse_args()
+    debug = args.debug
 
     if len(args.files) > 1:
         parser.error("Currently more than one assembly file is unsupported.")
@@ -104,6 +165,6 @@ if __name__ == "__main__":
         if not is_valid_file(f):
             parser.error("{} cannot be opened.".format(f))
 
-        attempt_assemble(f)
+        attempt_assemble(f, args.base)
 
-    print("Kappa")
+    dprint("Kappa")
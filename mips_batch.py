@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+
+# Lockstep execution of many copies of one program.
+#
+# BatchMIPSProcessor holds N independent guest states, one per lane: an
+# (N, 32) register file, (N,) HI/LO/PC and (N, mem_size) memory. Every step
+# the active lanes are grouped by PC and instruction word, each group's
+# instruction is decoded once, and its handler is applied to all of the
+# group's lanes with NumPy vector ops. Lanes that diverge at a branch simply
+# land in different groups on the next step.
+#
+# The handlers follow MIPSProcessor's semantics. A lane that traps is frozen
+# with its PC where MIPSProcessor would have left it, and the exception type
+# is recorded in trap. Out-of-range memory accesses trap as MemoryError.
+
+import numpy as np
+
+from mips_sim import Instr, MIPSI, MIPSR, IntegerOverflow, AddressError, SoftwareInterrupt,\
+    IllegalInstructionError, MIPSProcessor, s16
+
+M32 = np.uint32(0xffffffff)
+
+# Trap codes stored per lane. 0 means the lane hasn't trapped.
+trap_types = (None, IntegerOverflow, AddressError, SoftwareInterrupt, IllegalInstructionError, MemoryError)
+trap_codes = {t: i for i, t in enumerate(trap_types)}
+
+byte_offsets = np.arange(4)
+
+
+def as_signed(a):
+    # A uint32 array as signed values, widened so arithmetic can't wrap.
+    return a.astype(np.uint32).view(np.int32).astype(np.int64)
+
+
+class BatchMIPSProcessor:
+
+    def __init__(self, n, mem_size=1024):
+
+        self.n = n
+        self.reg = np.zeros((n, 32), dtype=np.uint32)
+        self.hi = np.zeros(n, dtype=np.uint32)
+        self.lo = np.zeros(n, dtype=np.uint32)
+        self.pc = np.zeros(n, dtype=np.uint32)
+        self.mem = np.zeros((n, mem_size), dtype=np.uint8)
+
+        self.active = np.ones(n, dtype=bool)
+        self.trap = np.zeros(n, dtype=np.int8)
+        self.instr_c = np.zeros(n, dtype=np.int64)
+
+        # (word) -> (handler, args), shared by every lane.
+        self.decoded = {}
+
+        self.ops = {
+            op: getattr(self, "_{}".format(op.name.lower())) for op in MIPSI
+        }
+
+    def load_program(self, start_addr, program, lanes=slice(None)):
+
+        if type(program) is not np.ndarray or program.dtype != np.uint8:
+            raise ValueError()
+
+        if start_addr + len(program) > self.mem.shape[1]:
+            raise MemoryError()
+
+        self.mem[lanes, start_addr:start_addr + len(program)] = program
+
+    def execute_prog(self, start_point, max_instr=-1):
+
+        self.pc[:] = start_point
+        self.reg[:, MIPSR.GP.value] = start_point
+        self.reg[:, MIPSR.FP.value] = start_point
+
+        return self.run(max_instr)
+
+    def run(self, max_instr=-1):
+        # Step every active lane until the budget runs out or all lanes have
+        # trapped. Returns the number of lockstep steps taken.
+        steps = 0
+
+        while (max_instr == -1 or steps < max_instr) and self.active.any():
+            self.step()
+            steps += 1
+
+        return steps
+
+    def step(self):
+
+        lanes = np.flatnonzero(self.active)
+
+        if len(lanes) == 0:
+            return
+
+        pcs = self.pc[lanes]
+
+        if pcs.min() == pcs.max():
+            self.step_group(lanes, int(pcs[0]))
+            return
+
+        upcs, inv = np.unique(pcs, return_inverse=True)
+
+        for k, pc in enumerate(upcs):
+            self.step_group(lanes[inv == k], int(pc))
+
+    def step_group(self, lanes, pc):
+        # All lanes here share a PC, but their memory (and so the word at
+        # that PC) might not be the same.
+        if pc + 4 > self.mem.shape[1]:
+            self.trap_lanes(lanes, MemoryError)
+            return
+
+        words = self.mem[lanes, pc:pc + 4].copy().view(np.uint32)[:, 0]
+
+        if words.min() == words.max():
+            self.dispatch(lanes, words[0])
+            return
+
+        uwords, inv = np.unique(words, return_inverse=True)
+
+        for k, w in enumerate(uwords):
+            self.dispatch(lanes[inv == k], w)
+
+    def dispatch(self, lanes, word):
+
+        entry = self.decoded.get(int(word))
+
+        if entry is None:
+            try:
+                i = Instr.decode(np.uint32(word))
+            except IllegalInstructionError:
+                self.trap_lanes(lanes, IllegalInstructionError)
+                return
+
+            entry = (self.ops[i._op], [int(a) for a in i.args])
+            self.decoded[int(word)] = entry
+
+        done = entry[0](lanes, *entry[1])
+
+        # Handlers return the lanes that retired when some of them trapped.
+        self.instr_c[lanes if done is None else done] += 1
+
+    def trap_lanes(self, lanes, exc):
+        self.active[lanes] = False
+        self.trap[lanes] = trap_codes[exc]
+
+    def traps(self):
+        # Exception type per lane, None where the lane didn't trap.
+        return [trap_types[t] for t in self.trap]
+
+    def lane(self, i):
+        # Copy one lane's state into a MIPSProcessor, e.g. to cross check it.
+        p = MIPSProcessor(self.mem.shape[1])
+        p.reg[:] = self.reg[i]
+        p.hi = self.hi[i]
+        p.lo = self.lo[i]
+        p.pc = self.pc[i]
+        p.mem[:] = self.mem[i]
+
+        return p
+
+    def advance(self, lanes):
+        self.pc[lanes] += np.uint32(4)
+
+    def split(self, lanes, bad, exc):
+        # Trap the lanes flagged in bad, returning the ones that carry on.
+        if bad.any():
+            self.trap_lanes(lanes[bad], exc)
+            return lanes[~bad]
+
+        return None
+
+    def addresses(self, lanes, rs, offset, size):
+        # Effective addresses for a load/store, trapping lanes that run off
+        # the end of memory.
+        addr = self.reg[lanes, rs].astype(np.int64) + s16(offset)
+        ok = (addr >= 0) & (addr + size <= self.mem.shape[1])
+
+        if not ok.all():
+            self.trap_lanes(lanes[~ok], MemoryError)
+            return lanes[ok], addr[ok], lanes[ok]
+
+        return lanes, addr, None
+
+    def branch(self, lanes, taken, offset):
+        self.pc[lanes] += np.uint32(4)
+        self.pc[lanes[taken]] += np.uint32((s16(offset) * 4) & 0xffffffff)
+
+    def _add(self, lanes, rd, rs, rt):
+        self.advance(lanes)
+        res = as_signed(self.reg[lanes, rs]) + as_signed(self.reg[lanes, rt])
+        bad = (res < -0x80000000) | (res > 0x7fffffff)
+
+        done = self.split(lanes, bad, IntegerOverflow)
+        self.reg[lanes[~bad], rd] = res[~bad].astype(np.uint32)
+
+        return done
+
+    def _addi(self, lanes, rt, rs, imm):
+        self.advance(lanes)
+        res = as_signed(self.reg[lanes, rs]) + s16(imm)
+        bad = (res < -0x80000000) | (res > 0x7fffffff)
+
+        done = self.split(lanes, bad, IntegerOverflow)
+        self.reg[lanes[~bad], rt] = res[~bad].astype(np.uint32)
+
+        return done
+
+    def _addiu(self, lanes, rt, rs, imm):
+        self.advance(lanes)
+        self.reg[lanes, rt] = self.reg[lanes, rs] + np.uint32(s16(imm) & 0xffffffff)
+
+    def _addu(self, lanes, rd, rs, rt):
+        self.advance(lanes)
+        self.reg[lanes, rd] = self.reg[lanes, rs] + self.reg[lanes, rt]
+
+    def _and(self, lanes, rd, rs, rt):
+        self.advance(lanes)
+        self.reg[lanes, rd] = self.reg[lanes, rs] & self.reg[lanes, rt]
+
+    def _andi(self, lanes, rt, rs, imm):
+        self.advance(lanes)
+        self.reg[lanes, rt] = self.reg[lanes, rs] & np.uint32(imm)
+
+    def _beq(self, lanes, rs, rt, offset):
+        self.branch(lanes, self.reg[lanes, rs] == self.reg[lanes, rt], offset)
+
+    def _bgez(self, lanes, rs, offset):
+        self.branch(lanes, self.reg[lanes, rs] < 0x80000000, offset)
+
+    def _bgezal(self, lanes, rs, offset):
+        taken = self.reg[lanes, rs] < 0x80000000
+        self.reg[lanes[taken], 31] = self.pc[lanes[taken]] + np.uint32(8)
+        self.branch(lanes, taken, offset)
+
+    def _bgtz(self, lanes, rs, offset):
+        self.branch(lanes, as_signed(self.reg[lanes, rs]) > 0, offset)
+
+    def _blez(self, lanes, rs, offset):
+        self.branch(lanes, as_signed(self.reg[lanes, rs]) <= 0, offset)
+
+    def _bltz(self, lanes, rs, offset):
+        self.branch(lanes, self.reg[lanes, rs] >= 0x80000000, offset)
+
+    def _bltzal(self, lanes, rs, offset):
+        taken = self.reg[lanes, rs] >= 0x80000000
+        self.reg[lanes[taken], 31] = self.pc[lanes[taken]] + np.uint32(8)
+        self.branch(lanes, taken, offset)
+
+    def _bne(self, lanes, rs, rt, offset):
+        self.branch(lanes, self.reg[lanes, rs] != self.reg[lanes, rt], offset)
+
+    def _div(self, lanes, rs, rt):
+        # Quotient truncates toward zero, the remainder takes the sign of the
+        # divisor, and division by zero zeroes HI/LO, as in MIPSProcessor.
+        self.advance(lanes)
+        a = as_signed(self.reg[lanes, rs])
+        b = as_signed(self.reg[lanes, rt])
+        zero = b == 0
+        b = np.where(zero, 1, b)
+
+        q = np.abs(a) // np.abs(b)
+        q = np.where((a < 0) != (b < 0), -q, q)
+
+        self.lo[lanes] = np.where(zero, 0, q).astype(np.uint32)
+        self.hi[lanes] = np.where(zero, 0, np.mod(a, b)).astype(np.uint32)
+
+    def _divu(self, lanes, rs, rt):
+        self.advance(lanes)
+        a = self.reg[lanes, rs]
+        b = self.reg[lanes, rt]
+        zero = b == 0
+        b = np.where(zero, np.uint32(1), b)
+
+        self.lo[lanes] = np.where(zero, np.uint32(0), a // b)
+        self.hi[lanes] = np.where(zero, np.uint32(0), a % b)
+
+    def _j(self, lanes, target):
+        self.pc[lanes] = (self.pc[lanes] & np.uint32(0xf0000000)) | np.uint32((target * 4) & 0xffffffff)
+
+    def _jal(self, lanes, target):
+        self.reg[lanes, 31] = self.pc[lanes] + np.uint32(8)
+        self._j(lanes, target)
+
+    def _jr(self, lanes, rs):
+        dest = self.reg[lanes, rs]
+        bad = dest % 4 != 0
+
+        done = self.split(lanes, bad, AddressError)
+        self.pc[lanes[~bad]] = dest[~bad]
+
+        return done
+
+    def _lb(self, lanes, rt, offset, rs):
+        self.advance(lanes)
+        lanes, addr, done = self.addresses(lanes, rs, offset, 1)
+
+        self.reg[lanes, rt] = self.mem[lanes, addr].view(np.int8).astype(np.int32).view(np.uint32)
+
+        return done
+
+    def _lui(self, lanes, rt, imm):
+        self.advance(lanes)
+        self.reg[lanes, rt] = np.uint32((imm << 16) & 0xffffffff)
+
+    def _lw(self, lanes, rt, offset, rs):
+        self.advance(lanes)
+        lanes, addr, done = self.addresses(lanes, rs, offset, 4)
+
+        data = self.mem[lanes[:, None], addr[:, None] + byte_offsets]
+        self.reg[lanes, rt] = data.view(np.uint32)[:, 0]
+
+        return done
+
+    def _mfhi(self, lanes, rd):
+        self.advance(lanes)
+        self.reg[lanes, rd] = self.hi[lanes]
+
+    def _mflo(self, lanes, rd):
+        self.advance(lanes)
+        self.reg[lanes, rd] = self.lo[lanes]
+
+    def _mult(self, lanes, rs, rt):
+        self.advance(lanes)
+        res = as_signed(self.reg[lanes, rs]) * as_signed(self.reg[lanes, rt])
+        self.hi[lanes] = (res >> 32).astype(np.uint32)
+        self.lo[lanes] = res.astype(np.uint32)
+
+    def _multu(self, lanes, rs, rt):
+        self.advance(lanes)
+        res = self.reg[lanes, rs].astype(np.uint64) * self.reg[lanes, rt].astype(np.uint64)
+        self.hi[lanes] = (res >> np.uint64(32)).astype(np.uint32)
+        self.lo[lanes] = res.astype(np.uint32)
+
+    def _noop(self, lanes):
+        self.advance(lanes)
+
+    def _or(self, lanes, rd, rs, rt):
+        self.advance(lanes)
+        self.reg[lanes, rd] = self.reg[lanes, rs] | self.reg[lanes, rt]
+
+    def _ori(self, lanes, rt, rs, imm):
+        self.advance(lanes)
+        self.reg[lanes, rt] = self.reg[lanes, rs] | np.uint32(imm)
+
+    def _sb(self, lanes, rt, offset, rs):
+        lanes, addr, done = self.addresses(lanes, rs, offset, 1)
+
+        self.mem[lanes, addr] = self.reg[lanes, rt].astype(np.uint8)
+        self.advance(lanes)
+
+        return done
+
+    def _sll(self, lanes, rd, rt, shamt):
+        self.advance(lanes)
+        self.reg[lanes, rd] = self.reg[lanes, rt] << np.uint32(shamt)
+
+    def _sllv(self, lanes, rd, rt, rs):
+        self.advance(lanes)
+        self.reg[lanes, rd] = self.reg[lanes, rt] << (self.reg[lanes, rs] & np.uint32(0b11111))
+
+    def _slt(self, lanes, rd, rs, rt):
+        self.advance(lanes)
+        self.reg[lanes, rd] = as_signed(self.reg[lanes, rs]) < as_signed(self.reg[lanes, rt])
+
+    def _slti(self, lanes, rt, rs, imm):
+        self.advance(lanes)
+        self.reg[lanes, rt] = as_signed(self.reg[lanes, rs]) < s16(imm)
+
+    def _sltiu(self, lanes, rt, rs, imm):
+        self.advance(lanes)
+        self.reg[lanes, rt] = self.reg[lanes, rs] < np.uint32(s16(imm) & 0xffffffff)
+
+    def _sltu(self, lanes, rd, rs, rt):
+        self.advance(lanes)
+        self.reg[lanes, rd] = self.reg[lanes, rs] < self.reg[lanes, rt]
+
+    def _sra(self, lanes, rd, rt, shamt):
+        self.advance(lanes)
+        self.reg[lanes, rd] = (as_signed(self.reg[lanes, rt]) >> shamt).astype(np.uint32)
+
+    def _srl(self, lanes, rd, rt, shamt):
+        self.advance(lanes)
+        self.reg[lanes, rd] = self.reg[lanes, rt] >> np.uint32(shamt)
+
+    def _srlv(self, lanes, rd, rt, rs):
+        self.advance(lanes)
+        self.reg[lanes, rd] = self.reg[lanes, rt] >> self.reg[lanes, rs]
+
+    def _sub(self, lanes, rd, rs, rt):
+        res = as_signed(self.reg[lanes, rs]) - as_signed(self.reg[lanes, rt])
+        bad = (res < -0x80000000) | (res > 0x7fffffff)
+
+        done = self.split(lanes, bad, IntegerOverflow)
+        ok = lanes[~bad]
+        self.reg[ok, rd] = res[~bad].astype(np.uint32)
+        self.advance(ok)
+
+        return done
+
+    def _subu(self, lanes, rd, rs, rt):
+        self.reg[lanes, rd] = self.reg[lanes, rs] - self.reg[lanes, rt]
+        self.advance(lanes)
+
+    def _sw(self, lanes, rt, offset, rs):
+        self.advance(lanes)
+        addr = self.reg[lanes, rs].astype(np.int64) + s16(offset)
+
+        done = self.split(lanes, addr % 4 != 0, AddressError)
+
+        if done is not None:
+            lanes = done
+
+        lanes, addr, short = self.addresses(lanes, rs, offset, 4)
+
+        if short is not None:
+            done = short
+
+        data = self.reg[lanes, rt].astype('<u4').view(np.uint8).reshape(-1, 4)
+        self.mem[lanes[:, None], addr[:, None] + byte_offsets] = data
+
+        return done
+
+    def _syscall(self, lanes):
+        self.advance(lanes)
+        self.trap_lanes(lanes, SoftwareInterrupt)
+
+        return lanes[:0]
+
+    def _xor(self, lanes, rd, rs, rt):
+        self.advance(lanes)
+        self.reg[lanes, rd] = self.reg[lanes, rs] ^ self.reg[lanes, rt]
+
+    def _xori(self, lanes, rt, rs, imm):
+        self.advance(lanes)
+        self.reg[lanes, rt] = self.reg[lanes, rs] ^ np.uint32(imm)
@@ -0,0 +1,520 @@
+#!/usr/bin/env python3
+
+# Basic block translator for MIPSProcessor.
+#
+# A basic block is a straight run of instructions ending at the first branch
+# or jump. Each block is turned into Python source with the register
+# operations inlined on a plain list of ints, compiled once and cached by
+# its start PC. Instructions that can't be translated (div, divu, syscall)
+# are handed back to the interpreter one at a time.
+
+from collections import defaultdict
+
+import numpy as np
+
+from generic_memory import MMem
+from mips_sim import Instr, IllegalInstructionError, IntegerOverflow, AddressError, SoftwareInterrupt, MIPSR, s16,\
+    StopReason, RunResult, control_ops, exit_syscalls
+
+M32 = 0xffffffff
+
+# Ops left to the interpreter.
+untranslatable = {
+    "div", "divu", "syscall",
+}
+
+
+def count_landings(landings, block, n, pc):
+    # Record where the branches or jumps ending the n instructions a block
+    # just ran landed, for the profiler. A block only returns partway
+    # through after a store into code.
+    k, part = divmod(n, block.length)
+
+    if part:
+        landings[block.start] += k
+    else:
+        landings[block.start] += k - 1
+        landings[pc] += 1
+
+
+def sx(expr):
+    # Sign interpretation of a 32 bit value held in an int.
+    return "(({} ^ 0x80000000) - 0x80000000)".format(expr)
+
+
+class Block:
+
+    def __init__(self, start, length, fn, source, control):
+        self.start = start
+        self.length = length
+        self.fn = fn
+        self.source = source
+
+        # Whether the block ends in a branch or jump.
+        self.control = control
+
+        # Address of the last instruction. A block that returns this as the
+        # next PC ended in a branch to itself.
+        self.last = start + 4 * (length - 1)
+
+
+class BlockTranslator:
+
+    max_block_len = 64
+
+    def __init__(self, proc):
+        self.proc = proc
+        self.blocks = {}
+        self.code_gen = proc.code_gen
+
+        # Stop conditions the cached blocks were translated for. Blocks end
+        # before any stop address, and self loops are only compiled into
+        # while loops when nothing needs checking between iterations.
+        self.stops = frozenset()
+        self.inline_loops = True
+        self.halt = False
+
+        # Paged memory has word and byte accessors that are much cheaper than
+        # going through its slice emulation.
+        self.paged = isinstance(proc.mem, MMem)
+
+    def flush(self):
+        self.blocks.clear()
+        self.code_gen = self.proc.code_gen
+
+    def fetch_decode(self, addr):
+        # Decode through the processor's cache so stores into translated code
+        # are noticed by the same invalidation path the interpreter uses.
+        p = self.proc
+
+        try:
+            word = np.uint32(p.mem[addr:addr + 4].view('uint32')[0])
+            instr = Instr.decode(word)
+        except (IllegalInstructionError, IndexError):
+            return None
+
+        if addr not in p.decoded:
+            p.decoded[addr] = p.decode_entry(instr.op, instr.args)
+
+        return instr
+
+    def translate(self, start):
+
+        instrs = []
+        addr = start
+
+        while len(instrs) < self.max_block_len:
+            if instrs and addr in self.stops:
+                break
+
+            instr = self.fetch_decode(addr)
+
+            if instr is None or instr.op in untranslatable:
+                break
+
+            instrs.append((addr, instr))
+            addr += 4
+
+            if instr.op in control_ops:
+                break
+
+        if not instrs:
+            self.blocks[start] = False
+            return False
+
+        source, fault_pcs = self.gen_source(start, instrs)
+
+        env = {
+            "np": np,
+            "IntegerOverflow": IntegerOverflow,
+            "AddressError": AddressError,
+            "D": self.proc.decoded,
+            "FAULT": tuple(fault_pcs),
+        }
+        exec(compile(source, "<block 0x{:08x}>".format(start), "exec"), env)
+
+        block = Block(start, len(instrs), env["block"], source, instrs[-1][1].op in control_ops)
+        self.blocks[start] = block
+
+        return block
+
+    def gen_source(self, start, instrs):
+
+        length = len(instrs)
+        last_addr, last = instrs[-1]
+        body = instrs
+        term = None
+
+        if last.op in control_ops:
+            body = instrs[:-1]
+            term = self.gen_terminator(last_addr, last)
+
+        # A conditional branch back to the top of its own block is emitted as
+        # a while loop so tight guest loops never leave the generated code.
+        self_loop = term is not None and term[0] is not None and term[1] == start
+        self_loop = self_loop and self.inline_loops and start not in self.stops
+        self_loop = self_loop and not (self.halt and length == 1)
+
+        fault_pcs = []
+        lines = []
+
+        for k, (a, instr) in enumerate(body):
+            fault_pc, stmts = getattr(self, "gen_" + instr.op)(a, k, *[int(x) for x in instr.args])
+            fault_pcs.append(fault_pc)
+
+            if fault_pc is not None:
+                lines.append("f = {}".format(k))
+
+            lines += stmts
+
+        if term is not None:
+            cond, target, link, pre = term
+            fault_pcs.append(last_addr)
+
+            if pre:
+                lines.append("f = {}".format(length - 1))
+                lines += pre
+        else:
+            cond, target, link = None, None, []
+
+        fall = (last_addr + 4) & M32
+
+        out = ["def block(r, p, M, budget):", "    f = 0", "    n = 0", "    try:"]
+
+        if self_loop:
+            out.append("        while True:")
+            out += ["            " + l for l in lines]
+            out.append("            n += {}".format(length))
+            out.append("            if {}:".format(cond))
+            out += ["                " + l for l in link]
+            out.append("                if budget != -1 and n + {} > budget:".format(length))
+            out.append("                    return {}, n".format(start))
+            out.append("                continue")
+            out.append("            return {}, n".format(fall))
+        else:
+            out += ["        " + l for l in lines]
+
+            if term is None:
+                out.append("        return {}, {}".format(fall, length))
+            elif cond is None:
+                out += ["        " + l for l in link]
+                out.append("        return {}, {}".format(target, length))
+            else:
+                out.append("        if {}:".format(cond))
+                out += ["            " + l for l in link]
+                out.append("            return {}, {}".format(target, length))
+                out.append("        return {}, {}".format(fall, length))
+
+        out.append("    except Exception:")
+        out.append("        p.pc = FAULT[f]")
+        out.append("        p.fault_retired = n + f")
+        out.append("        raise")
+
+        return "\n".join(out) + "\n", fault_pcs
+
+    def gen_terminator(self, a, instr):
+        # Returns (condition, target, link statements, pre statements).
+        # A condition of None means the transfer is unconditional.
+        args = [int(x) for x in instr.args]
+        op = instr.op
+        nxt = (a + 4) & M32
+
+        if op in ["j", "jal"]:
+            target = (a & 0xf0000000) | ((args[0] * 4) & M32)
+            link = ["r[31] = {}".format((a + 8) & M32)] if op == "jal" else []
+            return None, target, link, []
+
+        if op == "jr":
+            rs = args[0]
+            pre = ["if r[{}] % 4 != 0:".format(rs), "    raise AddressError()"]
+            return None, "r[{}]".format(rs), [], pre
+
+        if op in ["beq", "bne"]:
+            rs, rt, off = args
+            cmp = "==" if op == "beq" else "!="
+            cond = "r[{}] {} r[{}]".format(rs, cmp, rt)
+        else:
+            rs, off = args
+            cond = {
+                "bgez":     "r[{0}] < 0x80000000",
+                "bgezal":   "r[{0}] < 0x80000000",
+                "bgtz":     "0 < r[{0}] < 0x80000000",
+                "blez":     "(r[{0}] == 0 or r[{0}] >= 0x80000000)",
+                "bltz":     "r[{0}] >= 0x80000000",
+                "bltzal":   "r[{0}] >= 0x80000000",
+            }[op].format(rs)
+
+        target = (nxt + s16(off) * 4) & M32
+        link = ["r[31] = {}".format((a + 8) & M32)] if op in ["bgezal", "bltzal"] else []
+
+        return cond, target, link, []
+
+    # Each gen_<op> returns (pc to report if it faults, statements). The fault
+    # pc mirrors where the matching interpreter handler leaves self.pc.
+
+    def gen_add(self, a, k, rd, rs, rt):
+        return a + 4, [
+            "v = {} + {}".format(sx("r[{}]".format(rs)), sx("r[{}]".format(rt))),
+            "if not -0x80000000 <= v <= 0x7fffffff:",
+            "    raise IntegerOverflow()",
+            "r[{}] = v & 0xffffffff".format(rd),
+        ]
+
+    def gen_addi(self, a, k, rt, rs, imm):
+        return a + 4, [
+            "v = {} + {}".format(sx("r[{}]".format(rs)), s16(imm)),
+            "if not -0x80000000 <= v <= 0x7fffffff:",
+            "    raise IntegerOverflow()",
+            "r[{}] = v & 0xffffffff".format(rt),
+        ]
+
+    def gen_addiu(self, a, k, rt, rs, imm):
+        return None, ["r[{}] = (r[{}] + {}) & 0xffffffff".format(rt, rs, s16(imm))]
+
+    def gen_addu(self, a, k, rd, rs, rt):
+        return None, ["r[{}] = (r[{}] + r[{}]) & 0xffffffff".format(rd, rs, rt)]
+
+    def gen_and(self, a, k, rd, rs, rt):
+        return None, ["r[{}] = r[{}] & r[{}]".format(rd, rs, rt)]
+
+    def gen_andi(self, a, k, rt, rs, imm):
+        return None, ["r[{}] = r[{}] & {}".format(rt, rs, imm)]
+
+    def gen_lb(self, a, k, rt, off, rs):
+        load = "M.load_byte(r[{}] + {})" if self.paged else "int(M[r[{}] + {}])"
+
+        return a + 4, [
+            "v = " + load.format(rs, s16(off)),
+            "r[{}] = v | 0xffffff00 if v & 0x80 else v".format(rt),
+        ]
+
+    def gen_lui(self, a, k, rt, imm):
+        return None, ["r[{}] = {}".format(rt, (imm << 16) & M32)]
+
+    def gen_lw(self, a, k, rt, off, rs):
+        load = "M.load_word(v)" if self.paged else "int(M[v:v + 4].view('uint32')[0])"
+
+        return a + 4, [
+            "v = r[{}] + {}".format(rs, s16(off)),
+            "r[{}] = {}".format(rt, load),
+        ]
+
+    def gen_mfhi(self, a, k, rd):
+        return None, ["r[{}] = int(p.hi)".format(rd)]
+
+    def gen_mflo(self, a, k, rd):
+        return None, ["r[{}] = int(p.lo)".format(rd)]
+
+    def gen_mult(self, a, k, rs, rt):
+        return None, [
+            "v = {} * {}".format(sx("r[{}]".format(rs)), sx("r[{}]".format(rt))),
+            "p.hi = (v >> 32) & 0xffffffff",
+            "p.lo = v & 0xffffffff",
+        ]
+
+    def gen_multu(self, a, k, rs, rt):
+        return None, [
+            "v = r[{}] * r[{}]".format(rs, rt),
+            "p.hi = v >> 32",
+            "p.lo = v & 0xffffffff",
+        ]
+
+    def gen_noop(self, a, k):
+        return None, []
+
+    def gen_or(self, a, k, rd, rs, rt):
+        return None, ["r[{}] = r[{}] | r[{}]".format(rd, rs, rt)]
+
+    def gen_ori(self, a, k, rt, rs, imm):
+        return None, ["r[{}] = r[{}] | {}".format(rt, rs, imm)]
+
+    def gen_sb(self, a, k, rt, off, rs):
+        store = "M.store_byte(v, r[{}])" if self.paged else "M[v] = r[{}] & 0xff"
+
+        return a, [
+            "v = r[{}] + {}".format(rs, s16(off)),
+            store.format(rt),
+            "if D.pop(v & ~3, None) is not None:",
+            "    p.code_gen += 1",
+            "    return {}, n + {}".format((a + 4) & M32, k + 1),
+        ]
+
+    def gen_sll(self, a, k, rd, rt, shamt):
+        return None, ["r[{}] = (r[{}] << {}) & 0xffffffff".format(rd, rt, shamt)]
+
+    def gen_sllv(self, a, k, rd, rt, rs):
+        return None, ["r[{}] = (r[{}] << (r[{}] & 0x1f)) & 0xffffffff".format(rd, rt, rs)]
+
+    def gen_slt(self, a, k, rd, rs, rt):
+        return None, ["r[{}] = 1 if {} < {} else 0".format(rd, sx("r[{}]".format(rs)), sx("r[{}]".format(rt)))]
+
+    def gen_slti(self, a, k, rt, rs, imm):
+        return None, ["r[{}] = 1 if {} < {} else 0".format(rt, sx("r[{}]".format(rs)), s16(imm))]
+
+    def gen_sltiu(self, a, k, rt, rs, imm):
+        return None, ["r[{}] = 1 if r[{}] < {} else 0".format(rt, rs, s16(imm) & M32)]
+
+    def gen_sltu(self, a, k, rd, rs, rt):
+        return None, ["r[{}] = 1 if r[{}] < r[{}] else 0".format(rd, rs, rt)]
+
+    def gen_sra(self, a, k, rd, rt, shamt):
+        return None, ["r[{}] = ({} >> {}) & 0xffffffff".format(rd, sx("r[{}]".format(rt)), shamt)]
+
+    def gen_srl(self, a, k, rd, rt, shamt):
+        return None, ["r[{}] = r[{}] >> {}".format(rd, rt, shamt)]
+
+    def gen_srlv(self, a, k, rd, rt, rs):
+        return None, ["r[{}] = r[{}] >> r[{}]".format(rd, rt, rs)]
+
+    def gen_sub(self, a, k, rd, rs, rt):
+        return a, [
+            "v = {} - {}".format(sx("r[{}]".format(rs)), sx("r[{}]".format(rt))),
+            "if not -0x80000000 <= v <= 0x7fffffff:",
+            "    raise IntegerOverflow()",
+            "r[{}] = v & 0xffffffff".format(rd),
+        ]
+
+    def gen_subu(self, a, k, rd, rs, rt):
+        return None, ["r[{}] = (r[{}] - r[{}]) & 0xffffffff".format(rd, rs, rt)]
+
+    def gen_sw(self, a, k, rt, off, rs):
+        store = "M.store_word(v, r[{}])" if self.paged else "M[v:v + 4] = np.uint32([r[{}]]).view('uint8')"
+
+        return a + 4, [
+            "v = r[{}] + {}".format(rs, s16(off)),
+            "if v % 4 != 0:",
+            "    raise AddressError",
+            store.format(rt),
+            "if D.pop(v, None) is not None:",
+            "    p.code_gen += 1",
+            "    return {}, n + {}".format((a + 4) & M32, k + 1),
+        ]
+
+    def gen_xor(self, a, k, rd, rs, rt):
+        return None, ["r[{}] = r[{}] ^ r[{}]".format(rd, rs, rt)]
+
+    def gen_xori(self, a, k, rt, rs, imm):
+        return None, ["r[{}] = r[{}] ^ {}".format(rt, rs, imm)]
+
+    def run(self, max_instr=-1, halt=False, stop_at=(), until=None, syscall_exit=False, resume=False):
+        # Execute from the processor's current PC, see MIPSProcessor.run.
+        # Registers live in a list of ints while blocks run and are written
+        # back to the processor on the way out. halt and until are checked
+        # each time control comes back from a block.
+        p = self.proc
+        mem = p.mem
+        blocks = self.blocks
+
+        stop_at = frozenset(int(a) for a in stop_at)
+        options = (stop_at, until is None, halt)
+
+        if options != (self.stops, self.inline_loops, self.halt):
+            self.stops, self.inline_loops, self.halt = options
+            self.flush()
+
+        regs = p._reg.tolist()
+        pc = int(p._pc)
+        count = 0
+        reason = StopReason.MAX_INSTR
+
+        prof = p.profiler
+        landings = defaultdict(int, {pc: 1})
+        end_pc = None
+        block = None
+
+        try:
+            while max_instr == -1 or count < max_instr:
+                if p.code_gen != self.code_gen:
+                    self.flush()
+
+                if stop_at and (count or resume) and pc in stop_at:
+                    reason = StopReason.STOP_PC
+                    break
+
+                block = blocks.get(pc)
+
+                if block is None:
+                    block = self.translate(pc)
+
+                budget = -1 if max_instr == -1 else max_instr - count
+
+                if block is False or (budget != -1 and block.length > budget):
+                    block = None
+                    p._reg[:] = regs
+                    p.pc = pc
+                    p.fault_retired = 0
+                    regs = None
+                    p.step()
+                    regs = p._reg.tolist()
+                    count += 1
+
+                    if prof is not None:
+                        entry = p.decoded.get(pc)
+
+                        if entry is not None and entry[2]:
+                            landings[int(p._pc)] += 1
+
+                    pc = int(p._pc)
+                    continue
+
+                p.fault_retired = 0
+                pc, n = block.fn(regs, p, mem, budget)
+                count += n
+
+                if prof is not None and block.control:
+                    if n == block.length:
+                        landings[pc] += 1
+                    else:
+                        count_landings(landings, block, n, pc)
+
+                # A store into decoded code also returns early, possibly
+                # with pc on the last instruction, which then hasn't run.
+                if halt and pc == block.last and n % block.length == 0:
+                    reason = StopReason.HALT
+                    break
+
+                if until is not None:
+                    p._reg[:] = regs
+                    p.pc = pc
+
+                    if until(p):
+                        reason = StopReason.PREDICATE
+                        break
+        except SoftwareInterrupt:
+            # Only raised by p.step(), which already moved the PC on.
+            if not syscall_exit or int(p.reg[MIPSR.V0]) not in exit_syscalls:
+                count += p.fault_retired
+                end_pc = pc
+                raise
+
+            count += 1
+            reason = StopReason.EXIT
+            end_pc = int(p._pc)
+        except Exception:
+            count += p.fault_retired
+            end_pc = pc
+
+            # A fault inside a block: whole passes through a self loop
+            # landed back on its start, then the instruction at f didn't
+            # retire.
+            if block:
+                k, f = divmod(p.fault_retired, block.length)
+
+                if block.control:
+                    landings[block.start] += k
+
+                end_pc = block.start + 4 * f
+
+            raise
+        else:
+            p.pc = pc
+            end_pc = pc
+        finally:
+            if regs is not None:
+                p._reg[:] = regs
+            p.instr_c += count
+
+            if prof is not None:
+                prof.record(landings, end_pc, count)
+
+        return RunResult(reason, count)
@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+
+# Set-associative cache models for a MIPSProcessor's memory accesses.
+#
+# A Cache only tracks which lines it holds, it never stores data, so it can
+# sit alongside any memory backend. Caches are write-back and
+# write-allocate: a miss fetches the line from the next level, and evicting
+# a dirty line writes it back there.
+#
+# CacheHierarchy.attach wraps the handlers in the processor's ops table:
+# every instruction is fetched through the I-cache, and lw/lb/sw/sb also go
+# through the D-cache. A processor without a hierarchy attached keeps its
+# plain handlers and pays nothing. Translated blocks don't call handlers,
+# so a processor with caches attached always runs in the interpreter (see
+# MIPSProcessor.push_ops).
+#
+# Instead of simulating one geometry at a time, a TraceRecorder can be
+# attached the same way to record the address stream, and
+# miss_ratio_curve then gives the LRU miss ratio of every size and
+# associativity from a single pass over the trace per set count.
+
+import argparse
+import random
+
+import numpy as np
+
+from mips_sim import s16
+
+M32 = 0xffffffff
+
+policies = ("lru", "fifo", "random")
+
+# Kinds of access in a trace.
+FETCH = 0
+READ = 1
+WRITE = 2
+
+
+class Cache:
+
+    def __init__(self, size, assoc, line_size, policy="lru", next_level=None, name="cache", seed=0):
+        for v in (size, assoc, line_size):
+            if v <= 0 or v & (v - 1):
+                raise ValueError("Cache geometry must be powers of two.")
+
+        if size < assoc * line_size:
+            raise ValueError("Cache is smaller than one set.")
+
+        if policy not in policies:
+            raise ValueError("Unknown replacement policy {}.".format(policy))
+
+        self.size = size
+        self.assoc = assoc
+        self.line_size = line_size
+        self.policy = policy
+        self.next_level = next_level
+        self.name = name
+        self.rand = random.Random(seed)
+
+        self.offset_bits = line_size.bit_length() - 1
+        self.n_sets = size // (assoc * line_size)
+        self.set_mask = self.n_sets - 1
+
+        self.reset()
+
+    def reset(self):
+        # Empty the cache and zero the counters.
+
+        # Line numbers held by each set, oldest first. For lru a hit moves
+        # the line to the end, for fifo it stays where it was inserted.
+        self.sets = [[] for _ in range(self.n_sets)]
+        self.dirty = set()
+
+        self.reads = 0
+        self.writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writebacks = 0
+
+    def access(self, addr, write=False):
+        # Look up the byte at addr, returning True on a hit.
+        line = (addr & M32) >> self.offset_bits
+        ways = self.sets[line & self.set_mask]
+
+        if write:
+            self.writes += 1
+        else:
+            self.reads += 1
+
+        if line in ways:
+            self.hits += 1
+
+            if self.policy == "lru" and ways[-1] != line:
+                ways.remove(line)
+                ways.append(line)
+
+            if write:
+                self.dirty.add(line)
+
+            return True
+
+        self.misses += 1
+
+        if self.next_level is not None:
+            self.next_level.access(line << self.offset_bits)
+
+        if len(ways) == self.assoc:
+            if self.policy == "random":
+                victim = ways.pop(self.rand.randrange(self.assoc))
+            else:
+                victim = ways.pop(0)
+
+            self.evictions += 1
+
+            if victim in self.dirty:
+                self.dirty.discard(victim)
+                self.writebacks += 1
+
+                if self.next_level is not None:
+                    self.next_level.access(victim << self.offset_bits, True)
+
+        ways.append(line)
+
+        if write:
+            self.dirty.add(line)
+
+        return False
+
+    def stats(self):
+        accesses = self.hits + self.misses
+
+        return {
+            "reads": self.reads,
+            "writes": self.writes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "writebacks": self.writebacks,
+            "miss_rate": self.misses / accesses if accesses else 0.0,
+        }
+
+    def __repr__(self):
+        return "Cache({}, {} bytes, {}-way, {} byte lines, {})".format(
+            self.name, self.size, self.assoc, self.line_size, self.policy)
+
+
+def parse_spec(spec, name="cache"):
+    # Build a Cache from "size:assoc:line[:policy]", where size may end in k
+    # or m, e.g. "32k:4:32:lru".
+    parts = spec.split(":")
+
+    if len(parts) not in (3, 4):
+        raise ValueError("Cache spec should be size:assoc:line[:policy], not {}.".format(spec))
+
+    size = parts[0].lower()
+    scale = {"k": 1 << 10, "m": 1 << 20}.get(size[-1:], 1)
+
+    if scale != 1:
+        size = size[:-1]
+
+    policy = parts[3] if len(parts) == 4 else "lru"
+
+    return Cache(int(size) * scale, int(parts[1]), int(parts[2]), policy, name=name)
+
+
+class CacheHierarchy:
+
+    def __init__(self, l1i=None, l1d=None, l2=None):
+        # Either L1 may be left out. With an L2, L1 misses and write-backs
+        # go to it unless the L1 already has a next level of its own.
+        self.l1i = l1i
+        self.l1d = l1d
+        self.l2 = l2
+
+        for c in (l1i, l1d):
+            if c is not None and l2 is not None and c.next_level is None:
+                c.next_level = l2
+
+    def levels(self):
+        # (name, cache) for each cache, nearest first.
+        out = [(c.name, c) for c in (self.l1i, self.l1d) if c is not None]
+
+        if self.l2 is not None:
+            out.append((self.l2.name, self.l2))
+
+        return out
+
+    def reset(self):
+        for _, c in self.levels():
+            c.reset()
+
+    def stats(self):
+        return {name: c.stats() for name, c in self.levels()}
+
+    def report(self):
+        # One line of counters per cache.
+        lines = []
+
+        for name, c in self.levels():
+            s = c.stats()
+            lines.append("{:4} {:>10} accesses {:>10} hits {:>10} misses {:>8} evictions {:>8} writebacks"
+                         " ({:.2%} miss)".format(name, s["reads"] + s["writes"], s["hits"], s["misses"],
+                                                 s["evictions"], s["writebacks"], s["miss_rate"]))
+
+        return "\n".join(lines)
+
+    def attach(self, proc):
+        # Route proc's instruction fetches and loads/stores through the
+        # caches until detach is called.
+        hook(proc, self, self.l1i and self.l1i.access, self.l1d and self.l1d.access)
+
+    def detach(self, proc):
+        proc.pop_ops(self)
+
+
+def hook(proc, owner, fetch, data):
+    # Wrap proc's handlers so fetch(pc) is called before every instruction
+    # and data(addr, write) before every load and store, either may be None.
+    ops = dict(proc.ops)
+
+    if data is not None:
+        for op, write in (("lw", False), ("lb", False), ("sw", True), ("sb", True)):
+            ops[op] = data_access(proc, ops[op], data, write)
+
+    if fetch is not None:
+        for op in ops:
+            ops[op] = fetch_access(proc, ops[op], fetch)
+
+    proc.push_ops(owner, ops)
+
+
+def fetch_access(proc, handler, access):
+    def fetch(*args):
+        access(int(proc._pc))
+        return handler(*args)
+
+    return fetch
+
+
+def data_access(proc, handler, access, write):
+    def data(rt, offset, rs):
+        access(int(proc.reg[rs]) + s16(offset), write)
+        return handler(rt, offset, rs)
+
+    return data
+
+
+class TraceRecorder:
+    # Records every instruction fetch and load/store address of a processor
+    # it is attached to.
+
+    def __init__(self):
+        self.addrs = []
+        self.kinds = []
+
+    def fetch(self, addr, write=False):
+        self.addrs.append(addr & M32)
+        self.kinds.append(FETCH)
+
+    def data(self, addr, write):
+        self.addrs.append(addr & M32)
+        self.kinds.append(WRITE if write else READ)
+
+    def attach(self, proc):
+        hook(proc, self, self.fetch, self.data)
+
+    def detach(self, proc):
+        proc.pop_ops(self)
+
+    def trace(self):
+        # (addresses, kinds) as uint32 and uint8 arrays.
+        return np.array(self.addrs, dtype=np.uint32), np.array(self.kinds, dtype=np.uint8)
+
+    def save(self, path):
+        addrs, kinds = self.trace()
+        np.savez_compressed(path, addr=addrs, kind=kinds)
+
+
+def load_trace(path):
+    with np.load(path) as f:
+        return f["addr"], f["kind"]
+
+
+def count_below(values, ends, limits):
+    # For each query q, the number of j < ends[q] with values[j] < limits[q].
+    # values and limits lie in [0, len(values)].
+    #
+    # A merge sort tree done level by level: at level k values is sorted
+    # within aligned blocks of 2 ** k, and a prefix [0, X) is the union of
+    # one block per set bit of X. Offsetting each value by its block number
+    # times M keeps the whole level in one sorted array, so every query's
+    # block can be searched with a single searchsorted.
+    #
+    # Each level is built from the one below, where it is already two sorted
+    # runs per block, which a stable sort merges in close to linear time.
+    # The queries are sorted before searching as well; searchsorted is an
+    # order of magnitude faster on sorted keys than on scattered ones.
+    n = len(values)
+    m = n + 1
+    out = np.zeros(len(ends), dtype=np.int64)
+    level = np.arange(n, dtype=np.int64) * m + values
+    k = 0
+
+    while (1 << k) <= n:
+        if k:
+            level = np.sort((level // m >> 1) * m + level % m, kind="stable")
+
+        q = np.flatnonzero((ends >> k) & 1)
+        block = (ends[q] >> k) - 1
+        keys = block * m + limits[q]
+        o = np.argsort(keys, kind="stable")
+
+        out[q[o]] += np.searchsorted(level, keys[o]) - (block[o] << k)
+
+        k += 1
+
+    return out
+
+
+def stack_distances(lines):
+    # LRU stack distance of each access: the number of distinct other lines
+    # touched since the previous access to the same line, or -1 for the
+    # first access to a line. A fully associative LRU cache of C lines hits
+    # exactly the accesses with 0 <= distance < C.
+    #
+    # With p the previous access to line i, the distance is the length of
+    # the window (p, i) less the accesses in it that are repeated inside it.
+    # Those are the j > p whose next access comes before i.
+    #
+    # Back to back accesses to one line are always at distance 0 and don't
+    # change anyone else's distance, so they are dropped up front. That
+    # shrinks instruction fetch traces several times over.
+    lines = np.asarray(lines)
+    out = np.zeros(len(lines), dtype=np.int64)
+
+    if len(lines) == 0:
+        return out
+
+    keep = np.ones(len(lines), dtype=bool)
+    keep[1:] = lines[1:] != lines[:-1]
+    lines = lines[keep]
+    n = len(lines)
+
+    order = np.argsort(lines, kind="stable")
+    same = lines[order[1:]] == lines[order[:-1]]
+
+    prev = np.full(n, -1, dtype=np.int64)
+    prev[order[1:][same]] = order[:-1][same]
+
+    nxt = np.full(n, n, dtype=np.int64)
+    nxt[order[:-1][same]] = order[1:][same]
+
+    # In order of p, which keeps the searches in count_below local.
+    i = np.flatnonzero(prev >= 0)
+    i = i[np.argsort(prev[i], kind="stable")]
+    p = prev[i]
+
+    # Accesses j with nxt[j] < i, minus those with j <= p.
+    repeats = np.cumsum(prev >= 0) - (prev >= 0)
+    inner = repeats[i] - count_below(nxt, p + 1, i)
+
+    dist = np.full(n, -1, dtype=np.int64)
+    dist[i] = i - p - 1 - inner
+    out[keep] = dist
+
+    return out
+
+
+def misses_by_ways(dist, max_ways):
+    # Misses of an LRU set of 1..max_ways ways, given stack distances.
+    hist = np.bincount(dist[dist >= 0], minlength=max_ways)[:max_ways]
+    cold = np.count_nonzero(dist < 0)
+
+    return cold + len(dist) - cold - np.cumsum(hist)
+
+
+def miss_ratio_curve(addrs, line_size=32, sizes=None, assocs=(1, 2, 4, 8, None)):
+    # LRU miss ratios of every cache size (bytes) and associativity, None
+    # being fully associative. Returns a (len(sizes), len(assocs)) array,
+    # nan where a geometry doesn't fit (fewer lines than ways). Sizes
+    # default to the powers of two from one line up to the trace footprint.
+    lines = np.asarray(addrs, dtype=np.int64) >> (line_size.bit_length() - 1)
+    n = len(lines)
+
+    if sizes is None:
+        footprint = len(np.unique(lines)) * line_size
+        sizes = [line_size << k for k in range(max(1, footprint // line_size).bit_length() + 1)]
+
+    table = np.full((len(sizes), len(assocs)), np.nan)
+
+    if n == 0:
+        return sizes, table
+
+    n_lines = [s // line_size for s in sizes]
+
+    # Fully associative: one set, all sizes from one set of distances.
+    if None in assocs:
+        ways = misses_by_ways(stack_distances(lines), max(n_lines))
+        table[:, assocs.index(None)] = [ways[c - 1] / n for c in n_lines]
+
+    # Set associative: one pass per set count, covering every associativity
+    # with that many sets. Grouping the accesses by set keeps each set's
+    # accesses contiguous, so the distances come out per set.
+    by_sets = {}
+
+    for r, c in enumerate(n_lines):
+        for col, a in enumerate(assocs):
+            if a is not None and c >= a:
+                by_sets.setdefault(c // a, []).append((r, col, a))
+
+    for sets, cells in by_sets.items():
+        order = np.argsort(lines & (sets - 1), kind="stable")
+        ways = misses_by_ways(stack_distances(lines[order]), max(a for _, _, a in cells))
+
+        for r, col, a in cells:
+            table[r, col] = ways[a - 1] / n
+
+    return sizes, table
+
+
+def format_curve(sizes, assocs, table):
+    # Miss ratio table, one row per size.
+    head = ["{:>10}".format("size")] + ["{:>8}".format("full" if a is None else "{}-way".format(a)) for a in assocs]
+    lines = [" ".join(head)]
+
+    for s, row in zip(sizes, table):
+        cells = ["{:>8}".format("-" if np.isnan(v) else "{:.4f}".format(v)) for v in row]
+        lines.append(" ".join(["{:>10}".format(s)] + cells))
+
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='Miss ratio curves from a recorded address trace',
+                                     description='')
+    parser.add_argument(dest='trace', type=str,
+                        help="Trace .npz written by TraceRecorder.save (mips_sim.py --trace).")
+    parser.add_argument('-l', '--line', type=int, dest='line', default=32,
+                        help='Line size in bytes.')
+    parser.add_argument('-k', '--kind', choices=['all', 'fetch', 'data'], dest='kind', default='data',
+                        help='Which accesses to analyze.')
+    parser.add_argument('-a', '--assoc', type=str, dest='assoc', default='1,2,4,8,full',
+                        help='Comma separated associativities, "full" for fully associative.')
+
+    args = parser.parse_args()
+
+    addrs, kinds = load_trace(args.trace)
+
+    if args.kind == 'fetch':
+        addrs = addrs[kinds == FETCH]
+    elif args.kind == 'data':
+        addrs = addrs[kinds != FETCH]
+
+    assocs = tuple(None if a == 'full' else int(a) for a in args.assoc.split(','))
+    sizes, table = miss_ratio_curve(addrs, args.line, assocs=assocs)
+
+    print(format_curve(sizes, assocs, table))
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+# Checkpoints of a MIPSProcessor on disk.
+#
+# A checkpoint is a compressed .npz holding the registers, HI/LO, PC, the
+# coprocessor 0 fields and instr_c, plus memory. For paged memory only the
+# pages written since the previous checkpoint are stored, along with the
+# file name of that previous checkpoint; loading follows the chain back to
+# the first, full checkpoint and replays the pages forward. Flat memory is
+# always stored whole.
+#
+# Dirty pages are found the same way MMem.restore finds changed ones: the
+# Checkpointer keeps an MMem snapshot of the state it last wrote, and any
+# page that is no longer the same object has been written since.
+#
+# The decode cache isn't saved, it refills itself on the first pass through
+# the code (or all at once with predecode).
+
+import os
+import signal
+
+import numpy as np
+
+from generic_memory import MMem, PAGE_BITS, PAGE_SIZE
+from mips_sim import StopReason, RunResult
+
+# Order of the scalar fields in the "state" array.
+state_fields = ["hi", "lo", "pc", "epc", "cause", "badvaddr", "status"]
+
+
+def write_checkpoint(path, p, parent=None, pages=None):
+    # Write p to path. With paged memory, pages is the list of page numbers
+    # to store (all of them if None) and parent the checkpoint holding the
+    # rest. The file is written next to path and renamed into place, so a
+    # crash never leaves a half written checkpoint behind.
+    arrays = {
+        "reg": np.array(p.reg.tolist(), dtype=np.uint32),
+        "state": np.array([int(getattr(p, f)) for f in state_fields], dtype=np.uint32),
+        "instr_c": np.int64(p.instr_c),
+        "parent": np.str_(os.path.basename(parent) if parent else ""),
+    }
+
+    if isinstance(p.mem, MMem):
+        if pages is None:
+            pages = sorted(p.mem.pages)
+
+        arrays["fill_value"] = np.uint8(p.mem.fill_value)
+        arrays["page_ids"] = np.array(pages, dtype=np.uint32)
+        arrays["page_data"] = np.array([p.mem.pages[n] for n in pages], dtype=np.uint8).reshape(-1, PAGE_SIZE)
+    else:
+        arrays["flat"] = p.mem
+
+    tmp = path + ".tmp"
+
+    with open(tmp, "wb") as f:
+        np.savez_compressed(f, **arrays)
+
+    os.replace(tmp, path)
+
+
+def read_chain(path):
+    # The contents of path and every checkpoint before it, oldest first.
+    chain = []
+
+    while path:
+        with np.load(path) as f:
+            data = {k: f[k] for k in f.files}
+
+        chain.append(data)
+
+        parent = str(data["parent"])
+        path = os.path.join(os.path.dirname(path), parent) if parent else None
+
+    return chain[::-1]
+
+
+def load_checkpoint(path, cls):
+    # Build a cls processor from the checkpoint at path.
+    chain = read_chain(path)
+    last = chain[-1]
+
+    if "flat" in last:
+        p = cls(len(last["flat"]))
+        p.mem[:] = last["flat"]
+    else:
+        p = cls(mem=MMem())
+        p.mem.fill(int(chain[0]["fill_value"]))
+
+        for data in chain:
+            for n, page in zip(data["page_ids"], data["page_data"]):
+                p.mem.write(int(n) << PAGE_BITS, page)
+
+    p.reg[:] = [int(v) for v in last["reg"]]
+
+    for f, v in zip(state_fields, last["state"]):
+        setattr(p, f, v)
+
+    p.instr_c = int(last["instr_c"])
+
+    return p
+
+
+class Checkpointer:
+    # Writes numbered checkpoints of a processor as prefix-000000.npz,
+    # prefix-000001.npz, ..., each holding the pages written since the one
+    # before it.
+
+    def __init__(self, proc, prefix):
+        self.proc = proc
+        self.prefix = prefix
+        self.count = 0
+        self.last = None
+        self.base = None
+        self.requested = False
+        self.installed = False
+
+    def save(self, full=False):
+        # Write the next checkpoint and return its path. full writes every
+        # page and starts a new chain.
+        p = self.proc
+        path = "{}-{:06d}.npz".format(self.prefix, self.count)
+
+        if isinstance(p.mem, MMem):
+            base = self.base
+            pages = None
+
+            if not full and base is not None and base.fill_value == p.mem.fill_value\
+                    and all(n in p.mem.pages for n in base.pages):
+                pages = sorted(n for n, page in p.mem.pages.items() if base.pages.get(n) is not page)
+            else:
+                full = True
+
+            write_checkpoint(path, p, None if full else self.last, pages)
+            self.base = p.mem.snapshot()
+        else:
+            write_checkpoint(path, p)
+
+        self.count += 1
+        self.last = path
+
+        return path
+
+    def request(self, signum=None, frame=None):
+        # Ask for a checkpoint at the next opportunity. Safe to use as a
+        # signal handler.
+        self.requested = True
+
+    def install(self, signum=signal.SIGUSR1):
+        # Checkpoint whenever signum arrives during run.
+        signal.signal(signum, self.request)
+        self.installed = True
+
+    def run(self, max_instr=-1, every=None, translate=False, until=None, **stop):
+        # MIPSProcessor.run, writing a checkpoint every `every` instructions
+        # and whenever one has been requested. Requests are noticed at the
+        # same points until is checked, so they cost nothing unless a
+        # handler has been installed for them.
+        p = self.proc
+        count = 0
+        resume = stop.pop("resume", False)
+
+        def check(proc):
+            return self.requested or (until is not None and until(proc))
+
+        if not self.installed and until is None:
+            check = None
+
+        while max_instr == -1 or count < max_instr:
+            n = max_instr - count if max_instr != -1 else -1
+
+            if every is not None:
+                n = every if n == -1 else min(n, every)
+
+            # Past the first run a stop address where the last one left off
+            # still has to stop it.
+            res = p.run(n, translate, until=check, resume=resume, **stop)
+            count += res.count
+            resume = True
+
+            if res.reason == StopReason.PREDICATE and self.requested:
+                self.requested = False
+                self.save()
+                continue
+
+            if res.reason != StopReason.MAX_INSTR:
+                return RunResult(res.reason, count)
+
+            if every is not None or self.requested:
+                self.requested = False
+                self.save()
+
+        return RunResult(StopReason.MAX_INSTR, count)
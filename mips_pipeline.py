@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+# Cycle-approximate timing for a MIPSProcessor, modelled on the classic
+# five stage IF/ID/EX/MEM/WB pipeline with full forwarding.
+#
+# Like the cache models, a PipelineModel wraps the handlers in the
+# processor's ops table. Which registers each instruction reads and writes
+# is worked out once per op with mips_sim.op_usage, so the wrappers only
+# look up the arguments the decoded entry already holds. After each
+# instruction retires the model picks the cycle it could enter EX in:
+#
+# - ALU results can be forwarded to the next instruction's EX, loaded
+#   values only one cycle later (load-use stall).
+# - Branches and jr are resolved in ID, a cycle before EX, so they wait
+#   for their operands a cycle longer. A taken branch or jump throws away
+#   the fetched instruction after it (branch penalty); there are no delay
+#   slots.
+# - Store data isn't needed until MEM.
+# - mult/div keep the multiply unit busy and HI/LO unavailable for a fixed
+#   number of cycles; mfhi/mflo and the next mult/div wait for them.
+#
+# Caches aren't modelled here, attach a mips_cache.CacheHierarchy as well
+# for miss counts.
+
+from mips_sim import control_ops, link_ops, muldiv_ops, op_usage
+
+# Stall causes, in the order they are reported.
+stall_causes = ("load_use", "data", "hilo", "muldiv", "branch")
+
+
+class PipelineModel:
+
+    def __init__(self, branch_penalty=1, mult_latency=5, div_latency=35):
+        if min(branch_penalty, mult_latency, div_latency) < 0:
+            raise ValueError("Latencies can't be negative.")
+
+        self.branch_penalty = branch_penalty
+        self.mult_latency = mult_latency
+        self.div_latency = div_latency
+
+        self.reset()
+
+    def reset(self):
+        self.instructions = 0
+        self.stalls = dict.fromkeys(stall_causes, 0)
+
+        # EX cycle of the last instruction, the first one reaches EX in
+        # cycle 3.
+        self.ex = 2
+        self.bubble = 0
+
+        # Cycle each register's value can be forwarded to EX, and whether it
+        # came from a load.
+        self.ready = [0] * 32
+        self.loaded = [False] * 32
+        self.hilo_ready = 0
+        self.unit_free = 0
+
+    @property
+    def cycles(self):
+        # The last instruction still has to go through MEM and WB.
+        return self.ex + 2 if self.instructions else 0
+
+    def stats(self):
+        cycles = self.cycles
+
+        return {
+            "instructions": self.instructions,
+            "cycles": cycles,
+            "cpi": cycles / self.instructions if self.instructions else 0.0,
+            "stalls": dict(self.stalls),
+        }
+
+    def report(self):
+        s = self.stats()
+        lines = ["{} cycles, {} instructions, CPI {:.3f}".format(s["cycles"], s["instructions"], s["cpi"])]
+
+        for cause in stall_causes:
+            lines.append("  {:10} {:>10} stall cycles".format(cause, s["stalls"][cause]))
+
+        return "\n".join(lines)
+
+    def issue(self, srcs, early, store, dest, load, hilo, muldiv, taken):
+        # Account for one retired instruction reading the registers srcs
+        # (early: in ID) and store, writing dest.
+        ex = self.ex + 1
+
+        if self.bubble:
+            self.stalls["branch"] += self.bubble
+            ex += self.bubble
+            self.bubble = 0
+
+        need = ex
+        cause = None
+        ready = self.ready
+
+        for r in srcs:
+            t = ready[r] + early
+
+            if t > need:
+                need = t
+                cause = "load_use" if self.loaded[r] else "data"
+
+        if store is not None and ready[store] - 1 > need:
+            need = ready[store] - 1
+            cause = "load_use" if self.loaded[store] else "data"
+
+        if hilo and self.hilo_ready > need:
+            need = self.hilo_ready
+            cause = "hilo"
+
+        if muldiv and self.unit_free > need:
+            need = self.unit_free
+            cause = "muldiv"
+
+        if need > ex:
+            self.stalls[cause] += need - ex
+            ex = need
+
+        if dest:
+            ready[dest] = ex + 2 if load else ex + 1
+            self.loaded[dest] = load
+
+        if muldiv:
+            self.hilo_ready = self.unit_free = ex + muldiv
+
+        # Charged to the next instruction, so a run ending on a taken
+        # branch doesn't pay for it.
+        if taken:
+            self.bubble = self.branch_penalty
+
+        self.ex = ex
+        self.instructions += 1
+
+    def wrap(self, proc, op, handler):
+        dest, srcs, store = op_usage(op)
+        control = op in control_ops
+        early = 1 if control else 0
+        load = op in ("lw", "lb")
+        hilo = op in ("mfhi", "mflo")
+        link = op in link_ops
+        latency = 0
+        issue = self.issue
+
+        if op in muldiv_ops:
+            latency = self.mult_latency if op.startswith("mult") else self.div_latency
+
+        if op == "syscall":
+            # Reads $v0 and $a0, and may not return.
+            def timed():
+                issue((2, 4), 0, None, None, False, False, 0, False)
+                return handler()
+
+            return timed
+
+        def timed(*args):
+            pc = int(proc._pc)
+            res = handler(*args)
+
+            d = 31 if link else (None if dest is None else int(args[dest]))
+            taken = control and int(proc._pc) != pc + 4
+            issue([int(args[i]) for i in srcs], early, None if store is None else int(args[store]),
+                  d, load, hilo, latency, taken)
+
+            return res
+
+        return timed
+
+    def attach(self, proc):
+        # Time every instruction proc runs until detach is called.
+        ops = {op: self.wrap(proc, op, h) for op, h in proc.ops.items()}
+        proc.push_ops(self, ops)
+
+    def detach(self, proc):
+        proc.pop_ops(self)
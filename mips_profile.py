@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+# Per-PC and per-opcode execution counts for a MIPSProcessor.
+#
+# Counting every instruction would cost more than running it, so neither
+# engine does. Both already stop after each branch or jump (the interpreter
+# to check halt/until, the translator at the end of each block), and that
+# is where the profiler is fed: each run reports where it started, how many
+# times each branch or jump landed on each address, and where it stopped.
+# Execution between two of those points is straight-line, so the count of
+# an instruction is the number of landings on it plus the count of the
+# instruction before it (unless that one is a branch or jump), minus the
+# runs that stopped in front of it. That is a segmented cumulative sum over
+# preallocated arrays, done once when the counts are asked for.
+#
+# Opcode counts come from the per-PC counts and a decode of the profiled
+# range, so they describe the code in memory at the time they are asked
+# for.
+
+from collections import namedtuple
+
+import numpy as np
+
+from generic_memory import MMem, PAGE_BITS
+from mips_sim import Instr, MIPSI, control_ops
+
+HotSpot = namedtuple("HotSpot", ["addr", "count", "share", "op", "label"])
+
+control_ids = np.array([MIPSI[op.upper()].value for op in control_ops])
+
+
+def code_range(proc):
+    # The default range to profile: all of flat memory, or the run of
+    # allocated pages holding the PC.
+    if not isinstance(proc.mem, MMem):
+        return 0, len(proc.mem)
+
+    n = int(proc.pc) >> PAGE_BITS
+
+    if n not in proc.mem.pages:
+        raise ValueError("No code at the PC to profile.")
+
+    lo = hi = n
+
+    while lo - 1 in proc.mem.pages:
+        lo -= 1
+
+    while hi + 1 in proc.mem.pages:
+        hi += 1
+
+    return lo << PAGE_BITS, (hi + 1) << PAGE_BITS
+
+
+def label_of(symbols, addrs):
+    # The nearest label at or before each address, as "name+0x8", or "".
+    if not symbols:
+        return [""] * len(addrs)
+
+    names = sorted(symbols, key=lambda k: symbols[k])
+    starts = np.array([symbols[k] for k in names], dtype=np.int64)
+    out = []
+
+    for addr, i in zip(addrs, np.searchsorted(starts, addrs, side="right") - 1):
+        if i < 0:
+            out.append("")
+        elif addr == starts[i]:
+            out.append(names[i])
+        else:
+            out.append("{}+0x{:x}".format(names[i], int(addr - starts[i])))
+
+    return out
+
+
+class Profiler:
+
+    def __init__(self, start=None, end=None):
+        # Profile instructions in [start, end), by default see code_range.
+        self.start = start
+        self.end = end
+        self.proc = None
+        self.entries = None
+        self.exits = None
+        self.instructions = 0
+
+    def attach(self, proc):
+        if proc.profiler is not None:
+            raise ValueError("Processor already has a profiler attached.")
+
+        if self.entries is None:
+            if self.start is None:
+                self.start, self.end = code_range(proc)
+
+            self.start &= ~3
+
+            if self.end <= self.start:
+                raise ValueError("Empty profile range.")
+
+            n = (self.end - self.start + 3) // 4
+            self.entries = np.zeros(n, dtype=np.int64)
+            self.exits = np.zeros(n, dtype=np.int64)
+
+        self.proc = proc
+        proc.profiler = self
+
+    def detach(self, proc):
+        # Counts are kept, and stay readable while proc's memory is.
+        proc.profiler = None
+
+    def reset(self):
+        self.entries[:] = 0
+        self.exits[:] = 0
+        self.instructions = 0
+
+    def record(self, landings, end_pc, count):
+        # Called by MIPSProcessor.run at the end of every run with
+        # {address: landings} (including the start), the address of the
+        # first instruction not run and the number run.
+        self.instructions += count
+        n = len(self.entries)
+
+        for pc, k in landings.items():
+            i = (pc - self.start) // 4
+
+            if 0 <= i < n and pc % 4 == 0:
+                self.entries[i] += k
+
+        i = (end_pc - self.start) // 4
+
+        if 0 <= i < n:
+            self.exits[i] += 1
+
+    def ops(self):
+        # MIPSI value of each word in the range, -1 where it doesn't decode.
+        return Instr.decode_image(self.proc.mem[self.start:self.start + 4 * len(self.entries)])["op"]
+
+    def counts(self, ops=None):
+        # Times each word in the range was executed.
+        if ops is None:
+            ops = self.ops()
+
+        c = np.cumsum(self.entries - self.exits)
+
+        # Each straight-line segment starts after a branch or jump.
+        starts = np.flatnonzero(np.isin(ops[:-1], control_ids)) + 1
+        seg = np.zeros(len(c), dtype=np.intp)
+        seg[starts] = starts
+        seg = np.maximum.accumulate(seg)
+
+        return c - np.concatenate(([0], c[:-1]))[seg]
+
+    def op_counts(self):
+        # Executions of each MIPSI, indexed by its value.
+        ops = self.ops()
+        counts = self.counts(ops)
+        valid = ops >= 0
+
+        return np.bincount(ops[valid], weights=counts[valid], minlength=len(MIPSI)).astype(np.int64)
+
+    def hot_spots(self, top=20, symbols=None):
+        # The top most executed instructions as HotSpots, hottest first.
+        # symbols maps label names to addresses, see
+        # mips_assembler.read_labels.
+        ops = self.ops()
+        counts = self.counts(ops)
+        order = np.argsort(-counts, kind="stable")[:top]
+        order = order[counts[order] > 0]
+        addrs = self.start + 4 * order
+
+        return [HotSpot(int(a), int(counts[i]), counts[i] / max(self.instructions, 1),
+                        MIPSI(int(ops[i])).name.lower(), label)
+                for a, i, label in zip(addrs, order, label_of(symbols, addrs))]
+
+    def by_label(self, symbols):
+        # [(label, count)] of the instructions from each label up to the
+        # next, hottest first.
+        names = sorted(symbols, key=lambda k: symbols[k])
+        starts = np.array([symbols[k] for k in names], dtype=np.int64)
+        counts = self.counts()
+
+        which = np.searchsorted(starts, self.start + 4 * np.arange(len(counts)), side="right") - 1
+        inside = which >= 0
+        totals = np.bincount(which[inside], weights=counts[inside], minlength=len(names))
+
+        return sorted(((names[i], int(totals[i])) for i in np.flatnonzero(totals)), key=lambda e: -e[1])
+
+    def report(self, top=20, symbols=None):
+        total = max(self.instructions, 1)
+        counts = self.counts()
+        lines = ["{} instructions, {} in 0x{:08x}-0x{:08x}".format(
+            self.instructions, int(counts.sum()), self.start, self.start + 4 * len(counts))]
+
+        for h in self.hot_spots(top, symbols):
+            lines.append("  0x{:08x} {:20} {:>12} {:>7.2%}  {}".format(h.addr, h.label, h.count, h.share, h.op))
+
+        if symbols:
+            lines.append("By label:")
+
+            for name, count in self.by_label(symbols)[:top]:
+                lines.append("  {:31} {:>12} {:>7.2%}".format(name, count, count / total))
+
+        ops = self.op_counts()
+        lines.append("By opcode:")
+
+        for v in np.argsort(-ops, kind="stable"):
+            if ops[v]:
+                lines.append("  {:31} {:>12} {:>7.2%}".format(MIPSI(int(v)).name.lower(), int(ops[v]),
+                                                              ops[v] / total))
+
+        return "\n".join(lines)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+# Run many simulations across a pool of worker processes.
+#
+# Each Job names a binary plus the initial registers, memory patches and
+# instruction budget to run it with. Jobs are fanned out over a
+# ProcessPoolExecutor and their Results are yielded as they finish. Every
+# worker keeps a warm processor (and the binaries it has already mapped)
+# around between jobs instead of setting one up per run.
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import json
+import sys
+
+import numpy as np
+
+from generic_memory import as_image
+from mips_sim import IanMIPS, IntegerOverflow, AddressError, SoftwareInterrupt, IllegalInstructionError,\
+    backends, is_valid_file
+
+Job = namedtuple("Job", [
+    "binary",           # path of a .bin file
+    "regs",             # {register name or number: value} or None, $gp/$fp are set to start
+    "mem",              # [(address, bytes)] written after loading
+    "max_instr",        # instruction budget, -1 for none
+    "start",            # load and entry address
+    "mem_size",
+    "backend",          # key into mips_sim.backends
+    "translate",
+    "halt",             # stop once the program branches to itself
+])
+Job.__new__.__defaults__ = (None, (), 1000, 12, 1024, "int", False, False)
+
+Result = namedtuple("Result", [
+    "job_id",
+    "regs",
+    "hi",
+    "lo",
+    "pc",
+    "instr_count",
+    "trap",             # exception class name, or None if the run stopped
+    "stop",             # lower case StopReason name, or None on a trap
+])
+
+# What a guest can raise. IndexError, MemoryError and ValueError come from
+# accesses outside flat memory. Anything else is a bug in the simulator and
+# propagates.
+guest_errors = (IntegerOverflow, AddressError, SoftwareInterrupt, IllegalInstructionError,
+                IndexError, MemoryError, ValueError)
+
+# Per worker process state: a processor per (backend, mem_size) and what was
+# last loaded into it, as (binary, start, end, patched ranges). Binaries are
+# memory mapped once per worker by load_program.
+worker_procs = {}
+worker_loaded = {}
+
+
+def reg_index(name):
+    if type(name) is int:
+        return name
+
+    name = str(name).lstrip("$")
+
+    if name.isdigit():
+        return int(name)
+
+    return IanMIPS.reg_dict[name]
+
+
+def run_job(job_id, job):
+
+    key = (job.backend, job.mem_size)
+    p = worker_procs.get(key)
+    image = as_image(job.binary)
+    loaded = (job.binary, job.start, job.start + len(image))
+    patches = [(addr, addr + len(data)) for addr, data in job.mem]
+    last = worker_loaded.pop(key, None)
+
+    if p is None:
+        p = worker_procs[key] = backends[job.backend](job.mem_size)
+        p.load_program(job.start, image)
+    elif type(job.binary) is str and last is not None and last[:3] == loaded:
+        # The same binary again: keep what has been decoded of it, apart from
+        # whatever the last job patched.
+        p.reset(keep=loaded[1:])
+        p.load_program(job.start, image, invalidate=False)
+
+        for start, end in last[3]:
+            p.invalidate_decoded(start, end)
+    else:
+        p.reset()
+        p.load_program(job.start, image)
+
+    worker_loaded[key] = loaded + (patches,)
+
+    for addr, data in job.mem:
+        data = np.frombuffer(bytes(data), dtype=np.uint8)
+        p.mem[addr:addr + len(data)] = data
+        p.invalidate_decoded(addr, addr + len(data))
+
+    for name, value in (job.regs or {}).items():
+        p.reg[reg_index(name)] = value
+
+    trap = None
+    stop = None
+
+    try:
+        res = p.execute_prog(job.start, job.max_instr, translate=job.translate, halt=job.halt)
+        stop = res.reason.name.lower()
+    except guest_errors as e:
+        trap = type(e).__name__
+
+    return Result(job_id, [int(v) for v in p.reg], int(p.hi), int(p.lo), int(p.pc), p.instr_c, trap, stop)
+
+
+def run_jobs(jobs, max_workers=None):
+    # Yield a Result for every job as soon as it completes. job_id is the
+    # job's position in jobs.
+    with ProcessPoolExecutor(max_workers=max_workers) as ex:
+        futures = [ex.submit(run_job, i, job) for i, job in enumerate(jobs)]
+
+        for f in as_completed(futures):
+            yield f.result()
+
+
+def load_jobs(filename):
+    # A JSON list of objects with the same keys as Job.
+    with open(filename) as f:
+        return [Job(**j) for j in json.load(f)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog='Batch runner for the barebones MIPS simulator',
+                                     description='')
+    parser.add_argument(dest='files', type=str, nargs='*',
+                        help="Binary files to run, one job each.")
+    parser.add_argument('--jobs', type=str, dest='jobs', default=None,
+                        help='JSON file describing the jobs to run.')
+    parser.add_argument('-j', '--workers', type=int, dest='workers', default=None,
+                        help='Number of worker processes.')
+    parser.add_argument('-n', '--max-instr', type=int, dest='max_instr', default=1000,
+                        help='Instruction budget for jobs given as files.')
+    parser.add_argument('-b', '--backend', choices=sorted(backends.keys()), dest='backend', default='int',
+                        help='Register file backend for jobs given as files.')
+    parser.add_argument('-t', '--translate', action='store_true', dest='translate', default=False,
+                        help='Run jobs given as files through the block translator.')
+    parser.add_argument('--halt', action='store_true', dest='halt', default=False,
+                        help='Stop jobs given as files once they branch to themselves.')
+
+    args = parser.parse_args()
+
+    jobs = []
+
+    if args.jobs is not None:
+        jobs += load_jobs(args.jobs)
+
+    for f in args.files:
+        jobs.append(Job(f, max_instr=args.max_instr, backend=args.backend, translate=args.translate,
+                        halt=args.halt))
+
+    for job in jobs:
+        if not is_valid_file(job.binary):
+            parser.error("{} cannot be opened.".format(job.binary))
+
+    # One JSON object per line, in completion order.
+    for res in run_jobs(jobs, args.workers):
+        print(json.dumps(dict(res._asdict(), binary=jobs[res.job_id].binary)))
+        sys.stdout.flush()
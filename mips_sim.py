@@ -18,7 +18,9 @@
 # ░░░░░░░░░░░░░░░░░░░░
 
 from enum import Enum, unique, IntEnum
+from collections import namedtuple, defaultdict
 import numpy as np
+from generic_memory import MMem, PAGE_BITS, PAGE_SIZE, as_image
 import argparse
 import os.path
 
@@ -30,6 +32,21 @@ def bshl(value, shamt):
         return np.left_shift([value], shamt)[0]
 
 
+def u32(value):
+    # Wrap a Python int to an unsigned 32 bit value.
+    return int(value) & 0xffffffff
+
+
+def s32(value):
+    # Interpret the low 32 bits of a Python int as signed.
+    return ((int(value) & 0xffffffff) ^ 0x80000000) - 0x80000000
+
+
+def s16(value):
+    # Interpret the low 16 bits of a Python int as signed.
+    return ((int(value) & 0xffff) ^ 0x8000) - 0x8000
+
+
 @unique
 class MIPSI(Enum):
     ADD = 0
@@ -183,6 +200,36 @@ class AddressError(Exception):
     pass
 
 
+@unique
+class StopReason(Enum):
+    MAX_INSTR = 0       # Ran out of instruction budget
+    HALT = 1            # Branched to itself, nothing will ever change
+    STOP_PC = 2         # Reached one of the stop_at addresses
+    EXIT = 3            # syscall with $v0 set to exit
+    PREDICATE = 4       # until(processor) returned True
+
+
+RunResult = namedtuple("RunResult", ["reason", "count"])
+
+# Architectural state captured by MIPSProcessor.snapshot. mem is an MMem
+# PageMap for paged memory, or a copy of the flat array.
+Snapshot = namedtuple("Snapshot", [
+    "reg", "hi", "lo", "pc", "epc", "cause", "badvaddr", "status", "instr_c", "mem",
+])
+
+# Ops that transfer control, i.e. the ends of basic blocks.
+control_ops = {
+    "beq", "bne", "bgez", "bgezal", "bgtz", "blez", "bltz", "bltzal", "j", "jal", "jr",
+}
+
+# $v0 values treated as exit by syscall_exit, as in SPIM.
+exit_syscalls = {10, 17}
+
+# Ops writing $ra, and ops writing HI and LO.
+link_ops = {"jal", "bgezal", "bltzal"}
+muldiv_ops = {"mult", "multu", "div", "divu"}
+
+
 class CMDParse:
 
     # op
@@ -530,49 +577,6 @@ class IanMIPS:
 
 class Instr:
 
-    def gen_args(self):
-        if self.op in CMDParse.cat_0:
-            pass
-
-        elif self.op in CMDParse.cat_1:
-            self.args = [self.rd, self.rs, self.rt]
-
-        elif self.op in CMDParse.cat_2:
-            self.args = [self.rd, self.rt, self.rs]
-
-        elif self.op in CMDParse.cat_3:
-            self.args = [self.rd, self.rt, self.shamt]
-
-        elif self.op in CMDParse.cat_4:
-            self.args = [self.rt, self.rs, self.imm]
-
-        elif self.op in CMDParse.cat_5:
-            self.args = [self.rt, self.imm, self.rs]
-
-        elif self.op in CMDParse.cat_6:
-            self.args = [self.rs]
-
-        elif self.op in CMDParse.cat_7:
-            self.args = [self.target]
-
-        elif self.op in CMDParse.cat_8:
-            self.args = [self.rs, self.rt]
-
-        elif self.op in CMDParse.cat_9:
-            self.args = [self.rd]
-
-        elif self.op in CMDParse.cat_10:
-            self.args = [self.rt, self.imm]
-
-        elif self.op in CMDParse.cat_11:
-            self.args = [self.rs, self.imm]
-
-        elif self.op in CMDParse.cat_12:
-            self.args = [self.rs, self.rt, self.imm]
-
-        else:
-            raise IllegalInstructionError()
-
     @staticmethod
     def extr_rd(instr):
         mask = np.uint32(0b11111)
@@ -723,68 +727,69 @@ class Instr:
         instr = Instr()
         instr.bin = word
 
-        if word == 0:
-            instr.op = "noop"
+        w = int(word)
+
+        if w == 0:
             return instr
 
-        op = Instr.extr_op(word)
+        op = w >> 26
 
         if op == 0:
-            instr.funct = Instr.extr_funct(word)
-            instr.op = IanMIPS.inv_funct_dict[instr.funct]
+            entry = Instr.funct_table[w & 0b111111]
         elif op == 1:
-            instr.rt = Instr.extr_rt(word)
-            instr.op = IanMIPS.inv_b_instr[instr.rt]
+            entry = Instr.regimm_table[(w >> 16) & 0b11111]
         else:
-            instr.op = IanMIPS.inv_op_dict[op]
+            entry = Instr.op_table[op]
 
-        if op == 0:
-            instr.funct = Instr.extr_funct(word)
-            if instr.op == "jr":
-                instr.rs = Instr.extr_rs(word)
-            elif instr.op in ["sll", "srl", "sra"]:
-                instr.rt = Instr.extr_rt(word)
-                instr.rd = Instr.extr_rd(word)
-                instr.shamt = Instr.extr_shamt(word)
-            elif instr.op in ["mflo", "mfhi"]:
-                instr.rd = Instr.extr_rd(word)
-            elif instr.op in ["mult", "multu", "div", "divu"]:
-                instr.rs = Instr.extr_rs(word)
-                instr.rt = Instr.extr_rt(word)
-            elif instr.op == "syscall":
-                pass
-            else:
-                instr.rs = Instr.extr_rs(word)
-                instr.rt = Instr.extr_rt(word)
-                instr.rd = Instr.extr_rd(word)
+        if entry is None:
+            raise IllegalInstructionError()
 
-        elif op == 1:
-            instr.rs = Instr.extr_rs(word)
-            instr.rt = Instr.extr_rt(word)
-            instr.imm = Instr.extr_imm(word)
-        else:
-            # op - rs - rt - imm
-            if instr.op in ["addi", "addiu", "andi", "beq", "bne", "lb", "lw", "ori", "sb", "slti", "sltiu", "sw", "xori"]:
-                instr.rs = Instr.extr_rs(word)
-                instr.rt = Instr.extr_rt(word)
-                instr.imm = Instr.extr_imm(word)
-            elif instr.op in ["blez", "bgtz"]:
-                instr.rs = Instr.extr_rs(word)
-                instr.imm = Instr.extr_imm(word)
-            elif instr.op in ["j", "jal"]:
-                instr.target = Instr.extr_target(word)
-            elif instr.op in ["lui"]:
-                instr.rt = Instr.extr_rt(word)
-                instr.imm = Instr.extr_imm(word)
-            else:
-                raise NotImplementedError()
+        instr._op, fields, args = entry
 
-        # TODO Rewrite this so it doesn't need to pass into parse_cmd again.
+        for name, shift, mask, conv in fields:
+            setattr(instr, name, conv((w >> shift) & mask))
 
-        instr.gen_args()
+        instr.args = [getattr(instr, a) for a in args]
 
         return instr
 
+    @staticmethod
+    def decode_image(image):
+        # Decode a whole program in one vectorized pass. Takes a uint32 or
+        # uint8 array, or the path of a .bin file, and returns an array of
+        # decoded_dtype records. Words that don't decode get op -1.
+
+        if type(image) is str:
+            image = np.fromfile(image, dtype=np.uint8)
+
+        image = np.asarray(image)
+
+        if image.dtype == np.uint8:
+            image = image[:len(image) // 4 * 4].view(np.uint32)
+
+        words = image.astype(np.uint32, copy=False)
+
+        op = Instr.extr_op(words)
+        rt = Instr.extr_rt(words)
+        imm = Instr.extr_imm(words)
+
+        ids = Instr.op_ids[op]
+        ids = np.where(op == 0, Instr.funct_ids[Instr.extr_funct(words)], ids)
+        ids = np.where(op == 1, Instr.regimm_ids[rt], ids)
+        ids = np.where(words == 0, MIPSI.NOOP.value, ids)
+
+        out = np.empty(len(words), dtype=decoded_dtype)
+        out["op"] = ids
+        out["rs"] = Instr.extr_rs(words)
+        out["rt"] = rt
+        out["rd"] = Instr.extr_rd(words)
+        out["shamt"] = Instr.extr_shamt(words)
+        out["imm"] = imm
+        out["simm"] = imm.astype(np.uint16).view(np.int16)
+        out["target"] = Instr.extr_target(words)
+
+        return out
+
     def encode(self):
 
         #  0 -  1 -  2 -  3 -   4   -   5
@@ -920,14 +925,122 @@ class Instr:
         return self.bin == other.bin
 
 
-class MIPSProcessor:
+# Decoding tables. Each entry is (MIPSI, fields, args): the fields to pull out
+# of the word as (attribute, shift, mask, type), and the order the handler
+# takes them in. They are indexed by opcode, by funct when the opcode is 0, and by
+# rt when the opcode is 1.
+
+decode_fields = {
+    "rs":       (21, 0b11111, int),
+    "rt":       (16, 0b11111, int),
+    "rd":       (11, 0b11111, int),
+    "shamt":    (6, 0b11111, int),
+    "funct":    (0, 0b111111, int),
+    "_imm":     (0, 0b1111111111111111, np.uint16),
+    "target":   (0, 0b11111111111111111111111111, int),
+}
+
+# (category, fields, args) using the CMDParse operand categories.
+decode_recipes = [
+    (CMDParse.cat_0, [], []),
+    (CMDParse.cat_1, ["rs", "rt", "rd"], ["rd", "rs", "rt"]),
+    (CMDParse.cat_2, ["rs", "rt", "rd"], ["rd", "rt", "rs"]),
+    (CMDParse.cat_3, ["rt", "rd", "shamt"], ["rd", "rt", "shamt"]),
+    (CMDParse.cat_4, ["rs", "rt", "_imm"], ["rt", "rs", "_imm"]),
+    (CMDParse.cat_5, ["rs", "rt", "_imm"], ["rt", "_imm", "rs"]),
+    (CMDParse.cat_6, ["rs"], ["rs"]),
+    (CMDParse.cat_7, ["target"], ["target"]),
+    (CMDParse.cat_8, ["rs", "rt"], ["rs", "rt"]),
+    (CMDParse.cat_9, ["rd"], ["rd"]),
+    (CMDParse.cat_10, ["rt", "_imm"], ["rt", "_imm"]),
+    (CMDParse.cat_11, ["rs", "_imm"], ["rs", "_imm"]),
+    (CMDParse.cat_12, ["rs", "rt", "_imm"], ["rs", "rt", "_imm"]),
+]
+
+
+def build_decode_tables():
+
+    op_table = [None] * 64
+    funct_table = [None] * 64
+    regimm_table = [None] * 32
+
+    for cat, fields, args in decode_recipes:
+        for name in cat:
+            op = IanMIPS.op_dict[name]
+            extra = []
+
+            if op == 0:
+                extra = ["funct"]
+            elif op == 1:
+                extra = ["rt"]
+
+            entry = (op_enum[name], tuple((f,) + decode_fields[f] for f in fields + extra), tuple(args))
+
+            if name == "noop":
+                continue
+            elif op == 0:
+                funct_table[IanMIPS.funct_dict[name]] = entry
+            elif op == 1:
+                regimm_table[IanMIPS.b_instr[name]] = entry
+            else:
+                op_table[op] = entry
+
+    return op_table, funct_table, regimm_table
+
+
+Instr.op_table, Instr.funct_table, Instr.regimm_table = build_decode_tables()
+
+
+def table_ids(table):
+    return np.array([-1 if e is None else e[0].value for e in table], dtype=np.int8)
+
+
+# The same tables as MIPSI values for Instr.decode_image, -1 where illegal.
+Instr.op_ids = table_ids(Instr.op_table)
+Instr.funct_ids = table_ids(Instr.funct_table)
+Instr.regimm_ids = table_ids(Instr.regimm_table)
+
+# Record fields making up each handler's args.
+Instr.record_args = {MIPSI.NOOP: ()}
+
+for e in Instr.op_table + Instr.funct_table + Instr.regimm_table:
+    if e is not None:
+        Instr.record_args[e[0]] = tuple("imm" if a == "_imm" else a for a in e[2])
+
+
+def op_usage(op):
+    # (dest arg, source args, store data arg) positions in the handler args
+    # of op, None or () where there are none. $ra written by link_ops and
+    # HI/LO aren't args and are left to the caller.
+    fields = Instr.record_args[MIPSI[op.upper()]]
+    dest = None
+    store = None
+
+    if "rd" in fields:
+        dest = fields.index("rd")
+    elif fields and fields[0] == "rt" and op not in ("sw", "sb"):
+        dest = 0
+    elif op in ("sw", "sb"):
+        store = 0
+
+    srcs = tuple(i for i, f in enumerate(fields) if f in ("rs", "rt") and i not in (dest, store))
+
+    return dest, srcs, store
+
 
-    def errcall(self, errstr, errflag):
-        if errstr == "overflow":
-            self.set_over()
+decoded_dtype = np.dtype([
+    ("op", np.int8),
+    ("rs", np.uint8),
+    ("rt", np.uint8),
+    ("rd", np.uint8),
+    ("shamt", np.uint8),
+    ("imm", np.uint16),
+    ("simm", np.int16),
+    ("target", np.uint32),
+])
 
-    def set_over(self):
-        self.over = True
+
+class MIPSProcessor:
 
     @property
     def pc(self):
@@ -971,7 +1084,7 @@ class MIPSProcessor:
     def sreg(self, value):
         raise AttributeError("Cannot assign to sreg!!")
 
-    def __init__(self, cache_size=1024):
+    def __init__(self, cache_size=1024, mem=None):
 
         self._reg = np.zeros(32, dtype=np.uint32)
 
@@ -987,49 +1100,360 @@ class MIPSProcessor:
 
         self.ir = np.uint32(0)
 
-        self.mem = np.empty(cache_size, dtype='uint8')
+        # Either a flat array of cache_size bytes, or a paged MMem passed in
+        # by the caller covering the whole address space.
+        if mem is None:
+            mem = np.empty(cache_size, dtype='uint8')
 
-        self.flush_cache()
+        self.mem = mem
+
+        # Decoded instructions keyed by PC, stored as (handler, args) so a
+        # hit can be dispatched without fetching or decoding the word again.
+        self.decoded = {}
+        self.decode_hits = 0
+        self.decode_misses = 0
+
+        # Bumped whenever decoded code is overwritten, so translated blocks
+        # know to throw themselves away.
+        self.code_gen = 0
+        self.translator = None
+        self.fault_retired = 0
+
+        # (owner, previous ops) for each set of handler wrappers installed
+        # with push_ops, innermost first.
+        self.hooks = []
 
-        self.over = False
+        # mips_profile.Profiler counting what runs, if any.
+        self.profiler = None
+
+        self.flush_cache()
 
         self.ops = {
             name.lower(): getattr(self, "_{}".format(name.lower())) for name, _ in MIPSI.__members__.items()
         }
 
-        np.seterr(over="call")
-        np.seterrcall(self.errcall)
+    def reset(self, keep=None):
+        # Back to the power-on state, keeping the allocated memory and the
+        # handler table so the processor can be reused for another run.
+        # keep is a (start, end) range whose decoded entries survive, for
+        # when the same program is loaded back there with invalidate=False.
+        self.reg[:] = [0] * len(self.reg)
+        self.hi = 0
+        self.lo = 0
+        self.pc = 0
+        self.instr_c = 0
+        self.epc = np.uint32(0)
+        self.cause = np.uint32(0)
+        self.badvaddr = np.uint32(0)
+        self.status = np.uint32(0)
+        self.ir = np.uint32(0)
+
+        if keep is None:
+            self.flush_cache()
+            return
+
+        self.mem.fill(0)
+        start, end = keep
+        stale = [a for a in self.decoded if not start <= a < end]
+
+        if stale:
+            self.code_gen += 1
+
+            for a in stale:
+                del self.decoded[a]
 
     def flush_cache(self):
 
         self.mem.fill(0)
+        self.invalidate_decoded()
 
-    def load_program(self, start_addr, program):
+    def invalidate_decoded(self, start=None, end=None):
+        # Drop decoded entries for [start, end), or everything if no range is
+        # given. Must be called after writing code into mem behind our back.
+        self.code_gen += 1
 
-        if type(program) is not np.ndarray:
-            raise ValueError()
-        elif type(program[0]) is not np.uint8:
-            raise ValueError()
+        if start is None:
+            self.decoded.clear()
+            return
 
-        try:
-            self.mem[start_addr:start_addr + len(program)] = program
-        except IndexError:
-            raise MemoryError()
+        if end is None:
+            end = start + 4
 
-    def execute_prog(self, start_point, max_instr=-1):
+        start = int(start) & ~3
+        end = int(end)
+
+        if (end - start) // 4 > len(self.decoded):
+            addrs = [k for k in self.decoded if start <= k < end]
+        else:
+            addrs = range(start, end, 4)
+
+        for addr in addrs:
+            self.decoded.pop(addr, None)
+
+    def snapshot(self):
+        # Capture the processor state. Paged memory is shared copy-on-write
+        # with the snapshot, so this costs about as much as copying the
+        # registers; a flat memory array has to be copied.
+        if isinstance(self.mem, MMem):
+            mem = self.mem.snapshot()
+        else:
+            mem = self.mem.copy()
+
+        return Snapshot(self._reg.tolist(), int(self.hi), int(self.lo), int(self.pc), self.epc, self.cause,
+                        self.badvaddr, self.status, self.instr_c, mem)
+
+    def restore(self, snap):
+        # Return to a snapshot. Decoded instructions are only dropped where
+        # memory differs from the snapshot, so restoring again and again
+        # keeps the decode cache and any translated blocks warm.
+        self._reg[:] = snap.reg
+        self.hi = snap.hi
+        self.lo = snap.lo
+        self.pc = snap.pc
+        self.epc = snap.epc
+        self.cause = snap.cause
+        self.badvaddr = snap.badvaddr
+        self.status = snap.status
+        self.instr_c = snap.instr_c
+
+        if isinstance(self.mem, MMem):
+            pages = self.mem.restore(snap.mem)
+
+            if pages is None:
+                self.invalidate_decoded()
+                return
+
+            if len(pages) * (PAGE_SIZE // 4) > len(self.decoded):
+                stale = [a for a in self.decoded if a >> PAGE_BITS in pages]
+            else:
+                stale = [a for n in pages for a in range(n << PAGE_BITS, (n + 1) << PAGE_BITS, 4)
+                         if a in self.decoded]
+        else:
+            diff = np.flatnonzero(self.mem != snap.mem)
+            self.mem[:] = snap.mem
+            stale = {int(a) & ~3 for a in diff if int(a) & ~3 in self.decoded}
+
+        if stale:
+            self.code_gen += 1
+
+            for a in stale:
+                del self.decoded[a]
+
+    @classmethod
+    def from_checkpoint(cls, path):
+        # A processor of this class restored from a checkpoint written by
+        # mips_checkpoint.
+        from mips_checkpoint import load_checkpoint
+
+        return load_checkpoint(path, cls)
+
+    def fork(self):
+        # A new processor of the same kind starting from this one's state.
+        # With paged memory the two share every page until one writes to it.
+        if isinstance(self.mem, MMem):
+            child = type(self)(mem=MMem())
+        else:
+            child = type(self)(len(self.mem))
+
+        child.restore(self.snapshot())
+
+        return child
+
+    def load_program(self, start_addr, program, invalidate=True):
+        # program is a uint8 array, a bytes-like buffer or the path of a
+        # binary, which is memory mapped rather than read. On paged memory the
+        # whole pages of a read-only program are mapped in place and only
+        # copied once the guest writes to them. invalidate=False keeps the
+        # decoded entries for the range, which is only right when reloading
+        # the exact bytes they were decoded from (see reset).
+
+        program = as_image(program)
+
+        if isinstance(self.mem, MMem):
+            self.mem.map(start_addr, program)
+        else:
+            try:
+                self.mem[start_addr:start_addr + len(program)] = program
+            except (IndexError, ValueError):
+                raise MemoryError()
+
+        if invalidate:
+            self.invalidate_decoded(start_addr, start_addr + len(program))
+
+    def execute_prog(self, start_point, max_instr=-1, translate=False, **stop):
+        # Run from start_point. See run for the stop conditions.
 
         self.pc = start_point
         self.reg[MIPSR.GP.value] = start_point
         self.reg[MIPSR.FP.value] = start_point
 
+        return self.run(max_instr, translate, **stop)
+
+    def run(self, max_instr=-1, translate=False, halt=False, stop_at=(), until=None, syscall_exit=False,
+            resume=False):
+        # Run from the current PC until one of the stop conditions holds,
+        # returning a RunResult with the reason and the number of instructions
+        # retired. The count is also added to instr_c, even if the run ends in
+        # a trap.
+        #
+        # halt:         stop once a branch or jump targets itself.
+        # stop_at:      addresses to stop at, before executing them. The PC the
+        #               run starts at only counts when reached again, unless
+        #               resume is set.
+        # until:        called with the processor after each branch or jump,
+        #               stops the run when it returns True.
+        # syscall_exit: a syscall with $v0 = 10 or 17 ends the run instead of
+        #               raising SoftwareInterrupt.
+        # resume:       the run carries on from an earlier one that stopped
+        #               for some other reason, so stop_at applies to the
+        #               starting PC too.
+        #
+        # With hooks installed translate is ignored, since translated blocks
+        # don't go through the handlers the hooks wrap.
+
+        if translate and not self.hooks:
+            # Imported here since mips_block builds on this module.
+            from mips_block import BlockTranslator
+
+            if self.translator is None:
+                self.translator = BlockTranslator(self)
+
+            return self.translator.run(max_instr, halt, stop_at, until, syscall_exit, resume)
+
         exec_counter = 0
+        hits = 0
+        misses = 0
+        decoded = self.decoded
+        stop_at = frozenset(int(a) for a in stop_at)
+        reason = StopReason.MAX_INSTR
+
+        # The profiler only needs to know where the run starts, where each
+        # branch or jump lands and where the run ends.
+        prof = self.profiler
+        pc = int(self._pc)
+        landings = defaultdict(int, {pc: 1})
+        end_pc = None
+        checks = halt or until is not None or prof is not None
 
-        while max_instr == -1 or exec_counter < max_instr:
+        try:
+            while max_instr == -1 or exec_counter < max_instr:
+                pc = int(self._pc)
+
+                if stop_at and (exec_counter or resume) and pc in stop_at:
+                    reason = StopReason.STOP_PC
+                    break
+
+                entry = decoded.get(pc)
+
+                # Counted as looked up, so an instruction that fails to
+                # decode or traps still shows up in hits + misses.
+                if entry is None:
+                    misses += 1
+                    self.fetch()
+                    self.decode()
+                    # print(self.instr)
+                    entry = self.decode_entry(self.instr.op, self.instr.args)
+                    decoded[pc] = entry
+                else:
+                    hits += 1
+
+                entry[0](*entry[1])
+                exec_counter += 1
+
+                if checks and entry[2]:
+                    if prof is not None:
+                        landings[int(self._pc)] += 1
+
+                    if halt and int(self._pc) == pc:
+                        reason = StopReason.HALT
+                        break
+
+                    if until is not None and until(self):
+                        reason = StopReason.PREDICATE
+                        break
+
+            end_pc = int(self._pc)
+        except SoftwareInterrupt:
+            if not syscall_exit or int(self.reg[MIPSR.V0]) not in exit_syscalls:
+                raise
+
+            exec_counter += 1
+            reason = StopReason.EXIT
+            end_pc = int(self._pc)
+        finally:
+            self.decode_misses += misses
+            self.decode_hits += hits
+            self.instr_c += exec_counter
+
+            # After a trap the instruction at pc didn't retire.
+            if prof is not None:
+                prof.record(landings, pc if end_pc is None else end_pc, exec_counter)
+
+        return RunResult(reason, exec_counter)
+
+    def step(self):
+        # Execute a single instruction through the decoded cache.
+        pc = int(self._pc)
+        entry = self.decoded.get(pc)
+
+        if entry is None:
+            self.decode_misses += 1
             self.fetch()
             self.decode()
-            # print(self.instr)
-            self.execute()
-            exec_counter += 1
+            entry = self.decode_entry(self.instr.op, self.instr.args)
+            self.decoded[pc] = entry
+        else:
+            self.decode_hits += 1
+
+        entry[0](*entry[1])
+
+    def push_ops(self, owner, ops):
+        # Install a new handler table, normally wrappers around the current
+        # handlers, on behalf of owner (a cache model, tracer or timing
+        # model). Until it is removed again every instruction runs in the
+        # interpreter through these handlers.
+        if any(o is owner for o, _ in self.hooks):
+            raise ValueError("{} is already attached.".format(owner))
+
+        self.hooks.append((owner, self.ops))
+        self.ops = ops
+
+        # Decoded entries hold the old handlers.
+        self.invalidate_decoded()
+
+    def pop_ops(self, owner):
+        # Remove owner's handlers, which must be the last ones installed.
+        if not self.hooks or self.hooks[-1][0] is not owner:
+            raise ValueError("Hooks must be removed in the reverse order they were added.")
+
+        _, self.ops = self.hooks.pop()
+        self.invalidate_decoded()
+
+    def decode_entry(self, op, args):
+        # The (handler, args, transfers control) entry kept in the decoded
+        # cache.
+        return self.ops[op], args, op in control_ops
+
+    def predecode(self, start=0, end=None):
+        # Fill the decoded cache for [start, end) from one vectorized decode
+        # of memory instead of decoding each word the first time it runs.
+        # On paged memory only the allocated pages are decoded.
+        start = int(start) & ~3
+
+        if isinstance(self.mem, MMem):
+            spans = list(self.mem.allocated(start, end))
+        else:
+            spans = [(start, (len(self.mem) if end is None else int(end)) - start)]
+
+        for start, n in spans:
+            image = Instr.decode_image(self.mem[start:start + n // 4 * 4])
+
+            for i in np.flatnonzero(image["op"] >= 0):
+                rec = image[i]
+                op = MIPSI(int(rec["op"]))
+
+                args = [rec[f] for f in Instr.record_args[op]]
+                self.decoded[start + 4 * int(i)] = self.decode_entry(op.name.lower(), args)
 
     def fetch(self):
 
@@ -1052,34 +1476,32 @@ class MIPSProcessor:
     def _add(self, rd, rs, rt):
         # Add two 32 bit GPRs, store in third. Traps on overflow.
         self.pc += 4
-        res = self.sreg[rs] + self.sreg[rt]
+        res = s32(self.reg[rs]) + s32(self.reg[rt])
 
-        if self.over:
-            self.over = False
+        if not -0x80000000 <= res <= 0x7fffffff:
             raise IntegerOverflow()
 
-        self.reg[rd] = res
+        self.reg[rd] = u32(res)
 
     def _addi(self, rt, rs, imm):
         # Add 16 bit signed imm to rs, then store in rt. Traps on overflow.
         self.pc += 4
-        res = self.sreg[rs] + np.int16(imm)
+        res = s32(self.reg[rs]) + s16(imm)
 
-        if self.over:
-            self.over = False
+        if not -0x80000000 <= res <= 0x7fffffff:
             raise IntegerOverflow()
 
-        self.reg[rt] = res
+        self.reg[rt] = u32(res)
 
     def _addiu(self, rt, rs, imm):
         # Add 16 bit signed imm to rs, then store in rt.
         self.pc += 4
-        self.reg[rt] = self.reg[rs] + np.int16(imm)
+        self.reg[rt] = u32(int(self.reg[rs]) + s16(imm))
 
     def _addu(self, rd, rs, rt):
         # Add two 32 bit GPRs, store in third.
         self.pc += 4
-        self.reg[rd] = self.reg[rs] + self.reg[rt]
+        self.reg[rd] = u32(int(self.reg[rs]) + int(self.reg[rt]))
 
     def _and(self, rd, rs, rt):
         # Bitwise and of two GPR, stores in a third.
@@ -1252,10 +1674,13 @@ class MIPSProcessor:
 
     def _sb(self, rt, offset, rs):
 
-        start = self.reg[rs] + offset
+        start = self.reg[rs] + np.int16(offset)
 
         self.mem[start] = np.uint8(np.bitwise_and(0xff, self.reg[rt]))
 
+        if self.decoded.pop(int(start) & ~3, None) is not None:
+            self.code_gen += 1
+
         self.pc += 4
 
     def _sll(self, rd, rt, shamt):
@@ -1281,7 +1706,7 @@ class MIPSProcessor:
     def _slti(self, rt, rs, imm):
         self.pc += 4
 
-        if np.int32(self.reg[rs]) < np.int32(imm):
+        if np.int32(self.reg[rs]) < np.int32(np.int16(imm)):
             self.reg[rt] = 1
         else:
             self.reg[rt] = 0
@@ -1323,21 +1748,18 @@ class MIPSProcessor:
 
     def _sub(self, rd, rs, rt):
         # Subtact two 32 bit GPRs, store in third. Traps on overflow
-        a = self.sreg[rs]
-        b = self.sreg[rt]
-        c = a - b
+        c = s32(self.reg[rs]) - s32(self.reg[rt])
 
-        if self.over:
-            self.over = False
+        if not -0x80000000 <= c <= 0x7fffffff:
             raise IntegerOverflow()
 
-        self.reg[rd] = c
+        self.reg[rd] = u32(c)
 
         self.pc += 4
 
     def _subu(self, rd, rs, rt):
         # Subtact two 32 bit GPRs, store in third. Does not trap on overflow
-        self.reg[rd] = self.reg[rs] - self.reg[rt]
+        self.reg[rd] = u32(int(self.reg[rs]) - int(self.reg[rt]))
 
         self.pc += 4
 
@@ -1350,6 +1772,8 @@ class MIPSProcessor:
             raise AddressError
 
         self.mem[eff_addr:eff_addr + 4] = np.uint32([self.reg[rt]]).view('uint8')
+        if self.decoded.pop(int(eff_addr), None) is not None:
+            self.code_gen += 1
 
     def _syscall(self):
         self.pc += 4
@@ -1364,6 +1788,370 @@ class MIPSProcessor:
         self.reg[rt] = np.bitwise_xor(self.reg[rs], imm)
 
 
+class IntRegFile:
+    # Register file backed by a list of Python ints. Values are wrapped to 32
+    # bits on the way in, the same way assigning into a uint32 array would.
+
+    def __init__(self, size=32):
+        self._r = [0] * size
+
+    def __getitem__(self, key):
+        return self._r[key]
+
+    def __setitem__(self, key, value):
+        if type(key) is slice:
+            self._r[key] = [u32(v) for v in value]
+        else:
+            self._r[key] = int(value) & 0xffffffff
+
+    def __len__(self):
+        return len(self._r)
+
+    def __iter__(self):
+        return iter(self._r)
+
+    def __repr__(self):
+        return "IntRegFile({})".format(self._r)
+
+    def tolist(self):
+        return list(self._r)
+
+
+class IntMIPSProcessor(MIPSProcessor):
+    # MIPSProcessor with the registers, HI/LO and PC held as Python ints.
+    # Scalar arithmetic on ints is several times cheaper than on NumPy
+    # scalars, memory is still the same uint8 array.
+
+    @property
+    def pc(self):
+        return self._pc
+
+    @pc.setter
+    def pc(self, value):
+        self._pc = int(value) & 0xffffffff
+
+    @property
+    def hi(self):
+        return self._hi
+
+    @hi.setter
+    def hi(self, value):
+        self._hi = int(value) & 0xffffffff
+
+    @property
+    def lo(self):
+        return self._lo
+
+    @lo.setter
+    def lo(self, value):
+        self._lo = int(value) & 0xffffffff
+
+    @property
+    def sreg(self):
+        return [s32(v) for v in self._reg._r]
+
+    def __init__(self, cache_size=1024, mem=None):
+
+        super().__init__(cache_size, mem)
+
+        self._reg = IntRegFile()
+        self._hi = 0
+        self._lo = 0
+        self._pc = 0
+
+    def decode_entry(self, op, args):
+        return self.ops[op], [int(a) for a in args], op in control_ops
+
+    def _add(self, rd, rs, rt):
+        r = self._reg._r
+        self._pc = (self._pc + 4) & 0xffffffff
+        res = s32(r[rs]) + s32(r[rt])
+
+        if not -0x80000000 <= res <= 0x7fffffff:
+            raise IntegerOverflow()
+
+        r[rd] = res & 0xffffffff
+
+    def _addi(self, rt, rs, imm):
+        r = self._reg._r
+        self._pc = (self._pc + 4) & 0xffffffff
+        res = s32(r[rs]) + s16(imm)
+
+        if not -0x80000000 <= res <= 0x7fffffff:
+            raise IntegerOverflow()
+
+        r[rt] = res & 0xffffffff
+
+    def _addiu(self, rt, rs, imm):
+        r = self._reg._r
+        self._pc = (self._pc + 4) & 0xffffffff
+        r[rt] = (r[rs] + s16(imm)) & 0xffffffff
+
+    def _addu(self, rd, rs, rt):
+        r = self._reg._r
+        self._pc = (self._pc + 4) & 0xffffffff
+        r[rd] = (r[rs] + r[rt]) & 0xffffffff
+
+    def _and(self, rd, rs, rt):
+        r = self._reg._r
+        self._pc = (self._pc + 4) & 0xffffffff
+        r[rd] = r[rs] & r[rt]
+
+    def _andi(self, rt, rs, imm):
+        r = self._reg._r
+        self._pc = (self._pc + 4) & 0xffffffff
+        r[rt] = r[rs] & u32(imm)
+
+    def _branch(self, taken, offset):
+        if taken:
+            self._pc = (self._pc + 4 + s16(offset) * 4) & 0xffffffff
+        else:
+            self._pc = (self._pc + 4) & 0xffffffff
+
+    def _beq(self, rs, rt, offset):
+        r = self._reg._r
+        self._branch(r[rs] == r[rt], offset)
+
+    def _bgez(self, rs, offset):
+        self._branch(self._reg._r[rs] < 0x80000000, offset)
+
+    def _bgezal(self, rs, offset):
+        r = self._reg._r
+        taken = r[rs] < 0x80000000
+
+        if taken:
+            r[31] = (self._pc + 8) & 0xffffffff
+
+        self._branch(taken, offset)
+
+    def _bgtz(self, rs, offset):
+        self._branch(0 < self._reg._r[rs] < 0x80000000, offset)
+
+    def _blez(self, rs, offset):
+        self._branch(s32(self._reg._r[rs]) <= 0, offset)
+
+    def _bltz(self, rs, offset):
+        self._branch(self._reg._r[rs] >= 0x80000000, offset)
+
+    def _bltzal(self, rs, offset):
+        r = self._reg._r
+        taken = r[rs] >= 0x80000000
+
+        if taken:
+            r[31] = (self._pc + 8) & 0xffffffff
+
+        self._branch(taken, offset)
+
+    def _bne(self, rs, rt, offset):
+        r = self._reg._r
+        self._branch(r[rs] != r[rt], offset)
+
+    def _div(self, rs, rt):
+        # Quotient truncates toward zero, the remainder follows the sign of
+        # the divisor like the NumPy backend does. Division by zero zeroes
+        # HI/LO, which is also where the NumPy backend ends up.
+        r = self._reg._r
+        self._pc = (self._pc + 4) & 0xffffffff
+        a = s32(r[rs])
+        b = s32(r[rt])
+
+        if b == 0:
+            self._hi = self._lo = 0
+            return
+
+        q = abs(a) // abs(b)
+        self._lo = (q if (a < 0) == (b < 0) else -q) & 0xffffffff
+        self._hi = (a % b) & 0xffffffff
+
+    def _divu(self, rs, rt):
+        r = self._reg._r
+        self._pc = (self._pc + 4) & 0xffffffff
+        a = r[rs]
+        b = r[rt]
+
+        if b == 0:
+            self._hi = self._lo = 0
+            return
+
+        self._lo = a // b
+        self._hi = a % b
+
+    def _j(self, target):
+        self._pc = (self._pc & 0xf0000000) | ((int(target) * 4) & 0xffffffff)
+
+    def _jal(self, target):
+        self._reg._r[31] = (self._pc + 8) & 0xffffffff
+        self._pc = (self._pc & 0xf0000000) | ((int(target) * 4) & 0xffffffff)
+
+    def _jr(self, rs):
+        r = self._reg._r
+
+        if r[rs] % 4 != 0:
+            raise AddressError()
+
+        self._pc = r[rs]
+
+    def _lb(self, rt, offset, rs):
+        r = self._reg._r
+        self._pc = (self._pc + 4) & 0xffffffff
+
+        e = int(self.mem[r[rs] + s16(offset)])
+
+        r[rt] = e | 0xffffff00 if e & 0x80 else e
+
+    def _lui(self, rt, imm):
+        self._pc = (self._pc + 4) & 0xffffffff
+        self._reg._r[rt] = (int(imm) << 16) & 0xffffffff
+
+    def _lw(self, rt, offset, rs):
+        r = self._reg._r
+        self._pc = (self._pc + 4) & 0xffffffff
+        loc = r[rs] + s16(offset)
+
+        r[rt] = int(self.mem[loc:loc + 4].view('uint32')[0])
+
+    def _mfhi(self, rd):
+        self._pc = (self._pc + 4) & 0xffffffff
+        self._reg._r[rd] = self._hi
+
+    def _mflo(self, rd):
+        self._pc = (self._pc + 4) & 0xffffffff
+        self._reg._r[rd] = self._lo
+
+    def _mult(self, rs, rt):
+        r = self._reg._r
+        self._pc = (self._pc + 4) & 0xffffffff
+        res = s32(r[rs]) * s32(r[rt])
+        self._hi = (res >> 32) & 0xffffffff
+        self._lo = res & 0xffffffff
+
+    def _multu(self, rs, rt):
+        r = self._reg._r
+        self._pc = (self._pc + 4) & 0xffffffff
+        res = r[rs] * r[rt]
+        self._hi = res >> 32
+        self._lo = res & 0xffffffff
+
+    def _noop(self):
+        self._pc = (self._pc + 4) & 0xffffffff
+
+    def _or(self, rd, rs, rt):
+        r = self._reg._r
+        self._pc = (self._pc + 4) & 0xffffffff
+        r[rd] = r[rs] | r[rt]
+
+    def _ori(self, rt, rs, imm):
+        r = self._reg._r
+        self._pc = (self._pc + 4) & 0xffffffff
+        r[rt] = r[rs] | u32(imm)
+
+    def _sb(self, rt, offset, rs):
+        r = self._reg._r
+        start = r[rs] + s16(offset)
+
+        self.mem[start] = r[rt] & 0xff
+
+        if self.decoded.pop(start & ~3, None) is not None:
+            self.code_gen += 1
+
+        self._pc = (self._pc + 4) & 0xffffffff
+
+    def _sll(self, rd, rt, shamt):
+        r = self._reg._r
+        self._pc = (self._pc + 4) & 0xffffffff
+        r[rd] = (r[rt] << int(shamt)) & 0xffffffff
+
+    def _sllv(self, rd, rt, rs):
+        r = self._reg._r
+        self._pc = (self._pc + 4) & 0xffffffff
+        r[rd] = (r[rt] << (r[rs] & 0b11111)) & 0xffffffff
+
+    def _slt(self, rd, rs, rt):
+        r = self._reg._r
+        self._pc = (self._pc + 4) & 0xffffffff
+        r[rd] = 1 if s32(r[rs]) < s32(r[rt]) else 0
+
+    def _slti(self, rt, rs, imm):
+        r = self._reg._r
+        self._pc = (self._pc + 4) & 0xffffffff
+        r[rt] = 1 if s32(r[rs]) < s16(imm) else 0
+
+    def _sltiu(self, rt, rs, imm):
+        r = self._reg._r
+        self._pc = (self._pc + 4) & 0xffffffff
+        r[rt] = 1 if r[rs] < (s16(imm) & 0xffffffff) else 0
+
+    def _sltu(self, rd, rs, rt):
+        r = self._reg._r
+        self._pc = (self._pc + 4) & 0xffffffff
+        r[rd] = 1 if r[rs] < r[rt] else 0
+
+    def _sra(self, rd, rt, shamt):
+        r = self._reg._r
+        self._pc = (self._pc + 4) & 0xffffffff
+        r[rd] = (s32(r[rt]) >> int(shamt)) & 0xffffffff
+
+    def _srl(self, rd, rt, shamt):
+        r = self._reg._r
+        self._pc = (self._pc + 4) & 0xffffffff
+        r[rd] = r[rt] >> int(shamt)
+
+    def _srlv(self, rd, rt, rs):
+        r = self._reg._r
+        self._pc = (self._pc + 4) & 0xffffffff
+        r[rd] = r[rt] >> r[rs]
+
+    def _sub(self, rd, rs, rt):
+        r = self._reg._r
+        res = s32(r[rs]) - s32(r[rt])
+
+        if not -0x80000000 <= res <= 0x7fffffff:
+            raise IntegerOverflow()
+
+        r[rd] = res & 0xffffffff
+
+        self._pc = (self._pc + 4) & 0xffffffff
+
+    def _subu(self, rd, rs, rt):
+        r = self._reg._r
+        r[rd] = (r[rs] - r[rt]) & 0xffffffff
+
+        self._pc = (self._pc + 4) & 0xffffffff
+
+    def _sw(self, rt, offset, rs):
+        r = self._reg._r
+        self._pc = (self._pc + 4) & 0xffffffff
+        eff_addr = r[rs] + s16(offset)
+
+        if eff_addr % 4 != 0:
+            raise AddressError
+
+        self.mem[eff_addr:eff_addr + 4] = np.uint32([r[rt]]).view('uint8')
+
+        if self.decoded.pop(eff_addr, None) is not None:
+            self.code_gen += 1
+
+    def _syscall(self):
+        self._pc = (self._pc + 4) & 0xffffffff
+        raise SoftwareInterrupt()
+
+    def _xor(self, rd, rs, rt):
+        r = self._reg._r
+        self._pc = (self._pc + 4) & 0xffffffff
+        r[rd] = r[rs] ^ r[rt]
+
+    def _xori(self, rt, rs, imm):
+        r = self._reg._r
+        self._pc = (self._pc + 4) & 0xffffffff
+        r[rt] = r[rs] ^ u32(imm)
+
+
+backends = {
+    "numpy": MIPSProcessor,
+    "int": IntMIPSProcessor,
+}
+
+
 # Static checks to ensure everything is correct.
 assert(all([op in IanMIPS.op_dict.keys() for op in CMDParse.oplist]))
 
@@ -1398,26 +2186,138 @@ def is_valid_file(filename):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(prog='My barebones MIPS simulator',
                                      description='')
-    parser.add_argument(dest='file', type=str,
+    parser.add_argument(dest='file', type=str, nargs='?',
                         help="Binary file to run.")
     parser.add_argument('-d', '--debug', action='store_true', dest='debug', default=False,
                         help='Debug mode.')
+    parser.add_argument('-t', '--translate', action='store_true', dest='translate', default=False,
+                        help='Run through the basic block translator.')
+    parser.add_argument('-n', '--max-instr', type=int, dest='max_instr', default=1000,
+                        help='Instruction budget, -1 for none.')
+    parser.add_argument('-b', '--backend', choices=sorted(backends.keys()), dest='backend', default='numpy',
+                        help='Register file backend.')
+    parser.add_argument('--checkpoint', type=str, dest='checkpoint', default=None,
+                        help='Write checkpoints as CHECKPOINT-NNNNNN.npz on SIGUSR1.')
+    parser.add_argument('--checkpoint-every', type=int, dest='every', default=None,
+                        help='Also checkpoint every N instructions.')
+    parser.add_argument('--paged', action='store_true', dest='paged', default=False,
+                        help='Use sparse paged memory, which makes checkpoints after the first incremental.')
+    parser.add_argument('--resume', type=str, dest='resume', default=None,
+                        help='Continue from a checkpoint instead of loading a file.')
+    parser.add_argument('--l1i', type=str, dest='l1i', default=None,
+                        help='Simulate an L1 I-cache, given as size:assoc:line[:lru|fifo|random].')
+    parser.add_argument('--l1d', type=str, dest='l1d', default=None,
+                        help='Simulate an L1 D-cache, same format as --l1i.')
+    parser.add_argument('--l2', type=str, dest='l2', default=None,
+                        help='Simulate a unified L2 behind the L1 caches.')
+    parser.add_argument('--trace', type=str, dest='trace', default=None,
+                        help='Record the fetch and load/store address trace to TRACE (.npz) for mips_cache.py.')
+    parser.add_argument('--exec-trace', type=str, dest='exec_trace', default=None,
+                        help='Record every retired instruction to EXEC_TRACE, see mips_trace.py.')
+    parser.add_argument('--timing', action='store_true', dest='timing', default=False,
+                        help='Estimate cycles on a 5-stage pipeline.')
+    parser.add_argument('--profile', action='store_true', dest='profile', default=False,
+                        help='Count executions per instruction and opcode.')
+    parser.add_argument('--labels', type=str, dest='labels', default=None,
+                        help='Assembly source of the binary, to name hot spots in the profile.')
 
     args = parser.parse_args()
 
-    p = MIPSProcessor()
+    # Build processors from the importable module rather than __main__, so
+    # their classes and exceptions are the ones mips_block and
+    # mips_checkpoint see.
+    from mips_sim import backends
+
+    if args.resume is not None:
+        p = backends[args.backend].from_checkpoint(args.resume)
+    else:
+        if args.file is None or not is_valid_file(args.file):
+            parser.error("a binary file is needed unless resuming")
+
+        p = backends[args.backend](mem=MMem() if args.paged else None)
+        p.load_program(12, args.file)
+
+        p.pc = 12
+        p.reg[MIPSR.GP.value] = 12
+        p.reg[MIPSR.FP.value] = 12
+
+    caches = None
+    recorder = None
 
-    assert(is_valid_file(args.file))
+    if args.trace is not None:
+        from mips_cache import TraceRecorder
 
-    tmpbuf = np.fromfile(args.file, np.uint8)
+        recorder = TraceRecorder()
+        recorder.attach(p)
 
-    p.load_program(12, tmpbuf)
+    if args.l1i or args.l1d or args.l2:
+        from mips_cache import CacheHierarchy, parse_spec
 
-    p.execute_prog(12, 1000)
+        caches = CacheHierarchy(*[parse_spec(s, n) if s else None for s, n in
+                                  [(args.l1i, "L1I"), (args.l1d, "L1D"), (args.l2, "L2")]])
+        caches.attach(p)
+
+    tracer = None
+
+    if args.exec_trace is not None:
+        from mips_trace import ExecTracer
+
+        tracer = ExecTracer(path=args.exec_trace)
+        tracer.attach(p)
+
+    pipeline = None
+
+    if args.timing:
+        from mips_pipeline import PipelineModel
+
+        pipeline = PipelineModel()
+        pipeline.attach(p)
+
+    profiler = None
+
+    if args.profile:
+        from mips_profile import Profiler
+
+        profiler = Profiler()
+        profiler.attach(p)
+
+    if args.checkpoint is not None:
+        from mips_checkpoint import Checkpointer
+
+        c = Checkpointer(p, args.checkpoint)
+        c.install()
+
+        res = c.run(args.max_instr, args.every, args.translate, halt=True, syscall_exit=True)
+    else:
+        res = p.run(args.max_instr, args.translate, halt=True, syscall_exit=True)
+
+    print("Stopped ({}) after {} instructions".format(res.reason.name.lower(), res.count))
 
     print("t0 = {}".format(p.reg[MIPSR.T0]))
     print("t1 = {}".format(p.reg[MIPSR.T1]))
     print("t2 = {}".format(p.reg[MIPSR.T2]))
     print("t3 = {}".format(p.reg[MIPSR.T3]))
 
+    if caches is not None:
+        print(caches.report())
+
+    if pipeline is not None:
+        print(pipeline.report())
+
+    if profiler is not None:
+        symbols = None
+
+        if args.labels is not None:
+            from mips_assembler import read_labels
+
+            symbols = read_labels(args.labels, 12)
+
+        print(profiler.report(symbols=symbols))
+
+    if recorder is not None:
+        recorder.save(args.trace)
+
+    if tracer is not None:
+        tracer.close()
+
 # End of file
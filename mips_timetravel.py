@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+# Reverse execution for a MIPSProcessor.
+#
+# TimeTravel.run runs the processor forward like MIPSProcessor.run, taking
+# a snapshot every `interval` instructions (by instr_c). Going back to an
+# earlier instruction restores the nearest snapshot at or before it and
+# replays forward; the simulator is deterministic, so the replay retraces
+# the original run exactly. A step back therefore never replays more than
+# `interval` instructions, however long the run has been.
+#
+# Only the `keep` most recent snapshots are kept, plus the one taken when
+# TimeTravel was created. With paged memory a snapshot costs the registers
+# and the pages written during its interval (see MMem.snapshot); with flat
+# memory it is a copy of all of it. Seeking to before the oldest kept
+# snapshot still works, but replays from the start.
+#
+# Running forward from the past starts a new history: snapshots after the
+# current point are dropped, and the current state becomes a snapshot so
+# changes made to it are replayed too. Changes made at the end of history
+# need mark() before running on.
+
+from bisect import bisect_right
+
+from mips_sim import StopReason, RunResult
+
+
+class TimeTravel:
+
+    def __init__(self, proc, interval=10000, keep=100, translate=False):
+        if interval <= 0 or keep < 0:
+            raise ValueError("Snapshot interval must be positive and keep not negative.")
+
+        self.proc = proc
+        self.interval = interval
+        self.keep = keep
+        self.translate = translate
+
+        self.snaps = [proc.snapshot()]
+        self.times = [proc.instr_c]
+
+        # The furthest instruction reached in this history.
+        self.end = proc.instr_c
+
+    @property
+    def now(self):
+        return self.proc.instr_c
+
+    def take(self):
+        if self.times[-1] == self.now:
+            return
+
+        self.mark()
+
+    def mark(self):
+        # Snapshot the current state, replacing any snapshot already taken
+        # at this point. In the past this starts a new history.
+        if self.now < self.end:
+            self.truncate()
+
+        if self.times[-1] == self.now:
+            self.snaps.pop()
+            self.times.pop()
+
+        self.snaps.append(self.proc.snapshot())
+        self.times.append(self.now)
+
+        # The first snapshot is kept to go back to the start.
+        if len(self.snaps) > self.keep + 1:
+            del self.snaps[1]
+            del self.times[1]
+
+    def truncate(self):
+        # Forget everything after the current point.
+        k = bisect_right(self.times, self.now)
+        del self.snaps[k:]
+        del self.times[k:]
+        self.end = self.now
+
+    def run(self, max_instr=-1, **stop):
+        # MIPSProcessor.run, recording history as it goes.
+        p = self.proc
+        count = 0
+        resume = stop.pop("resume", False)
+
+        if self.now < self.end:
+            self.mark()
+
+        try:
+            while max_instr == -1 or count < max_instr:
+                n = self.interval - self.now % self.interval
+
+                if max_instr != -1:
+                    n = min(n, max_instr - count)
+
+                # Past the first run a stop address on a snapshot boundary
+                # still has to stop it.
+                res = p.run(n, self.translate, resume=resume, **stop)
+                count += res.count
+                resume = True
+
+                if self.now % self.interval == 0:
+                    self.take()
+
+                if res.reason != StopReason.MAX_INSTR:
+                    return RunResult(res.reason, count)
+        finally:
+            self.end = max(self.end, self.now)
+
+        return RunResult(StopReason.MAX_INSTR, count)
+
+    def seek(self, n):
+        # Put the processor in the state it had before instruction n (by
+        # instr_c) of this history ran.
+        if not self.times[0] <= n <= self.end:
+            raise ValueError("Instruction {} is outside the history {}-{}.".format(n, self.times[0], self.end))
+
+        k = bisect_right(self.times, n) - 1
+
+        # Replay from where we are if that is closer.
+        if not self.times[k] <= self.now <= n:
+            self.proc.restore(self.snaps[k])
+
+        while self.now < n:
+            self.replay(n)
+
+    def replay(self, n, **stop):
+        # Run on towards instruction n of this history. A syscall only
+        # retires in it by ending a run with syscall_exit, so replays take
+        # the same way past it rather than trapping.
+        return self.proc.run(n - self.now, self.translate, syscall_exit=True, **stop)
+
+    def step_back(self, count=1):
+        self.seek(max(self.times[0], self.now - count))
+
+    def reverse_continue(self, stop_at):
+        # Go back to the last time before now the PC was at one of stop_at.
+        # Returns a RunResult with STOP_PC and the number of instructions
+        # gone back, or MAX_INSTR if the start of history was reached.
+        stop_at = frozenset(int(a) for a in stop_at)
+        p = self.proc
+        start = self.now
+        target = start
+
+        for k in range(bisect_right(self.times, target - 1) - 1, -1, -1):
+            hit = None
+            resume = True
+            p.restore(self.snaps[k])
+
+            # The snapshot's own PC counts, then each stop is passed over
+            # to find the next.
+            while self.now < target:
+                res = self.replay(target, stop_at=stop_at, resume=resume)
+                resume = False
+
+                if res.reason == StopReason.STOP_PC and self.now < target:
+                    hit = self.now
+
+            if hit is not None:
+                self.seek(hit)
+                return RunResult(StopReason.STOP_PC, start - hit)
+
+            target = self.times[k]
+
+        self.seek(self.times[0])
+
+        return RunResult(StopReason.MAX_INSTR, start - self.times[0])
@@ -0,0 +1,551 @@
+#!/usr/bin/env python3
+
+# Execution traces of a MIPSProcessor.
+#
+# An ExecTracer wraps the processor's handlers, like the cache models, and
+# records one entry per retired instruction:
+#
+#   pc      address of the instruction
+#   word    the instruction word
+#   dest    register written, HILO for mult/div, NO_DEST for none
+#   value   value written to dest (LO for mult/div), or the data stored by
+#           sw/sb
+#   addr    address loaded or stored, HI for mult/div
+#
+# Records go into a preallocated structured array used as a ring buffer.
+# Without a file the buffer keeps the most recent records. With one, every
+# full buffer is appended to the file as a .npy array, so a trace file is a
+# sequence of .npy chunks that read_trace or plain np.load can read back
+# without the simulator. Instructions that trap aren't recorded, syscalls
+# are recorded when reached.
+#
+# A StateTraceWriter keeps only what each instruction changed, for traces
+# too long to keep whole. It writes a directory of compressed segments,
+# seg-NNNNNNNNNNNN.npz named by the index of their first instruction. Each
+# segment starts with a keyframe: the registers, HI/LO and PC, and the
+# memory pages written since the previous keyframe (all of memory in the
+# first). Then comes one delta per instruction: its PC as an offset from
+# pc + 4 of the one before, which is almost always 0, and the register,
+# HI/LO, word or byte it wrote. Every `full_every` segments the keyframe
+# holds all of memory again.
+#
+# close() also writes index.npz: each segment's start, length and whether
+# its keyframe is full, and the pages in each keyframe. StateTrace loads
+# only that when opening a trace. It finds the segment holding instruction
+# N by bisecting the segment starts, and its memory from the newest copy of
+# each page between the last full keyframe and that segment, so seeking
+# costs O(log n) plus at most full_every keyframes and one segment's
+# replay, however long the trace.
+
+import argparse
+import os
+from bisect import bisect_right
+from collections import namedtuple
+
+import numpy as np
+
+from generic_memory import MMem, PAGE_BITS, PAGE_SIZE
+from mips_sim import Instr, MIPSR, s16, link_ops, muldiv_ops, op_usage
+
+M32 = 0xffffffff
+
+record_dtype = np.dtype([
+    ("pc", "<u4"),
+    ("word", "<u4"),
+    ("dest", "i1"),
+    ("value", "<u4"),
+    ("addr", "<u4"),
+])
+
+NO_DEST = -1
+HILO = 32
+
+# dest values of stores in state traces.
+STORE_WORD = -2
+STORE_BYTE = -3
+
+# State before an instruction of a StateTrace. mem is an MMem, or a flat
+# array if the traced processor had one.
+TraceState = namedtuple("TraceState", ["index", "reg", "hi", "lo", "pc", "mem"])
+
+segment_name = "seg-{:012d}.npz"
+index_name = "index.npz"
+
+
+class ExecTracer:
+
+    def __init__(self, size=1 << 16, path=None):
+        if size <= 0:
+            raise ValueError("Trace buffer must hold at least one record.")
+
+        self.buf = np.zeros(size, dtype=record_dtype)
+        self.n = 0
+        self.count = 0
+        self.wrapped = False
+        self.path = path
+        self.file = None
+
+        # Instruction words by address, valid for one proc.code_gen.
+        self.words = {}
+        self.code_gen = None
+
+    def word(self, proc, pc):
+        if proc.code_gen != self.code_gen:
+            self.words.clear()
+            self.code_gen = proc.code_gen
+
+        w = self.words.get(pc)
+
+        if w is None:
+            if isinstance(proc.mem, MMem):
+                w = proc.mem.load_word(pc)
+            else:
+                w = int(proc.mem[pc:pc + 4].view('uint32')[0])
+
+            self.words[pc] = w
+
+        return w
+
+    def append(self, rec):
+        self.buf[self.n] = rec
+        self.n += 1
+        self.count += 1
+
+        if self.n == len(self.buf):
+            self.overflow()
+
+    def overflow(self):
+        # The buffer is full: write it out, or start overwriting it.
+        if self.file is not None:
+            self.flush()
+        else:
+            self.n = 0
+            self.wrapped = True
+
+    def flush(self):
+        # Write out the buffered records if there is a file.
+        if self.file is not None and self.n:
+            np.save(self.file, self.buf[:self.n])
+            self.n = 0
+
+    def records(self):
+        # The records still in the buffer, oldest first.
+        if self.wrapped:
+            return np.concatenate((self.buf[self.n:], self.buf[:self.n]))
+
+        return self.buf[:self.n].copy()
+
+    def wrap(self, proc, op, handler):
+        dest, _, store = op_usage(op)
+        link = op in link_ops
+        hilo = op in muldiv_ops
+        mem_op = op in ("lw", "lb", "sw", "sb")
+        mask = 0xff if op == "sb" else M32
+        append = self.append
+        word = self.word
+
+        if op == "syscall":
+            def traced():
+                pc = int(proc._pc)
+                append((pc, word(proc, pc), NO_DEST, 0, 0))
+                return handler()
+
+            return traced
+
+        def traced(*args):
+            pc = int(proc._pc)
+            addr = (int(proc.reg[args[2]]) + s16(args[1])) & M32 if mem_op else 0
+
+            res = handler(*args)
+
+            if hilo:
+                d, value, addr = HILO, int(proc.lo), int(proc.hi)
+            elif link:
+                d, value = 31, int(proc.reg[31])
+            elif dest is not None:
+                d = int(args[dest])
+                value = int(proc.reg[d])
+            elif store is not None:
+                d, value = NO_DEST, int(proc.reg[args[store]]) & mask
+            else:
+                d, value = NO_DEST, 0
+
+            append((pc, word(proc, pc), d, value, addr))
+
+            return res
+
+        return traced
+
+    def attach(self, proc):
+        # Record every instruction proc runs until detach is called.
+        if self.path is not None and self.file is None:
+            self.file = open(self.path, "wb")
+
+        proc.push_ops(self, {op: self.wrap(proc, op, h) for op, h in proc.ops.items()})
+
+    def detach(self, proc):
+        proc.pop_ops(self)
+        self.flush()
+
+    def close(self):
+        self.flush()
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def read_page(mem, n):
+    # Page n of either kind of memory, zero padded past the end of flat
+    # memory.
+    if isinstance(mem, MMem):
+        return mem.read(n << PAGE_BITS, PAGE_SIZE)
+
+    out = np.zeros(PAGE_SIZE, dtype=np.uint8)
+    data = mem[n << PAGE_BITS:(n + 1) << PAGE_BITS]
+    out[:len(data)] = data
+
+    return out
+
+
+def encode_deltas(recs, pc):
+    # Delta arrays for ExecTracer records following a keyframe at pc.
+    op = recs["word"] >> 26
+    dest = recs["dest"].copy()
+    dest[op == 0x2b] = STORE_WORD
+    dest[op == 0x28] = STORE_BYTE
+
+    prev = np.concatenate((np.array([pc - 4], dtype=np.int64) & M32, recs["pc"][:-1])).astype(np.uint32)
+    dpc = (recs["pc"] - prev - np.uint32(4)).view(np.int32)
+
+    # Load addresses aren't state.
+    addr = np.where((dest <= STORE_WORD) | (dest == HILO), recs["addr"], 0).astype(np.uint32)
+
+    return {"dpc": dpc, "dest": dest, "value": recs["value"].copy(), "addr": addr}
+
+
+class StateTraceWriter(ExecTracer):
+    # Writes a state trace to the directory path, one segment every
+    # `interval` instructions. close() must be called at the end, it writes
+    # the final state and the index.
+
+    def __init__(self, path, interval=1 << 16, full_every=64):
+        if full_every <= 0:
+            raise ValueError("Full keyframes must be at least every segment.")
+
+        super().__init__(interval)
+        self.dir = path
+        self.full_every = full_every
+        self.proc = None
+        self.key = None
+
+        # The index, one entry per segment written.
+        self.starts = []
+        self.counts = []
+        self.full = []
+        self.pages = []
+
+        # Segments written since the last full keyframe, including it.
+        self.since_full = 0
+
+        os.makedirs(path, exist_ok=True)
+
+    def keyframe(self, proc, pages=None):
+        # The current state of proc, with the given pages of memory or all
+        # of it.
+        mem = proc.mem
+        full = pages is None
+
+        if full:
+            if isinstance(mem, MMem):
+                pages = sorted(mem.pages)
+            else:
+                pages = range((len(mem) + PAGE_SIZE - 1) // PAGE_SIZE)
+
+        data = np.zeros((len(pages), PAGE_SIZE), dtype=np.uint8)
+
+        for k, n in enumerate(pages):
+            data[k] = read_page(mem, n)
+
+        paged = isinstance(mem, MMem)
+
+        return {
+            "start": np.int64(self.count),
+            "reg": np.array(proc.reg.tolist(), dtype=np.uint32),
+            "state": np.array([int(proc.hi), int(proc.lo), int(proc.pc)], dtype=np.uint32),
+            "full": np.bool_(full),
+            "flat_size": np.int64(0 if paged else len(mem)),
+            "fill_value": np.uint8(mem.fill_value if paged else 0),
+            "page_ids": np.array(pages, dtype=np.uint32),
+            "page_data": data,
+        }
+
+    def write(self, key, recs):
+        path = os.path.join(self.dir, segment_name.format(int(key["start"])))
+        tmp = path + ".tmp"
+
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, **key, **encode_deltas(recs, int(key["state"][2])))
+
+        os.replace(tmp, path)
+
+        self.starts.append(int(key["start"]))
+        self.counts.append(len(recs))
+        self.full.append(bool(key["full"]))
+        self.pages.append(key["page_ids"])
+        self.since_full = 1 if key["full"] else self.since_full + 1
+
+    def write_index(self):
+        path = os.path.join(self.dir, index_name)
+        tmp = path + ".tmp"
+
+        with open(tmp, "wb") as f:
+            np.savez(f, starts=np.array(self.starts, dtype=np.int64), counts=np.array(self.counts, dtype=np.int64),
+                     full=np.array(self.full, dtype=bool), page_ids=np.concatenate(self.pages),
+                     page_offsets=np.cumsum([0] + [len(p) for p in self.pages]).astype(np.int64))
+
+        os.replace(tmp, path)
+
+    def attach(self, proc):
+        # Anything may have changed while detached, so each attach starts
+        # with a full keyframe.
+        self.proc = proc
+        self.key = self.keyframe(proc)
+        super().attach(proc)
+
+    def overflow(self):
+        self.flush()
+
+    def flush(self):
+        # End the current segment here and start the next.
+        if self.key is None or not self.n:
+            return
+
+        recs = self.buf[:self.n]
+        self.write(self.key, recs)
+
+        stores = recs["addr"][np.isin(recs["word"] >> 26, (0x2b, 0x28))]
+        self.n = 0
+
+        if self.since_full >= self.full_every:
+            self.key = self.keyframe(self.proc)
+        else:
+            self.key = self.keyframe(self.proc, sorted(set((stores >> PAGE_BITS).tolist())))
+
+    def close(self):
+        self.flush()
+
+        if self.key is not None:
+            self.write(self.key, self.buf[:0])
+            self.key = None
+
+        if self.starts:
+            self.write_index()
+
+
+def scan_segments(path):
+    # The index of a trace that was never closed, read from its segments.
+    names = sorted(f for f in os.listdir(path) if f.startswith("seg-") and f.endswith(".npz"))
+    starts, counts, full, pages = [], [], [], []
+
+    if not names:
+        return None
+
+    for name in names:
+        with np.load(os.path.join(path, name)) as f:
+            starts.append(int(f["start"]))
+            counts.append(len(f["dest"]))
+            full.append(bool(f["full"]))
+            pages.append(f["page_ids"])
+
+    return {
+        "starts": np.array(starts, dtype=np.int64),
+        "counts": np.array(counts, dtype=np.int64),
+        "full": np.array(full, dtype=bool),
+        "page_ids": np.concatenate(pages),
+        "page_offsets": np.cumsum([0] + [len(p) for p in pages]).astype(np.int64),
+    }
+
+
+class StateTrace:
+    # Reader for a StateTraceWriter directory.
+
+    def __init__(self, path):
+        index_path = os.path.join(path, index_name)
+
+        if os.path.exists(index_path):
+            with np.load(index_path) as f:
+                index = {name: f[name] for name in f.files}
+        else:
+            index = scan_segments(path)
+
+        if index is None:
+            raise ValueError("No state trace in {}.".format(path))
+
+        self.starts = index["starts"].tolist()
+        self.counts = index["counts"].tolist()
+        self.full = np.flatnonzero(index["full"]).tolist()
+        self.paths = [os.path.join(path, segment_name.format(n)) for n in self.starts]
+
+        # The pages in each keyframe, segment k's being
+        # page_ids[page_offsets[k]:page_offsets[k + 1]].
+        self.page_ids = index["page_ids"]
+        self.page_offsets = index["page_offsets"]
+
+        self.cached = (None, None)
+
+    def __len__(self):
+        # Instructions in the trace.
+        return self.starts[-1] + self.counts[-1]
+
+    def segment(self, k):
+        if self.cached[0] != k:
+            with np.load(self.paths[k]) as f:
+                self.cached = (k, {name: f[name] for name in f.files})
+
+        return self.cached[1]
+
+    def memory_at(self, k):
+        # Memory as of segment k's keyframe: the newest copy of each page in
+        # the keyframes from the last full one up to k. Pages missing from
+        # the full keyframe weren't allocated then.
+        first = self.full[bisect_right(self.full, k) - 1]
+        seg = self.segment(first)
+        flat_size = int(seg["flat_size"])
+
+        if flat_size:
+            mem = np.zeros(flat_size, dtype=np.uint8)
+        else:
+            mem = MMem()
+            mem.fill(int(seg["fill_value"]))
+
+        lo = int(self.page_offsets[first])
+        ids = self.page_ids[lo:int(self.page_offsets[k + 1])]
+
+        # Last occurrence of each page, as an index into page_ids.
+        pages, last = np.unique(ids[::-1], return_index=True)
+        last = lo + len(ids) - 1 - last
+        segs = np.searchsorted(self.page_offsets, last, side="right") - 1
+
+        for s in np.unique(segs).tolist():
+            with np.load(self.paths[s]) as f:
+                data = f["page_data"]
+
+            for n, i in zip(pages[segs == s].tolist(), (last[segs == s] - self.page_offsets[s]).tolist()):
+                if flat_size:
+                    a = n << PAGE_BITS
+                    mem[a:a + PAGE_SIZE] = data[i][:max(0, min(PAGE_SIZE, flat_size - a))]
+                else:
+                    mem.write(n << PAGE_BITS, data[i])
+
+        return mem
+
+    def state_at(self, n):
+        # The TraceState before instruction n runs, n = len(self) being the
+        # state at the end.
+        if not 0 <= n <= len(self):
+            raise IndexError("Instruction {} is outside the trace.".format(n))
+
+        k = bisect_right(self.starts, n) - 1
+        m = n - self.starts[k]
+
+        if m and m == self.counts[k]:
+            raise IndexError("The trace wasn't closed, the state after its last instruction is unknown.")
+
+        mem = self.memory_at(k)
+        seg = self.segment(k)
+
+        reg = seg["reg"].tolist()
+        hi, lo, pc = seg["state"].tolist()
+
+        dest = seg["dest"][:m]
+        value = seg["value"][:m]
+        addr = seg["addr"][:m]
+
+        # Only the last write to each register counts.
+        for r in np.unique(dest[dest >= 0]).tolist():
+            i = m - 1 - int(np.argmax(dest[::-1] == r))
+
+            if r == HILO:
+                hi, lo = int(addr[i]), int(value[i])
+            else:
+                reg[r] = int(value[i])
+
+        for i in np.flatnonzero(dest <= STORE_WORD).tolist():
+            a = int(addr[i])
+
+            if dest[i] == STORE_WORD:
+                word = np.array([value[i]], dtype="<u4").view(np.uint8)
+
+                if isinstance(mem, MMem):
+                    mem.write(a, word)
+                else:
+                    mem[a:a + 4] = word
+            else:
+                mem[a] = int(value[i]) & 0xff
+
+        pc = (pc + int(seg["dpc"][:m + 1].astype(np.int64).sum()) + 4 * m) & M32
+
+        return TraceState(n, reg, hi, lo, pc, mem)
+
+
+def iter_trace(path):
+    # Yield the chunks of a trace file in order.
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+
+        while f.tell() < size:
+            yield np.load(f)
+
+
+def read_trace(path):
+    chunks = list(iter_trace(path))
+
+    if not chunks:
+        return np.zeros(0, dtype=record_dtype)
+
+    return np.concatenate(chunks)
+
+
+def format_record(rec):
+    # One line per record, with the instruction disassembled.
+    instr = Instr.decode(rec["word"])
+    line = "0x{:08x}  {:08x}  {:24}".format(int(rec["pc"]), int(rec["word"]), str(instr))
+    d = int(rec["dest"])
+
+    if d == HILO:
+        line += " hi = 0x{:08x} lo = 0x{:08x}".format(int(rec["addr"]), int(rec["value"]))
+    elif d != NO_DEST:
+        line += " ${} = 0x{:08x}".format(MIPSR(d).name.lower(), int(rec["value"]))
+
+        if instr.op in ("lw", "lb"):
+            line += " [0x{:08x}]".format(int(rec["addr"]))
+    elif instr.op in ("sw", "sb"):
+        line += " [0x{:08x}] = 0x{:08x}".format(int(rec["addr"]), int(rec["value"]))
+
+    return line.rstrip()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Print an execution trace written by ExecTracer.')
+    parser.add_argument(dest='trace', type=str,
+                        help="Trace file.")
+    parser.add_argument('-n', type=int, dest='count', default=None,
+                        help='Only print the first N records.')
+    parser.add_argument('--pc', type=lambda s: int(s, 0), dest='pc', default=None,
+                        help='Only print records for the instruction at PC.')
+
+    args = parser.parse_args()
+
+    printed = 0
+
+    for chunk in iter_trace(args.trace):
+        if args.pc is not None:
+            chunk = chunk[chunk["pc"] == args.pc]
+
+        for rec in chunk:
+            if args.count is not None and printed >= args.count:
+                break
+
+            print(format_record(rec))
+            printed += 1
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import generic_memory
+from generic_memory import MMem, PAGE_SIZE, map_file
+
+
+class TestMMem(unittest.TestCase):
+
+    def test_sparse(self):
+
+        m = MMem()
+
+        self.assertEqual(m[0x7fffeffc], 0)
+        self.assertEqual(m.load_word(0x10000000), 0)
+        self.assertEqual(len(m.pages), 0)
+
+        m.store_word(0x7fffeffc, 0xdeadbeef)
+        m.store_byte(0x10000003, 0x1ff)
+
+        self.assertEqual(len(m.pages), 2)
+        self.assertEqual(m.load_word(0x7fffeffc), 0xdeadbeef)
+        self.assertEqual(m.load_byte(0x7fffeffc), 0xef)
+        self.assertEqual(m.load_word(0x10000000), 0xff000000)
+        self.assertEqual(m[0x10000003], 0xff)
+
+    def test_slices(self):
+
+        m = MMem()
+        data = np.arange(256, dtype=np.uint8)
+
+        # Straddles a page boundary.
+        m[PAGE_SIZE - 100:PAGE_SIZE + 156] = data
+
+        self.assertEqual(len(m.pages), 2)
+        self.assertListEqual(list(m[PAGE_SIZE - 100:PAGE_SIZE + 156]), list(data))
+        self.assertEqual(m[PAGE_SIZE:PAGE_SIZE + 4].view('uint32')[0], 0x67666564)
+        self.assertEqual(m.load_word(PAGE_SIZE - 2), 0x65646362)
+
+        m.write(0, b"\x01\x02")
+        self.assertListEqual(list(m.read(0, 3)), [1, 2, 0])
+
+        m[8:12] = 7
+        self.assertEqual(m.load_word(8), 0x07070707)
+
+        with self.assertRaises(ValueError):
+            m[0:4] = data
+
+    def test_wrap(self):
+
+        m = MMem()
+
+        m.write(0xfffffffe, b"\x01\x02\x03\x04")
+
+        self.assertEqual(m[-2], 1)
+        self.assertEqual(m.load_word(0), 0x0403)
+        self.assertEqual(m.load_word(-4), 0x02010000)
+        self.assertListEqual([a for a, n in m.allocated()], [0, 0xfffff000])
+
+    def test_fill(self):
+
+        m = MMem()
+
+        m.store_word(0x400, 5)
+        m.fill(0xaa)
+
+        self.assertEqual(len(m.pages), 0)
+        self.assertEqual(m.load_word(0x400), 0xaaaaaaaa)
+
+        m.store_byte(0x400, 0)
+        self.assertEqual(m.load_word(0x400), 0xaaaaaa00)
+
+    def test_map(self):
+
+        fd, path = tempfile.mkstemp(suffix=".bin")
+        os.close(fd)
+
+        try:
+            data = np.arange(3 * PAGE_SIZE // 4, dtype=np.uint32).view(np.uint8)
+            data.tofile(path)
+
+            image = map_file(path)
+            self.assertIs(map_file(path), image)
+            self.assertFalse(image.flags.writeable)
+
+            a = MMem()
+            b = MMem()
+            a.map(0x400000, image)
+            b.map(0x400000 + PAGE_SIZE - 8, image)
+
+            # a maps all three pages in place, b only the two that line up
+            # with its pages.
+            self.assertTrue(all(np.shares_memory(a.pages[n], image) for n in a.pages))
+            self.assertEqual(sum(np.shares_memory(b.pages[n], image) for n in b.pages), 2)
+            self.assertEqual(len(b.pages), 4)
+
+            self.assertEqual(a.load_word(0x400000 + 4 * 1000), 1000)
+            self.assertEqual(b.load_word(0x400000 + PAGE_SIZE - 8 + 4 * 2000), 2000)
+
+            # Writes copy the page first and leave the file alone.
+            a.store_word(0x400004, 0xffffffff)
+            a[0x401000:0x401004] = 9
+
+            self.assertEqual(a.load_word(0x400004), 0xffffffff)
+            self.assertEqual(a.load_word(0x400008), 2)
+            self.assertEqual(a.load_word(0x401000), 0x09090909)
+            self.assertEqual(image.view(np.uint32)[1], 1)
+            self.assertEqual(b.load_word(0x400000 + PAGE_SIZE - 4), 1)
+            self.assertTrue(np.shares_memory(a.pages[0x402], image))
+
+            # Only the most recently used maps are cached.
+            generic_memory.max_mapped_files = 1
+            map_file(__file__)
+            self.assertIsNot(map_file(path), image)
+            self.assertEqual(len(generic_memory.mapped_files), 1)
+        finally:
+            generic_memory.max_mapped_files = 16
+            os.remove(path)
+
+    def test_map_writable(self):
+
+        # Buffers the caller can still change are copied, not shared.
+        for buf in [np.zeros(2 * PAGE_SIZE, dtype=np.uint8), bytearray(2 * PAGE_SIZE)]:
+            m = MMem()
+            m.map(0, np.frombuffer(buf, dtype=np.uint8) if type(buf) is bytearray else buf)
+            buf[4] = 7
+            m.store_word(0x1000, 5)
+
+            self.assertFalse(any(np.shares_memory(p, np.asarray(buf)) for p in m.pages.values()))
+            self.assertEqual(m.load_byte(4), 0)
+            self.assertEqual(buf[0x1000], 0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import numpy as np
+
+from mips_sim import CMDParse, IntMIPSProcessor, StopReason
+from mips_assembler import assemble, remove_comments, split_labels, resolve_labels
+
+source = """
+    jal sub
+    noop
+loop:
+    bne $t0, $zero, loop
+    j loop
+sub:
+    jr $ra
+"""
+
+
+class TestAssembler(unittest.TestCase):
+
+    def test_resolve_labels(self):
+
+        prog, labels = split_labels(remove_comments(source.splitlines()))
+        self.assertEqual(labels, {"loop": 2, "sub": 4})
+
+        # Branches are relative, jumps absolute word addresses.
+        self.assertEqual(resolve_labels(prog, labels, 0), ["jal 4", "noop", "bne $t0, $zero, -1", "j 2", "jr $ra"])
+        self.assertEqual(resolve_labels(prog, labels, 0x400000)[3], "j {}".format(0x100002))
+        self.assertEqual(resolve_labels(prog, labels)[0], "jal 7")
+
+    def test_assemble(self):
+
+        image, symbols = assemble(source, 0x100)
+
+        self.assertEqual(image.dtype, np.uint8)
+        self.assertEqual(symbols, {"loop": 0x108, "sub": 0x110})
+
+        lines = ["jal 0x44", "noop", "bne $t0, $zero, -1", "j 0x42", "jr $ra"]
+        expected = np.array([CMDParse.parse_cmd(l).bin for l in lines], dtype=np.uint32).view(np.uint8)
+        self.assertListEqual(list(image), list(expected))
+
+        # Lines work too, and the image loads as is.
+        image, _ = assemble(source.splitlines(True), 0x100)
+        self.assertListEqual(list(image), list(expected))
+
+        p = IntMIPSProcessor(0x200)
+        p.load_program(0x100, image)
+        self.assertEqual(p.execute_prog(0x100, 4), (StopReason.MAX_INSTR, 4))
+
+        # jal, jr, bne, then j back to loop.
+        self.assertEqual(p.reg[31], 0x108)
+        self.assertEqual(p.pc, 0x108)
+
+    def test_jump_encoding(self):
+
+        # The 26 bit target field holds the label's word address.
+        image, _ = assemble(source, 0)
+        words = image.view(np.uint32)
+        self.assertEqual(int(words[0]), 0x0c000004)
+        self.assertEqual(int(words[3]), 0x08000002)
+
+        image, _ = assemble(source)
+        self.assertEqual(int(image.view(np.uint32)[0]), 0x0c000007)
+
+        # Only the low 28 bits of an address are encoded, the rest comes
+        # from the jump's own.
+        image, _ = assemble(source, 0x10000100)
+        self.assertEqual(int(image.view(np.uint32)[0]), 0x0c000044)
+
+        # Branches don't depend on the base.
+        self.assertEqual(int(words[2]), CMDParse.parse_cmd("bne $t0, $zero, -1").bin)
+
+    def test_run(self):
+
+        # Where mips_sim.py loads a .bin, called twice.
+        prog = """
+            addi $a0, $zero, 3
+            jal double
+            noop
+            jal double
+            noop
+            j end
+        double:
+            add $a0, $a0, $a0
+            jr $ra
+        end:
+            beq $zero, $zero, end
+        """
+
+        image, symbols = assemble(prog)
+        self.assertEqual(symbols, {"double": 36, "end": 44})
+
+        for translate in [False, True]:
+            p = IntMIPSProcessor(0x100)
+            p.load_program(12, image)
+            res = p.execute_prog(12, 100, translate=translate, halt=True)
+
+            self.assertEqual(res, (StopReason.HALT, 9))
+            self.assertEqual(p.reg[4], 12)
+            self.assertEqual(p.pc, 44)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+import unittest
+import random
+
+import numpy as np
+
+from mips_sim import CMDParse, MIPSProcessor, IntegerOverflow
+from mips_batch import BatchMIPSProcessor
+
+
+def build_prog(lines):
+    return np.array([CMDParse.parse_cmd(l).bin for l in lines], dtype=np.uint32).view('uint8')
+
+
+# Sums 1..$a0 into $v0, taking a different number of steps per lane.
+sum_prog = [
+    "xor $v0, $v0, $v0",
+    "blez $a0, 3",
+    "addu $v0, $v0, $a0",       # top
+    "addiu $a0, $a0, -1",
+    "bgtz $a0, -3",
+    "beq $zero, $zero, -1",     # end
+]
+
+
+class TestBatch(unittest.TestCase):
+
+    def test_divergent_lanes(self):
+
+        n = 50
+        b = BatchMIPSProcessor(n)
+        b.load_program(0, build_prog(sum_prog))
+        b.reg[:, 4] = np.arange(n)
+        b.execute_prog(0, 200)
+
+        self.assertListEqual(list(b.reg[:, 2]), [i * (i + 1) // 2 for i in range(n)])
+
+        for i in [0, 7, 49]:
+            p = MIPSProcessor()
+            p.load_program(0, build_prog(sum_prog))
+            p.reg[4] = i
+            p.execute_prog(0, 200)
+
+            self.assertListEqual(list(p.reg), list(b.reg[i]))
+            self.assertEqual(p.pc, b.pc[i])
+
+    def test_matches_scalar(self):
+
+        prog = build_prog([
+            "mult $t0, $t1",
+            "mflo $t2",
+            "mfhi $t3",
+            "divu $t0, $t1",
+            "mflo $t4",
+            "sra $t5, $t0, 7",
+            "sltu $t6, $t0, $t1",
+            "sllv $t7, $t0, $t1",
+            "xori $s0, $t1, 0xbeef",
+            "sw $t2, 0x200($zero)",
+            "lb $s1, 0x201($zero)",
+        ])
+
+        n = 64
+        b = BatchMIPSProcessor(n)
+        b.load_program(0, prog)
+        b.reg[:, 8:10] = [[random.getrandbits(32), random.getrandbits(32)] for _ in range(n)]
+        init = b.reg.copy()
+        b.execute_prog(0, 11)
+
+        for i in range(n):
+            p = MIPSProcessor()
+            p.load_program(0, prog)
+            p.reg[:] = init[i]
+            p.execute_prog(0, 11)
+
+            self.assertListEqual(list(p.reg), list(b.reg[i]))
+            self.assertEqual(p.hi, b.hi[i])
+            self.assertEqual(p.lo, b.lo[i])
+            self.assertListEqual(list(p.mem), list(b.mem[i]))
+
+    def test_trap(self):
+
+        b = BatchMIPSProcessor(3)
+        b.load_program(0, build_prog(["add $t2, $t0, $t1", "noop", "noop"]))
+        b.reg[:, 8] = [1, 2 ** 31 - 1, 5]
+        b.reg[:, 9] = 1
+
+        steps = b.execute_prog(0, 3)
+
+        self.assertEqual(steps, 3)
+        self.assertListEqual(b.traps(), [None, IntegerOverflow, None])
+        self.assertListEqual(list(b.active), [True, False, True])
+        self.assertListEqual(list(b.instr_c), [3, 0, 3])
+        self.assertListEqual(list(b.pc), [12, 4, 12])
+        self.assertListEqual(list(b.reg[:, 10]), [2, 0, 6])
+
+if __name__ == "__main__":
+    random.seed()
+    unittest.main()
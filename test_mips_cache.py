@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import numpy as np
+
+from mips_sim import CMDParse, MIPSProcessor, IntMIPSProcessor
+from mips_cache import Cache, CacheHierarchy, TraceRecorder, parse_spec, stack_distances, miss_ratio_curve,\
+    FETCH, READ, WRITE
+
+
+def build_prog(lines):
+    return np.array([CMDParse.parse_cmd(l).bin for l in lines], dtype=np.uint32).view('uint8')
+
+
+# Walks $t1 over 0x200..0x2ff a word at a time, loading and storing each
+# word, four times over.
+walk_prog = [
+    "addi $t3, $zero, 4",
+    "addi $t1, $zero, 0x200",       # outer
+    "addi $t2, $zero, 0x300",
+    "lw $t0, 0($t1)",               # inner
+    "addi $t0, $t0, 1",
+    "sw $t0, 0($t1)",
+    "addi $t1, $t1, 4",
+    "bne $t1, $t2, -5",
+    "addi $t3, $t3, -1",
+    "bne $t3, $zero, -9",
+    "beq $zero, $zero, -1",
+]
+
+
+class TestCache(unittest.TestCase):
+
+    def test_geometry(self):
+
+        c = parse_spec("1k:4:32:fifo", "L1D")
+
+        self.assertEqual((c.size, c.assoc, c.line_size, c.policy, c.n_sets), (1024, 4, 32, "fifo", 8))
+
+        for args in [(1000, 4, 32), (1024, 3, 32), (64, 4, 32)]:
+            with self.assertRaises(ValueError):
+                Cache(*args)
+
+        with self.assertRaises(ValueError):
+            Cache(1024, 4, 32, "plru")
+
+    def test_hits(self):
+
+        c = Cache(256, 1, 16)
+
+        self.assertFalse(c.access(0x100))
+        self.assertTrue(c.access(0x10f))
+        self.assertFalse(c.access(0x110))
+
+        # Same set, direct mapped.
+        self.assertFalse(c.access(0x200))
+        self.assertFalse(c.access(0x100))
+
+        self.assertEqual((c.hits, c.misses, c.evictions), (1, 4, 2))
+
+    def test_policies(self):
+
+        # Two ways, a b a c a: LRU keeps a, FIFO throws it out for c.
+        out = {}
+
+        for policy in ["lru", "fifo"]:
+            c = Cache(64, 2, 16, policy)
+
+            for a in [0x000, 0x040, 0x000, 0x080, 0x000]:
+                c.access(a)
+
+            out[policy] = c.misses
+
+        self.assertEqual(out, {"lru": 3, "fifo": 4})
+
+        runs = []
+
+        for i in range(2):
+            c = Cache(256, 4, 16, "random", seed=3)
+
+            for a in range(0, 0x4000, 48):
+                c.access(a)
+
+            runs.append([list(s) for s in c.sets])
+
+        self.assertEqual(runs[0], runs[1])
+
+    def test_writeback(self):
+
+        l2 = Cache(1024, 4, 32, name="L2")
+        l1 = Cache(64, 1, 16, next_level=l2)
+
+        l1.access(0x000, True)
+        l1.access(0x040)
+        l1.access(0x080)
+
+        self.assertEqual((l1.evictions, l1.writebacks), (2, 1))
+        self.assertEqual((l2.reads, l2.writes, l2.hits), (3, 1, 1))
+
+
+class TestHierarchy(unittest.TestCase):
+
+    def test_attach(self):
+
+        for cls in [MIPSProcessor, IntMIPSProcessor]:
+            p = cls(0x400)
+            p.load_program(0, build_prog(walk_prog))
+
+            h = CacheHierarchy(Cache(128, 2, 16, name="L1I"), Cache(128, 2, 16, name="L1D"),
+                               Cache(1024, 4, 32, name="L2"))
+            plain = p.ops["lw"]
+
+            h.attach(p)
+            res = p.execute_prog(0, 2000, translate=True, halt=True)
+
+            i, d, l2 = h.l1i, h.l1d, h.l2
+
+            self.assertEqual(p.mem[0x2f0:0x2f4].view('uint32')[0], 4)
+            self.assertEqual(i.reads, res.count)
+            self.assertEqual((d.reads, d.writes), (256, 256))
+
+            # Each pass over the 256 byte array misses once per line in the
+            # 128 byte D-cache, and the L2 holds the array after the first.
+            self.assertEqual(d.misses, 4 * 16)
+            self.assertEqual(d.writebacks, 4 * 16 - 8)
+            self.assertEqual(i.misses, 3)
+            self.assertEqual(l2.misses, 2 + 8)
+
+            h.detach(p)
+
+            self.assertIs(p.ops["lw"], plain)
+            self.assertListEqual(p.hooks, [])
+
+            h.reset()
+            p.execute_prog(0, 2000, halt=True)
+
+            self.assertEqual(i.reads, 0)
+            self.assertEqual(p.mem[0x2f0:0x2f4].view('uint32')[0], 8)
+
+
+class TestMissRatioCurve(unittest.TestCase):
+
+    def test_stack_distances(self):
+
+        lines = [1, 2, 2, 3, 1, 2, 4, 4, 3, 1]
+        self.assertListEqual(list(stack_distances(lines)), [-1, -1, 0, -1, 2, 2, -1, 0, 3, 3])
+
+        rng = np.random.RandomState(1)
+
+        for i in range(50):
+            lines = rng.randint(0, rng.randint(1, 20), size=rng.randint(0, 80))
+            naive = []
+
+            for k, l in enumerate(lines):
+                prev = [j for j in range(k) if lines[j] == l]
+                naive.append(len(set(lines[prev[-1] + 1:k])) if prev else -1)
+
+            self.assertListEqual(list(stack_distances(lines)), naive)
+
+    def test_matches_simulation(self):
+
+        rng = np.random.RandomState(2)
+        addrs = np.concatenate([rng.randint(0, 0x1000, 1500), rng.randint(0, 0x100, 1500)])
+        rng.shuffle(addrs)
+
+        assocs = (1, 2, 4, None)
+        sizes, table = miss_ratio_curve(addrs, 16, [16, 64, 256, 1024], assocs)
+
+        for r, size in enumerate(sizes):
+            for col, a in enumerate(assocs):
+                ways = size // 16 if a is None else a
+
+                if size < ways * 16:
+                    self.assertTrue(np.isnan(table[r, col]))
+                    continue
+
+                c = Cache(size, ways, 16)
+
+                for addr in addrs:
+                    c.access(int(addr))
+
+                self.assertAlmostEqual(table[r, col], c.misses / len(addrs))
+
+    def test_record(self):
+
+        p = MIPSProcessor(0x400)
+        p.load_program(0, build_prog(walk_prog))
+
+        rec = TraceRecorder()
+        rec.attach(p)
+        res = p.execute_prog(0, 2000, halt=True)
+        rec.detach(p)
+
+        addrs, kinds = rec.trace()
+
+        self.assertEqual(np.count_nonzero(kinds == FETCH), res.count)
+        self.assertEqual(np.count_nonzero(kinds == READ), 256)
+        self.assertEqual(np.count_nonzero(kinds == WRITE), 256)
+        self.assertEqual(addrs[kinds == FETCH][3], 12)
+        self.assertListEqual(list(addrs[kinds != FETCH][:4]), [0x200, 0x200, 0x204, 0x204])
+
+        # 64 distinct words, 16 byte lines: 16 cold misses, then the whole
+        # array fits in a 256 byte fully associative cache.
+        sizes, table = miss_ratio_curve(addrs[kinds != FETCH], 16, [128, 256], (None,))
+        self.assertAlmostEqual(table[1, 0], 16 / 512)
+        self.assertAlmostEqual(table[0, 0], 4 * 16 / 512)
+
+if __name__ == "__main__":
+    unittest.main()
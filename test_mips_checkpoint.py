@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import signal
+import tempfile
+import unittest
+
+import numpy as np
+
+from generic_memory import MMem
+from mips_sim import CMDParse, MIPSProcessor, IntMIPSProcessor, StopReason
+from mips_checkpoint import Checkpointer, read_chain
+
+
+# Counts in $t0 and stores the count on its own page every 8 iterations.
+prog = [
+    "addi $t0, $t0, 1",
+    "andi $t1, $t0, 7",
+    "bne $t1, $zero, 4",
+    "sll $t2, $t0, 9",
+    "lui $t3, 0x1000",
+    "addu $t3, $t3, $t2",
+    "sw $t0, 0($t3)",
+    "beq $zero, $zero, -8",
+]
+
+
+def build(mem=None):
+    p = IntMIPSProcessor(0x4000, mem=mem)
+    p.load_program(0x400000 if mem is not None else 0,
+                   np.array([CMDParse.parse_cmd(l).bin for l in prog], dtype=np.uint32).view('uint8'))
+    p.pc = 0x400000 if mem is not None else 0
+
+    return p
+
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.prefix = os.path.join(self.dir, "ck")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def assertSameState(self, a, b):
+        self.assertListEqual(list(a.reg), list(b.reg))
+        self.assertEqual((int(a.pc), int(a.hi), int(a.lo), a.instr_c), (int(b.pc), int(b.hi), int(b.lo), b.instr_c))
+
+    def test_dirty_pages(self):
+
+        p = build(MMem())
+        c = Checkpointer(p, self.prefix)
+
+        res = c.run(3000, every=1000)
+
+        self.assertEqual(res, (StopReason.MAX_INSTR, 3000))
+        self.assertEqual(c.count, 3)
+
+        chain = read_chain(c.last)
+
+        # The first checkpoint has the code page, later ones only the data
+        # pages written since.
+        self.assertEqual(len(chain), 3)
+        self.assertIn(0x400, chain[0]["page_ids"])
+
+        for data in chain[1:]:
+            self.assertNotIn(0x400, data["page_ids"])
+            self.assertTrue(all(0x10000 <= n < 0x10100 for n in data["page_ids"]))
+
+        q = IntMIPSProcessor.from_checkpoint(c.last)
+
+        self.assertSameState(p, q)
+        self.assertEqual(set(p.mem.pages), set(q.mem.pages))
+
+        for n in p.mem.pages:
+            self.assertListEqual(list(p.mem.pages[n]), list(q.mem.pages[n]))
+
+        p.run(500)
+        q.run(500, translate=True)
+        self.assertSameState(p, q)
+
+    def test_stop_at(self):
+
+        # A stop address reached exactly where a chunk ends still stops.
+        for every in [None, 8, 16]:
+            p = build()
+            c = Checkpointer(p, self.prefix + str(every))
+
+            self.assertEqual(c.run(1000, every=every, stop_at={0x10}), (StopReason.STOP_PC, 32))
+            self.assertEqual(p.pc, 0x10)
+
+    def test_flat(self):
+
+        p = build()
+        c = Checkpointer(p, self.prefix)
+        p.run(20)
+        p.mem[0x100:0x104] = 0xff
+        path = c.save()
+
+        q = MIPSProcessor.from_checkpoint(path)
+
+        self.assertIs(type(q), MIPSProcessor)
+        self.assertSameState(p, q)
+        self.assertListEqual(list(p.mem), list(q.mem))
+
+    def test_signal(self):
+
+        p = build(MMem())
+        c = Checkpointer(p, self.prefix)
+        old = signal.getsignal(signal.SIGUSR1)
+
+        def send(proc):
+            if proc.reg[8] == 20:
+                os.kill(os.getpid(), signal.SIGUSR1)
+
+            return False
+
+        try:
+            c.install()
+            res = c.run(1000, until=send)
+        finally:
+            signal.signal(signal.SIGUSR1, old)
+
+        self.assertEqual(res, (StopReason.MAX_INSTR, 1000))
+        self.assertEqual(c.count, 1)
+
+        q = IntMIPSProcessor.from_checkpoint(c.last)
+
+        # Taken at the first check after the signal arrived.
+        self.assertEqual(q.reg[8], 20)
+        self.assertEqual(q.mem.load_word(0x10002000), 16)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import numpy as np
+
+from mips_sim import CMDParse, MIPSProcessor, IntMIPSProcessor
+from mips_pipeline import PipelineModel
+from mips_cache import TraceRecorder
+
+
+def run(lines, cls=IntMIPSProcessor, model=None):
+    p = cls(0x400)
+    p.load_program(0, np.array([CMDParse.parse_cmd(l).bin for l in lines], dtype=np.uint32).view('uint8'))
+
+    m = model or PipelineModel()
+    m.attach(p)
+    res = p.execute_prog(0, 10000, halt=True)
+
+    return p, m, res
+
+
+class TestPipeline(unittest.TestCase):
+
+    def assertStalls(self, m, **expected):
+        stalls = {k: v for k, v in m.stalls.items() if v}
+        self.assertDictEqual(stalls, expected)
+
+        # Four cycles to fill the pipeline, then one per instruction plus
+        # the stalls.
+        self.assertEqual(m.cycles, 4 + m.instructions + sum(m.stalls.values()))
+
+    def test_no_hazards(self):
+
+        p, m, res = run([
+            "addi $t0, $zero, 1",
+            "addi $t1, $t0, 2",
+            "sw $t1, 0x200($zero)",
+            "beq $zero, $zero, -1",
+        ])
+
+        self.assertEqual(m.instructions, res.count)
+        self.assertEqual(m.cycles, 8)
+        self.assertStalls(m)
+        self.assertAlmostEqual(m.stats()["cpi"], 2.0)
+
+    def test_load_use(self):
+
+        p, m, res = run([
+            "lw $t0, 0x200($zero)",
+            "addi $t1, $t0, 1",
+            "lw $t2, 0x200($zero)",
+            "sw $t2, 0x204($zero)",
+            "lw $t3, 0x200($zero)",
+            "beq $t3, $zero, -1",
+        ])
+
+        # Stored data is forwarded in time, a branch needs its operand two
+        # cycles after the load.
+        self.assertStalls(m, load_use=3)
+
+    def test_branches(self):
+
+        p, m, res = run([
+            "addi $t0, $zero, 3",
+            "addi $t0, $t0, -1",
+            "bne $t0, $zero, -2",
+            "jal 6",
+            "addi $t1, $zero, 1",
+            "beq $zero, $zero, -1",
+            "jr $ra",
+        ])
+
+        # Each bne waits a cycle for $t0, two of them are taken, and both jal
+        # and jr are taken. The final halting branch isn't charged.
+        self.assertEqual(p.reg[9], 0)
+        self.assertStalls(m, data=3, branch=4)
+
+    def test_muldiv(self):
+
+        p, m, res = run([
+            "addi $t0, $zero, 7",
+            "addi $t1, $zero, 3",
+            "mult $t0, $t1",
+            "div $t0, $t1",
+            "mflo $t2",
+            "mfhi $t3",
+            "beq $zero, $zero, -1",
+        ], model=PipelineModel(mult_latency=4, div_latency=10))
+
+        self.assertEqual((p.reg[10], p.reg[11]), (2, 1))
+        self.assertStalls(m, muldiv=3, hilo=9)
+
+    def test_backends(self):
+
+        prog = [
+            "addi $t3, $zero, 20",
+            "lw $t0, 0x200($zero)",
+            "addi $t0, $t0, 1",
+            "mult $t0, $t3",
+            "mflo $t1",
+            "sw $t1, 0x200($zero)",
+            "addi $t3, $t3, -1",
+            "bne $t3, $zero, -7",
+            "beq $zero, $zero, -1",
+        ]
+
+        stats = []
+
+        for cls in [MIPSProcessor, IntMIPSProcessor]:
+            p, m, res = run(prog, cls)
+            stats.append(m.stats())
+
+            plain = p.ops
+            r = TraceRecorder()
+            r.attach(p)
+
+            # Hooks come off in reverse order.
+            with self.assertRaises(ValueError):
+                m.detach(p)
+
+            r.detach(p)
+            m.detach(p)
+
+            self.assertListEqual(p.hooks, [])
+            self.assertIsNot(p.ops, plain)
+
+        self.assertEqual(stats[0], stats[1])
+        self.assertEqual(stats[0]["stalls"]["hilo"], 20 * 4)
+
+if __name__ == "__main__":
+    unittest.main()
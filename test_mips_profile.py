@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from generic_memory import MMem
+from mips_sim import CMDParse, MIPSProcessor, IntMIPSProcessor, MIPSI, IntegerOverflow, StopReason
+from mips_profile import Profiler
+from mips_cache import TraceRecorder, FETCH
+from mips_assembler import read_labels
+
+source = """
+    addi $s0, $zero, 5
+outer:
+    addi $t0, $zero, 3
+inner:
+    jal square
+    noop
+    addi $t0, $t0, -1
+    bne $t0, $zero, inner
+    addi $s0, $s0, -1
+    bgtz $s0, outer
+end:
+    beq $zero, $zero, end
+square:
+    mult $t0, $t0
+    mflo $t1
+    sw $t1, 0x200($zero)
+    jr $ra
+"""
+
+# The same program with the labels resolved by hand.
+prog = [
+    "addi $s0, $zero, 5",
+    "addi $t0, $zero, 3",
+    "jal 9",
+    "noop",
+    "addi $t0, $t0, -1",
+    "bne $t0, $zero, -4",
+    "addi $s0, $s0, -1",
+    "bgtz $s0, -7",
+    "beq $zero, $zero, -1",
+    "mult $t0, $t0",
+    "mflo $t1",
+    "sw $t1, 0x200($zero)",
+    "jr $ra",
+]
+
+
+def build(lines, cls=IntMIPSProcessor, mem=None, base=0):
+    p = cls(0x400, mem=mem)
+    p.load_program(base, np.array([CMDParse.parse_cmd(l).bin for l in lines], dtype=np.uint32).view('uint8'))
+    p.pc = base
+
+    return p
+
+
+def reference(lines, n=-1):
+    # Exact per-PC counts from the fetch trace.
+    p = build(lines)
+    r = TraceRecorder()
+    r.attach(p)
+
+    try:
+        p.run(n, halt=True)
+    except IntegerOverflow:
+        pass
+
+    addrs, kinds = r.trace()
+    fetches = addrs[kinds == FETCH]
+
+    # A trapping instruction is fetched but doesn't retire.
+    if p.instr_c < len(fetches):
+        fetches = fetches[:p.instr_c]
+
+    return np.bincount(fetches // 4, minlength=0x100)
+
+
+class TestProfiler(unittest.TestCase):
+
+    def test_counts(self):
+
+        expected = reference(prog)
+
+        for cls in [MIPSProcessor, IntMIPSProcessor]:
+            for translate in [False, True]:
+                p = build(prog, cls)
+                prof = Profiler()
+                prof.attach(p)
+
+                # Short runs end partway through blocks.
+                while p.run(7, translate, halt=True).reason == StopReason.MAX_INSTR:
+                    pass
+
+                self.assertEqual(prof.instructions, p.instr_c)
+                self.assertListEqual(list(prof.counts()), list(expected))
+
+        ops = prof.op_counts()
+
+        self.assertEqual(ops.sum(), p.instr_c)
+        self.assertEqual(ops[MIPSI.JAL.value], 15)
+        self.assertEqual(ops[MIPSI.JR.value], 15)
+
+    def test_trap(self):
+
+        lines = [
+            "lui $t0, 0x7fff",
+            "ori $t0, $t0, 0xfff0",
+            "addi $t0, $t0, 1",
+            "bne $t0, $zero, -2",
+        ]
+
+        expected = reference(lines)
+        self.assertEqual(expected[2], 15)
+
+        for translate in [False, True]:
+            p = build(lines)
+            prof = Profiler()
+            prof.attach(p)
+
+            with self.assertRaises(IntegerOverflow):
+                p.run(1000, translate)
+
+            self.assertEqual(prof.instructions, p.instr_c)
+            self.assertListEqual(list(prof.counts()), list(expected))
+
+    def test_report(self):
+
+        fd, path = tempfile.mkstemp(suffix=".s")
+
+        with os.fdopen(fd, "w") as f:
+            f.write(source)
+
+        try:
+            symbols = read_labels(path, 0x400000)
+        finally:
+            os.remove(path)
+
+        self.assertEqual(symbols, {"outer": 0x400004, "inner": 0x400008, "end": 0x400020, "square": 0x400024})
+
+        # jal targets are absolute.
+        p = build([l.replace("jal 9", "jal 0x100009") for l in prog], mem=MMem(), base=0x400000)
+        prof = Profiler()
+        prof.attach(p)
+        p.run(-1, True, halt=True)
+        prof.detach(p)
+
+        self.assertIsNone(p.profiler)
+        self.assertEqual((prof.start, prof.end), (0x400000, 0x401000))
+
+        hot = prof.hot_spots(5, symbols)
+
+        self.assertEqual([h.count for h in hot], [15] * 5)
+        self.assertEqual(hot[0].label, "inner")
+        self.assertEqual(hot[0].op, "jal")
+        self.assertEqual(hot[1].label, "inner+0x8")
+        self.assertEqual(prof.counts()[3], 0)
+
+        self.assertEqual(prof.by_label(symbols)[0], ("square", 60))
+        self.assertIn("square", prof.report(symbols=symbols))
+
+if __name__ == "__main__":
+    unittest.main()
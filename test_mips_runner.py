@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from mips_sim import CMDParse
+from mips_runner import Job, run_job, run_jobs, worker_procs
+
+
+prog = [
+    "addu $v0, $a0, $a1",
+    "lw $v1, 0x100($zero)",
+    "beq $zero, $zero, -1",
+]
+
+
+class TestRunner(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.binary = tempfile.mkstemp(suffix=".bin")
+        os.close(fd)
+        np.array([CMDParse.parse_cmd(l).bin for l in prog], dtype=np.uint32).tofile(self.binary)
+
+    def tearDown(self):
+        os.remove(self.binary)
+
+    def test_run_job(self):
+
+        job = Job(self.binary, regs={"a0": 5, "$a1": 7}, mem=[(0x100, b"\x2a\0\0\0")], max_instr=10, start=0)
+        res = run_job(3, job)
+
+        self.assertEqual(res.job_id, 3)
+        self.assertEqual(res.regs[2], 12)
+        self.assertEqual(res.regs[3], 42)
+        self.assertEqual(res.pc, 8)
+        self.assertEqual(res.instr_count, 10)
+        self.assertIsNone(res.trap)
+        self.assertEqual(res.stop, "max_instr")
+
+        # A second job on the same warm processor starts from scratch.
+        res = run_job(4, Job(self.binary, max_instr=1, start=0, regs={4: 1}))
+
+        self.assertEqual(res.regs[2], 1)
+        self.assertEqual(res.regs[3], 0)
+        self.assertEqual(res.instr_count, 1)
+
+    def test_trap(self):
+
+        res = run_job(0, Job(self.binary, max_instr=10, start=0, mem_size=64))
+
+        self.assertEqual(res.trap, "IndexError")
+        self.assertEqual(res.instr_count, 1)
+        self.assertIsNone(res.stop)
+
+    def test_warm(self):
+
+        # The decode cache survives between jobs running the same binary,
+        # except where a job patched it.
+        run_job(0, Job(self.binary, regs={"a0": 1, "a1": 2}, max_instr=2, start=0))
+        p = worker_procs[("int", 1024)]
+        lw = p.decoded[4]
+
+        patch = CMDParse.parse_cmd("addu $v0, $a0, $a0").bin.tobytes()
+        res = run_job(1, Job(self.binary, regs={"a0": 1, "a1": 2}, mem=[(0, patch)], max_instr=2, start=0))
+        self.assertEqual(res.regs[2], 2)
+        self.assertIs(p.decoded[4], lw)
+
+        res = run_job(2, Job(self.binary, regs={"a0": 1, "a1": 2}, max_instr=2, start=0))
+        self.assertEqual(res.regs[2], 3)
+        self.assertIs(p.decoded[4], lw)
+
+        # Host errors aren't guest traps.
+        def broken(*args):
+            raise TypeError()
+
+        p.ops["addu"] = broken
+
+        try:
+            with self.assertRaises(TypeError):
+                run_job(4, Job(self.binary, max_instr=2, start=4 * 64))
+        finally:
+            p.ops["addu"] = getattr(p, "_addu")
+
+    def test_halt(self):
+
+        for translate in [False, True]:
+            res = run_job(0, Job(self.binary, max_instr=1000, start=0, translate=translate, halt=True))
+
+            self.assertEqual(res.stop, "halt")
+            self.assertEqual(res.instr_count, 3)
+            self.assertEqual(res.pc, 8)
+
+    def test_pool(self):
+
+        jobs = [Job(self.binary, regs={"a0": i}, max_instr=5, start=0, backend=b, translate=t)
+                for i in range(8) for b, t in [("int", False), ("numpy", True)]]
+
+        results = sorted(run_jobs(jobs, max_workers=2))
+
+        self.assertListEqual([r.job_id for r in results], list(range(len(jobs))))
+        self.assertListEqual([r.regs[2] for r in results], [i for i in range(8) for _ in range(2)])
+
+if __name__ == "__main__":
+    unittest.main()
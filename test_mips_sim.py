@@ -1,12 +1,16 @@
 #!/usr/bin/env python3
 
+import os
+import tempfile
 import unittest
 import random
 
 import numpy as np
 
 from mips_sim import IanMIPS, Instr, IllegalInstructionError,\
-    CMDParse, MIPSProcessor, IntegerOverflow, AddressError, SoftwareInterrupt
+    CMDParse, MIPSProcessor, IntegerOverflow, AddressError, SoftwareInterrupt, IntMIPSProcessor,\
+    StopReason
+from generic_memory import MMem
 
 well_formed = [
     "add $s0, $t0, $t1",
@@ -63,6 +67,9 @@ well_formed = [
 
 class TestOpcodes(unittest.TestCase):
 
+    # Run again for each backend by the subclasses below.
+    cls = MIPSProcessor
+
     def test_well_formed(self):
 
         for s in well_formed:
@@ -97,6 +104,31 @@ class TestOpcodes(unittest.TestCase):
 
             self.assertEqual(iform, iform2, "error encoding and decoding {}.".format(s))
 
+    def test_decode_illegal(self):
+
+        for word in [0b111111 << 26, 0b000001, (1 << 26) | (0b00111 << 16)]:
+            with self.assertRaises(IllegalInstructionError):
+                Instr.decode(np.uint32(word))
+
+    def test_decode_image(self):
+
+        image = build_prog(well_formed + ["noop"])
+        out = Instr.decode_image(image)
+
+        self.assertEqual(len(out), len(well_formed) + 1)
+
+        for s, rec in zip(well_formed, out):
+            i = Instr.decode(CMDParse.parse_cmd(s).bin)
+
+            self.assertEqual(rec["op"], i._op.value, s)
+            self.assertListEqual([int(rec[f]) for f in Instr.record_args[i._op]], [int(a) for a in i.args], s)
+
+            if "imm" in Instr.record_args[i._op]:
+                self.assertEqual(rec["simm"], i.simm, s)
+
+        out = Instr.decode_image(np.uint32([0xffffffff]))
+        self.assertEqual(out["op"][0], -1)
+
     def test_encode_jr(self):
         o = CMDParse.parse_cmd("jr $s0")
 
@@ -194,7 +226,7 @@ class TestOpcodes(unittest.TestCase):
         self.assertEqual(imm, 10)
 
     def test_add(self):
-        p = MIPSProcessor()
+        p = self.cls()
 
         p.reg[10] = 11
         p.reg[11] = 22
@@ -232,7 +264,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_addi(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         p.reg[10] = 5
 
@@ -265,7 +297,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_addiu(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         p.reg[10] = 5
 
@@ -283,7 +315,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_addu(self):
         """ Test addu $rd, $rs, $rt """
-        p = MIPSProcessor()
+        p = self.cls()
 
         p.reg[10] = 11
         p.reg[11] = 22
@@ -306,7 +338,7 @@ class TestOpcodes(unittest.TestCase):
     def test_and(self):
         """ Test and $rd, $rs, $rt """
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         for i in range(100):
             a = np.uint32(random.getrandbits(32))
@@ -323,7 +355,7 @@ class TestOpcodes(unittest.TestCase):
     def test_andi(self):
         """ Test addi $rt, $rs, imm """
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         for i in range(100):
             imm = np.uint32(random.getrandbits(32))
@@ -343,7 +375,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_beq(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         beq_cmd = CMDParse.parse_cmd("beq $t0, $s0, 0x3")
 
@@ -358,7 +390,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_bgez(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         bgez_cmd = CMDParse.parse_cmd("bgez $s0, 0xa")
 
@@ -384,7 +416,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_bgezal(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         bgez_cmd = CMDParse.parse_cmd("bgezal $s0, 0xa")
 
@@ -416,7 +448,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_bgtz(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         bgez_cmd = CMDParse.parse_cmd("bgtz $s0, 0xa")
 
@@ -442,7 +474,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_blez(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         bgez_cmd = CMDParse.parse_cmd("blez $s0, 0xa")
 
@@ -468,7 +500,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_bltz(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         bgez_cmd = CMDParse.parse_cmd("bltz $s0, 0xa")
 
@@ -494,7 +526,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_bltzal(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         the_cmd = CMDParse.parse_cmd("bltzal $s0, 0xa")
 
@@ -526,7 +558,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_bne(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         the_cmd = CMDParse.parse_cmd("bne $t0, $s0, 0xa")
 
@@ -550,7 +582,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_div(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         the_cmd = CMDParse.parse_cmd("div $s0, $s1")
 
@@ -572,7 +604,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_divu(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         the_cmd = CMDParse.parse_cmd("divu $s0, $s1")
 
@@ -594,7 +626,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_j(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         the_cmd = CMDParse.parse_cmd("j 0xf")
 
@@ -610,7 +642,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_jal(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         the_cmd = CMDParse.parse_cmd("jal 0xf")
 
@@ -630,7 +662,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_jr(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         the_cmd = CMDParse.parse_cmd("jr $s0")
 
@@ -650,7 +682,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_lb(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         the_cmd = CMDParse.parse_cmd("lb $s0, 4($s1)")
 
@@ -670,7 +702,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_lui(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         the_cmd = CMDParse.parse_cmd("lui $s0, 0xabba")
 
@@ -690,7 +722,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_lw(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         the_cmd = CMDParse.parse_cmd("lw $s0, 4($s1)")
 
@@ -703,7 +735,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_mfhi(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         the_cmd = CMDParse.parse_cmd("mfhi $s0")
 
@@ -719,7 +751,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_mflo(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         the_cmd = CMDParse.parse_cmd("mflo $s0")
 
@@ -735,7 +767,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_mult(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         the_cmd = CMDParse.parse_cmd("mult $s0, $s1")
 
@@ -749,7 +781,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_multu(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         the_cmd = CMDParse.parse_cmd("multu $s0, $s1")
 
@@ -763,7 +795,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_noop(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         the_cmd = CMDParse.parse_cmd("noop")
 
@@ -774,7 +806,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_or(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         for i in range(100):
             a = np.uint32(random.getrandbits(32))
@@ -790,7 +822,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_ori(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         for i in range(100):
             imm = np.uint32(random.getrandbits(32))
@@ -810,7 +842,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_sb(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         the_cmd = CMDParse.parse_cmd("sb $s0, 4($s1)")
 
@@ -822,7 +854,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_sll(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         the_cmd = CMDParse.parse_cmd("sll $s0, $s1, 10")
 
@@ -834,7 +866,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_sllv(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         the_cmd = CMDParse.parse_cmd("sllv $s0, $s1, $s2")
 
@@ -847,7 +879,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_slt(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         the_cmd = CMDParse.parse_cmd("slt $s0, $s1, $s2")
 
@@ -860,7 +892,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_slti(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         the_cmd = CMDParse.parse_cmd("slti $s0, $s1, 0x5")
 
@@ -872,7 +904,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_sltiu(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         the_cmd = CMDParse.parse_cmd("sltiu $s0, $s1, 0x5")
 
@@ -884,7 +916,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_sltu(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         the_cmd = CMDParse.parse_cmd("sltu $s0, $s1, $s2")
 
@@ -897,7 +929,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_sra(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         the_cmd = CMDParse.parse_cmd("sra $s0, $s1, 2")
 
@@ -909,7 +941,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_srl(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         the_cmd = CMDParse.parse_cmd("srl $s0, $s1, 2")
 
@@ -921,7 +953,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_srlv(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         the_cmd = CMDParse.parse_cmd("srlv $s0, $s1, $s2")
 
@@ -933,7 +965,7 @@ class TestOpcodes(unittest.TestCase):
         self.assertEqual(p.reg[16], np.right_shift(0xabbaabba, 0xa))
 
     def test_sub(self):
-        p = MIPSProcessor()
+        p = self.cls()
 
         p.reg[10] = 11
         p.reg[11] = 22
@@ -969,7 +1001,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_subu(self):
         """ Test subu $rd, $rs, $rt """
-        p = MIPSProcessor()
+        p = self.cls()
 
         p.reg[10] = 11
         p.reg[11] = 22
@@ -991,7 +1023,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_sw(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         the_cmd = CMDParse.parse_cmd("sw $s0, 4($s1)")
 
@@ -1014,7 +1046,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_syscall(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         the_cmd = CMDParse.parse_cmd("syscall")
 
@@ -1026,7 +1058,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_xor(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         for i in range(100):
             a = np.uint32(random.getrandbits(32))
@@ -1042,7 +1074,7 @@ class TestOpcodes(unittest.TestCase):
 
     def test_xori(self):
 
-        p = MIPSProcessor()
+        p = self.cls()
 
         for i in range(100):
             imm = np.uint32(random.getrandbits(32))
@@ -1060,6 +1092,535 @@ class TestOpcodes(unittest.TestCase):
 
             self.assertEqual(p.reg[rt], res)
 
+
+class TestIntOpcodes(TestOpcodes):
+
+    cls = IntMIPSProcessor
+
+
+def build_prog(lines):
+    return np.array([CMDParse.parse_cmd(l).bin for l in lines], dtype=np.uint32).view('uint8')
+
+
+loop_prog = [
+    "xor $t0, $t0, $t0",
+    "addi $t1, $zero, 0x1",
+    "addi $t2, $zero, 0x10",
+    "add $t0, $t0, $t1",        # top
+    "bne $t0, $t2, -2",
+    "beq $t0, $t0, -1",         # end
+]
+
+
+class TestDecodeCache(unittest.TestCase):
+
+    def test_hits(self):
+
+        p = MIPSProcessor()
+        p.load_program(0, build_prog(loop_prog))
+        p.execute_prog(0, 100)
+
+        self.assertEqual(p.reg[8], 0x10)
+        self.assertEqual(p.decode_misses, len(loop_prog))
+        self.assertEqual(p.decode_hits, 100 - len(loop_prog))
+
+    def test_trap_counts(self):
+
+        p = MIPSProcessor()
+        p.load_program(0, build_prog(["syscall"]))
+
+        # A trap still looked the instruction up, a miss then a hit.
+        for misses, hits in [(1, 0), (1, 1)]:
+            p.pc = 0
+
+            with self.assertRaises(SoftwareInterrupt):
+                p.run(10)
+
+            self.assertEqual((p.decode_misses, p.decode_hits), (misses, hits))
+
+    def test_predecode(self):
+
+        for cls in [MIPSProcessor, IntMIPSProcessor]:
+            p = cls()
+            p.load_program(0, build_prog(loop_prog))
+            p.predecode(0, 4 * len(loop_prog))
+            p.execute_prog(0, 100)
+
+            self.assertEqual(p.reg[8], 0x10)
+            self.assertEqual(p.decode_misses, 0)
+
+    def test_store_invalidates(self):
+
+        p = MIPSProcessor()
+        p.load_program(0, build_prog(loop_prog))
+        p.execute_prog(0, 10)
+
+        self.assertIn(12, p.decoded)
+
+        # Overwrite the loop body with a sw of its own encoding.
+        p.reg[16] = CMDParse.parse_cmd("addi $t0, $t0, 2").bin
+        p.reg[17] = 12
+        p.do_instr(CMDParse.parse_cmd("sw $s0, 0($s1)"))
+
+        self.assertNotIn(12, p.decoded)
+
+        p.reg[16] = 0
+        p.reg[17] = 14
+        p.do_instr(CMDParse.parse_cmd("sb $s0, 0($s1)"))
+
+        self.assertNotIn(12, p.decoded)
+
+        p.load_program(0, build_prog(loop_prog))
+        self.assertEqual(len(p.decoded), 0)
+
+
+call_prog = [
+    "addi $a0, $zero, 5",
+    "jal 5",
+    "noop",                     # jal links past the next instruction
+    "addu $s0, $v0, $zero",
+    "beq $zero, $zero, -1",     # end
+    "sll $v0, $a0, 2",          # 5: return a0 * 4 + 3
+    "addiu $v0, $v0, 3",
+    "jr $ra",
+]
+
+
+class TestBlockTranslation(unittest.TestCase):
+
+    def run_both(self, prog, n):
+
+        out = []
+        for translate in [False, True]:
+            p = MIPSProcessor()
+            p.load_program(0, build_prog(prog))
+            p.execute_prog(0, n, translate=translate)
+            out.append(p)
+
+        return out
+
+    def test_matches_interpreter(self):
+
+        for prog in [loop_prog, call_prog]:
+            for n in [1, 3, 4, 7, 10, 50, 500]:
+                a, b = self.run_both(prog, n)
+
+                self.assertListEqual(list(a.reg), list(b.reg))
+                self.assertEqual(a.pc, b.pc)
+
+        a, b = self.run_both(call_prog, 50)
+        self.assertEqual(b.reg[16], 23)
+
+    def test_self_modifying(self):
+
+        prog = [
+            "addi $t0, $zero, 1",
+            "sw $t1, 12($zero)",        # overwrite the addi below with $t1
+            "noop",
+            "addi $t2, $zero, 7",
+            "beq $zero, $zero, -1",
+        ]
+
+        for translate in [False, True]:
+            p = MIPSProcessor()
+            p.load_program(0, build_prog(prog))
+            p.reg[9] = CMDParse.parse_cmd("addi $t2, $zero, 9").bin
+            p.execute_prog(0, 10, translate=translate)
+
+            self.assertEqual(p.reg[10], 9)
+
+    def test_self_modifying_halt(self):
+
+        # The sw lands on decoded code just before the branch, which
+        # still has to run before the halt.
+        prog = [
+            "addi $t0, $zero, 1",
+            "sw $t1, 0($zero)",
+            "beq $zero, $zero, -1",
+        ]
+
+        out = []
+        for translate in [False, True]:
+            p = MIPSProcessor()
+            p.load_program(0, build_prog(prog))
+            p.reg[9] = CMDParse.parse_cmd("addi $t0, $zero, 2").bin
+            out.append((p.execute_prog(0, 10, translate=translate, halt=True), p.pc))
+
+        self.assertEqual(out[0], ((StopReason.HALT, 3), 8))
+        self.assertEqual(out[1], out[0])
+
+    def test_trap_pc(self):
+
+        prog = [
+            "addi $t0, $zero, 1",
+            "add $t2, $t1, $t0",
+            "beq $zero, $zero, -1",
+        ]
+
+        for translate in [False, True]:
+            p = MIPSProcessor()
+            p.load_program(0, build_prog(prog))
+            p.reg[9] = 2 ** 31 - 1
+
+            with self.assertRaises(IntegerOverflow):
+                p.execute_prog(0, 10, translate=translate)
+
+            self.assertEqual(p.pc, 8)
+            self.assertEqual(p.reg[8], 1)
+
+
+class TestStopConditions(unittest.TestCase):
+
+    def run_all(self, prog, n, **stop):
+
+        out = []
+        for cls in [MIPSProcessor, IntMIPSProcessor]:
+            for translate in [False, True]:
+                p = cls()
+                p.load_program(0, build_prog(prog))
+                res = p.execute_prog(0, n, translate=translate, **stop)
+                out.append((p, res))
+
+        return out
+
+    def test_halt(self):
+
+        for p, res in self.run_all(loop_prog, 1000, halt=True):
+            self.assertEqual(res, (StopReason.HALT, 36))
+            self.assertEqual(p.instr_c, 36)
+            self.assertEqual(p.pc, 20)
+            self.assertEqual(p.reg[8], 0x10)
+
+        for p, res in self.run_all(loop_prog, 1000):
+            self.assertEqual(res, (StopReason.MAX_INSTR, 1000))
+
+    def test_stop_at(self):
+
+        for p, res in self.run_all(call_prog, 1000, stop_at=[20]):
+            self.assertEqual(res, (StopReason.STOP_PC, 2))
+            self.assertEqual(p.pc, 20)
+
+        for p, res in self.run_all(call_prog, 1000, stop_at=[16]):
+            self.assertEqual(res, (StopReason.STOP_PC, 6))
+            self.assertEqual(p.pc, 16)
+            self.assertEqual(p.reg[16], 23)
+
+        # The starting address itself only stops the run when reached again.
+        for p, res in self.run_all(loop_prog, 1000, stop_at=[0, 12]):
+            self.assertEqual(res, (StopReason.STOP_PC, 3))
+
+        # Unless the run resumes an earlier one.
+        for p, res in self.run_all(loop_prog, 1000, stop_at=[0, 12], resume=True):
+            self.assertEqual(res, (StopReason.STOP_PC, 0))
+
+            res = p.run(1000, stop_at=[0, 12], resume=False)
+            self.assertEqual(res, (StopReason.STOP_PC, 3))
+
+    def test_until(self):
+
+        for p, res in self.run_all(loop_prog, 1000, until=lambda p: p.reg[8] >= 5):
+            self.assertEqual(res.reason, StopReason.PREDICATE)
+            self.assertEqual(p.reg[8], 5)
+            self.assertEqual(p.pc, 12)
+
+    def test_syscall_exit(self):
+
+        prog = [
+            "addi $v0, $zero, 10",
+            "syscall",
+            "addi $t0, $zero, 1",
+        ]
+
+        for p, res in self.run_all(prog, 1000, syscall_exit=True):
+            self.assertEqual(res, (StopReason.EXIT, 2))
+            self.assertEqual(p.pc, 8)
+            self.assertEqual(p.reg[8], 0)
+
+        prog[0] = "addi $v0, $zero, 1"
+
+        for cls in [MIPSProcessor, IntMIPSProcessor]:
+            for translate in [False, True]:
+                p = cls()
+                p.load_program(0, build_prog(prog))
+
+                with self.assertRaises(SoftwareInterrupt):
+                    p.execute_prog(0, 1000, translate=translate, syscall_exit=True)
+
+                self.assertEqual(p.instr_c, 1)
+
+
+class TestOverflow(unittest.TestCase):
+
+    def test_local(self):
+
+        before = np.geterr()
+
+        p = MIPSProcessor()
+        q = MIPSProcessor()
+
+        self.assertEqual(np.geterr(), before)
+
+        # Unsigned ops wrap silently and leave nothing behind for the next
+        # trapping op to pick up.
+        p.reg[8] = 0xffffffff
+        p.reg[9] = 2
+        p._addu(10, 8, 9)
+        p._subu(11, 9, 8)
+        p._add(12, 9, 9)
+
+        self.assertEqual(p.reg[10], 1)
+        self.assertEqual(p.reg[11], 3)
+        self.assertEqual(p.reg[12], 4)
+
+        q.reg[8] = 2 ** 31 - 1
+        q.reg[9] = 1
+
+        with self.assertRaises(IntegerOverflow):
+            q._add(10, 8, 9)
+
+        with self.assertRaises(IntegerOverflow):
+            q._addi(10, 8, 1)
+
+        q.reg[8] = 2 ** 31
+
+        with self.assertRaises(IntegerOverflow):
+            q._sub(10, 8, 9)
+
+        p._add(12, 9, 9)
+        self.assertEqual(p.reg[12], 4)
+
+    def test_threads(self):
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        prog = [
+            "addi $t0, $t0, 0x4000",
+            "beq $zero, $zero, -2",
+        ]
+
+        def run(start):
+            p = MIPSProcessor()
+            p.load_program(0, build_prog(prog))
+            p.reg[8] = start
+
+            try:
+                p.execute_prog(0, 2000)
+            except IntegerOverflow:
+                return p.instr_c
+
+        # Each processor traps exactly when its own counter wraps.
+        starts = [0, 2 ** 30, 2 ** 31 - 0x4000 * 100, 2 ** 31 - 1]
+
+        with ThreadPoolExecutor(4) as ex:
+            counts = list(ex.map(run, starts))
+
+        self.assertListEqual(counts, [None, None, 198, 0])
+
+
+class TestPagedMemory(unittest.TestCase):
+
+    def test_far_addresses(self):
+
+        prog = [
+            "lui $sp, 0x7fff",
+            "ori $sp, $sp, 0xfff0",
+            "lui $s0, 0x1000",
+            "addi $t0, $zero, 0x1a5",
+            "sw $t0, 8($s0)",
+            "lw $t1, 8($s0)",
+            "sw $t1, -4($sp)",
+            "lb $t2, -4($sp)",
+            "sb $t2, 1($s0)",
+            "beq $zero, $zero, -1",
+        ]
+
+        for cls in [MIPSProcessor, IntMIPSProcessor]:
+            for translate in [False, True]:
+                p = cls(mem=MMem())
+                p.load_program(0x400000, build_prog(prog))
+                res = p.execute_prog(0x400000, 100, translate=translate, halt=True)
+
+                self.assertEqual(res.reason, StopReason.HALT)
+                self.assertEqual(p.reg[9], 0x1a5)
+                self.assertEqual(p.reg[10], 0xffffffa5)
+                self.assertEqual(p.mem.load_word(0x7fffffec), 0x1a5)
+                self.assertEqual(p.mem.load_word(0x10000000), 0xa500)
+                self.assertEqual(len(p.mem.pages), 3)
+
+                p.reset()
+                self.assertEqual(len(p.mem.pages), 0)
+
+    def test_load(self):
+
+        image = build_prog(loop_prog)
+
+        fd, path = tempfile.mkstemp(suffix=".bin")
+        os.close(fd)
+        image.tofile(path)
+
+        try:
+            for prog in [image, image.tobytes(), path]:
+                for mem in [None, MMem()]:
+                    p = IntMIPSProcessor(mem=mem)
+                    p.load_program(0x200, prog)
+                    p.execute_prog(0x200, 100, halt=True)
+
+                    self.assertEqual(p.reg[8], 0x10)
+        finally:
+            os.remove(path)
+
+        p = MIPSProcessor(64)
+
+        with self.assertRaises(MemoryError):
+            p.load_program(48, image)
+
+        with self.assertRaises(ValueError):
+            p.load_program(0, image.view(np.uint32))
+
+    def test_predecode(self):
+
+        p = IntMIPSProcessor(mem=MMem())
+        p.load_program(0x400000, build_prog(loop_prog))
+        p.predecode()
+
+        # Only the one allocated page, where the untouched words are noops.
+        self.assertEqual(len(p.decoded), 1024)
+        self.assertEqual(min(p.decoded), 0x400000)
+
+        p.execute_prog(0x400000, 100)
+        self.assertEqual(p.decode_misses, 0)
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def test_restore(self):
+
+        prog = [
+            "addi $t0, $t0, 1",
+            "sw $t0, 0x1100($zero)",
+            "sb $t0, -1($sp)",
+            "beq $zero, $zero, -4",
+        ]
+
+        # Data is kept off the code page, so restoring doesn't have to drop
+        # any decoded instructions.
+        for cls in [MIPSProcessor, IntMIPSProcessor]:
+            for mem in [None, MMem()]:
+                for translate in [False, True]:
+                    p = cls(0x3000, mem=mem)
+                    p.load_program(0, build_prog(prog))
+                    p.reg[29] = 0x2200
+                    p.execute_prog(0, 10, translate=translate)
+
+                    snap = p.snapshot()
+                    p.run(20, translate=translate)
+                    after = (list(p.reg), int(p.pc), p.mem[0:0x3000].copy())
+                    misses = p.decode_misses
+
+                    for i in range(3):
+                        p.restore(snap)
+
+                        self.assertEqual(p.reg[8], 3)
+                        self.assertEqual(p.mem[0x1100], 3)
+                        self.assertEqual(p.mem[0x21ff], 2)
+                        self.assertEqual(p.instr_c, 10)
+
+                        p.run(20, translate=translate)
+
+                        self.assertEqual((list(p.reg), int(p.pc)), after[:2])
+                        self.assertListEqual(list(p.mem[0:0x3000]), list(after[2]))
+                        self.assertEqual(p.decode_misses, misses)
+
+    def test_fork(self):
+
+        p = IntMIPSProcessor(mem=MMem())
+        p.load_program(0x400000, build_prog(loop_prog))
+        p.execute_prog(0x400000, 10)
+
+        c = p.fork()
+
+        self.assertIs(type(c), IntMIPSProcessor)
+        self.assertIs(c.mem.pages[0x400], p.mem.pages[0x400])
+        self.assertListEqual(list(c.reg), list(p.reg))
+
+        c.reg[9] = 2
+        c.mem.store_word(0x400100, 7)
+        c.run(100, halt=True)
+
+        self.assertEqual(c.reg[8], 0x10)
+        self.assertEqual(p.reg[8], 4)
+        self.assertEqual(p.mem.load_word(0x400100), 0)
+        self.assertIsNot(c.mem.pages[0x400], p.mem.pages[0x400])
+
+        p.run(100, halt=True)
+        self.assertEqual(p.reg[8], 0x10)
+
+    def test_code_changed(self):
+
+        # Code written after the snapshot has to be forgotten on restore.
+        prog = [
+            "sw $t1, 12($zero)",
+            "noop",
+            "noop",
+            "addi $t2, $zero, 7",
+            "beq $zero, $zero, -1",
+        ]
+
+        for mem in [None, MMem()]:
+            for translate in [False, True]:
+                p = IntMIPSProcessor(mem=mem)
+                p.load_program(0, build_prog(prog))
+                p.reg[9] = CMDParse.parse_cmd("addi $t2, $zero, 9").bin
+                p.execute_prog(0, 1)
+
+                snap = p.snapshot()
+                p.mem[12:16] = build_prog(["addi $t2, $zero, 5"])
+                p.reg[9] = 0
+                p.run(10, translate=translate)
+
+                self.assertEqual(p.reg[10], 5)
+
+                p.restore(snap)
+                p.run(10, translate=translate)
+
+                self.assertEqual(p.reg[10], 9)
+
+
+class TestIntBackend(unittest.TestCase):
+
+    def test_matches_numpy(self):
+
+        for s in well_formed:
+            if s.split()[0] in ["add", "addi", "sub", "syscall", "jr", "lb", "lw", "sb", "sw"]:
+                continue
+
+            for i in range(20):
+                vals = [random.getrandbits(32) for _ in range(32)]
+                out = []
+
+                for cls in [MIPSProcessor, IntMIPSProcessor]:
+                    p = cls()
+                    p.reg[:] = vals
+                    p.pc = 0x400
+                    p.do_instr(CMDParse.parse_cmd(s))
+                    out.append((list(p.reg), p.pc, p.hi, p.lo))
+
+                self.assertEqual(out[0], out[1], s)
+
+    def test_types(self):
+
+        p = IntMIPSProcessor()
+        p.load_program(0, build_prog(loop_prog))
+        p.execute_prog(0, 100)
+
+        self.assertIs(type(p.pc), int)
+        self.assertIs(type(p.reg[8]), int)
+        self.assertEqual(p.reg[8], 0x10)
+
+        p.reg[8] = -1
+        self.assertEqual(p.reg[8], 2 ** 32 - 1)
+        self.assertEqual(p.sreg[8], -1)
+
 if __name__ == "__main__":
     random.seed()
     unittest.main()
\ No newline at end of file
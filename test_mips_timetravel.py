@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import numpy as np
+
+from generic_memory import MMem
+from mips_sim import CMDParse, MIPSProcessor, IntMIPSProcessor, StopReason
+from mips_timetravel import TimeTravel
+
+# Fills 0x200.. with a running sum, with a subroutine call in the loop.
+prog = [
+    "addi $s0, $zero, 0x200",
+    "addi $s1, $zero, 0x300",
+    "jal 7",
+    "noop",
+    "addi $s0, $s0, 4",
+    "bne $s0, $s1, -4",
+    "beq $zero, $zero, -7",
+    "lw $t0, -4($s0)",
+    "addu $t0, $t0, $s0",
+    "sw $t0, 0($s0)",
+    "jr $ra",
+]
+
+
+def build(cls=IntMIPSProcessor, mem=None):
+    p = cls(0x400, mem=mem)
+    p.load_program(0, np.array([CMDParse.parse_cmd(l).bin for l in prog], dtype=np.uint32).view('uint8'))
+    p.pc = 0
+
+    return p
+
+
+def state(p):
+    return p.reg.tolist(), int(p.pc), list(p.mem[0x200:0x300])
+
+
+class TestTimeTravel(unittest.TestCase):
+
+    def setUp(self):
+        # The state before each instruction, one step at a time.
+        p = build()
+        self.ref = [state(p)]
+
+        for i in range(1000):
+            p.run(1)
+            self.ref.append(state(p))
+
+    def test_seek(self):
+
+        for cls, mem, translate in [(MIPSProcessor, None, False), (IntMIPSProcessor, MMem(), True)]:
+            p = build(cls, mem)
+            t = TimeTravel(p, 64, keep=4, translate=translate)
+
+            self.assertEqual(t.run(1000), (StopReason.MAX_INSTR, 1000))
+            self.assertEqual(len(t.snaps), 5)
+            self.assertEqual(t.times[1:], [768, 832, 896, 960])
+            self.assertEqual(state(p), self.ref[1000])
+
+            t.step_back()
+            self.assertEqual(p.instr_c, 999)
+            self.assertEqual(state(p), self.ref[999])
+
+            # Before the oldest kept snapshot, then forward again.
+            for n in [900, 10, 0, 777, 1000, 768]:
+                t.seek(n)
+                self.assertEqual(state(p), self.ref[n])
+
+            with self.assertRaises(ValueError):
+                t.seek(1001)
+
+    def test_reverse_continue(self):
+
+        p = build()
+        t = TimeTravel(p, 50)
+        t.run(1000)
+
+        hits = [n for n, s in enumerate(self.ref[:1000]) if s[1] == 36]
+
+        for n in hits[::-1][:5]:
+            start = p.instr_c
+            self.assertEqual(t.reverse_continue([36]), (StopReason.STOP_PC, start - n))
+            self.assertEqual(state(p), self.ref[n])
+
+        # The first hit, then nothing earlier.
+        t.seek(hits[0] + 1)
+        self.assertEqual(t.reverse_continue([36]), (StopReason.STOP_PC, 1))
+        self.assertEqual(t.reverse_continue([36]), (StopReason.MAX_INSTR, hits[0]))
+        self.assertEqual(p.instr_c, 0)
+
+    def test_stop_at_boundary(self):
+
+        p = build()
+        self.assertEqual(p.run(1000, stop_at={0x10}), (StopReason.STOP_PC, 7))
+
+        # The breakpoint falls exactly on a snapshot.
+        p = build()
+        t = TimeTravel(p, 7)
+        self.assertEqual(t.run(1000, stop_at={0x10}), (StopReason.STOP_PC, 7))
+        self.assertEqual(t.times, [0, 7])
+        self.assertEqual(state(p), self.ref[7])
+
+    def test_new_history(self):
+
+        p = build(mem=MMem())
+        t = TimeTravel(p, 100)
+        t.run(1000)
+
+        t.seek(450)
+        p.reg[9] = 123
+        t.run(100)
+
+        self.assertEqual(t.end, 550)
+        self.assertEqual(t.times[-3:], [400, 450, 500])
+
+        # Replays see the change.
+        t.seek(460)
+        self.assertEqual(p.reg[9], 123)
+        self.assertEqual(state(p)[2], self.ref[460][2])
+
+        t.seek(449)
+        self.assertEqual(state(p), self.ref[449])
+
+        # At the end of history changes need marking.
+        t.seek(550)
+        p.reg[9] = 7
+        t.mark()
+        t.run(10)
+        t.step_back(5)
+        self.assertEqual(p.reg[9], 7)
+
+    def test_exit(self):
+
+        exit_prog = [
+            "addi $v0, $zero, 10",
+            "addi $t0, $zero, 1",
+            "syscall",
+            "addi $t0, $t0, 1",
+            "beq $zero, $zero, -1",
+        ]
+
+        for translate in [False, True]:
+            p = MIPSProcessor(0x100)
+            p.load_program(0, np.array([CMDParse.parse_cmd(l).bin for l in exit_prog], dtype=np.uint32).view('uint8'))
+            t = TimeTravel(p, 2, translate=translate)
+
+            self.assertEqual(t.run(100, syscall_exit=True), (StopReason.EXIT, 3))
+            self.assertEqual(t.run(5), (StopReason.MAX_INSTR, 5))
+
+            # Back and forth across the exit.
+            for n in [0, 3, 1, 8, 2, 4, 0, 6]:
+                t.seek(n)
+                self.assertEqual(p.instr_c, n)
+                self.assertEqual(p.reg[8], [0, 0, 1, 1, 2, 2, 2, 2, 2][n])
+                self.assertEqual(p.pc, min(4 * n, 16))
+
+            t.seek(8)
+            self.assertEqual(t.reverse_continue([8]), (StopReason.STOP_PC, 6))
+            self.assertEqual(p.instr_c, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
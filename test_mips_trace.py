@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from generic_memory import MMem
+from mips_sim import CMDParse, MIPSProcessor, IntMIPSProcessor
+from mips_trace import ExecTracer, StateTraceWriter, StateTrace, read_trace, iter_trace, format_record,\
+    NO_DEST, HILO
+
+# Sums the squares of 5..1 into memory through a subroutine.
+prog = [
+    "addi $s0, $zero, 5",
+    "jal 6",
+    "noop",
+    "addi $s0, $s0, -1",
+    "bgtz $s0, -4",
+    "beq $zero, $zero, -1",
+    "mult $s0, $s0",
+    "mflo $t1",
+    "lw $t2, 0x200($zero)",
+    "addu $t2, $t2, $t1",
+    "sw $t2, 0x200($zero)",
+    "jr $ra",
+]
+
+# Writes words and bytes over three pages.
+store_prog = [
+    "addi $s0, $zero, 60",
+    "addi $s1, $zero, 0x1000",
+    "mult $s0, $s0",
+    "mflo $t0",
+    "sll $t1, $s0, 7",
+    "addu $t1, $t1, $s1",
+    "sw $t0, 0($t1)",
+    "sb $s0, 3($t1)",
+    "lw $t2, 0($t1)",
+    "addi $s0, $s0, -1",
+    "bne $s0, $zero, -9",
+    "beq $zero, $zero, -1",
+]
+
+
+def build(cls=IntMIPSProcessor, mem=None, lines=prog, size=0x400):
+    p = cls(size, mem=mem)
+    p.load_program(0, np.array([CMDParse.parse_cmd(l).bin for l in lines], dtype=np.uint32).view('uint8'))
+    p.pc = 0
+
+    return p
+
+
+class TestExecTracer(unittest.TestCase):
+
+    def test_records(self):
+
+        for cls in [MIPSProcessor, IntMIPSProcessor]:
+            p = build(cls)
+            t = ExecTracer()
+            t.attach(p)
+            res = p.run(200, translate=True, halt=True)
+            t.detach(p)
+
+            recs = t.records()
+
+            self.assertEqual(len(recs), res.count)
+            self.assertListEqual(list(recs["pc"][:4]), [0, 4, 24, 28])
+            self.assertEqual(recs["word"][0], np.frombuffer(CMDParse.parse_cmd(prog[0]).bin, np.uint32)[0])
+
+            jal, mult, sw = recs[1], recs[2], recs[6]
+            self.assertEqual((jal["dest"], jal["value"]), (31, 12))
+            self.assertEqual((mult["dest"], mult["value"], mult["addr"]), (HILO, 25, 0))
+            self.assertEqual((sw["dest"], sw["value"], sw["addr"]), (NO_DEST, 25, 0x200))
+
+            # Replaying the register writes gives the final registers.
+            regs = [0] * 32
+
+            for r in recs[recs["dest"] >= 0]:
+                if r["dest"] < 32:
+                    regs[r["dest"]] = int(r["value"])
+
+            self.assertListEqual(regs, [int(v) for v in p.reg])
+            self.assertEqual(recs[recs["pc"] == 40]["value"][-1], 55)
+
+        self.assertIn("$t1 = 0x00000019", format_record(recs[3]))
+
+    def test_ring(self):
+
+        p = build()
+        t = ExecTracer(8)
+        t.attach(p)
+        p.run(30)
+
+        full = build()
+        u = ExecTracer()
+        u.attach(full)
+        full.run(30)
+
+        self.assertEqual(t.count, 30)
+        self.assertTrue(t.wrapped)
+        self.assertListEqual(t.records().tolist(), u.records()[-8:].tolist())
+
+    def test_file(self):
+
+        fd, path = tempfile.mkstemp(suffix=".npy")
+        os.close(fd)
+
+        try:
+            p = build(mem=MMem())
+            t = ExecTracer(16, path)
+            t.attach(p)
+            p.run(100)
+            t.detach(p)
+            p.run(10)
+            t.close()
+
+            full = build(mem=MMem())
+            u = ExecTracer()
+            u.attach(full)
+            full.run(100)
+
+            self.assertEqual(len(list(iter_trace(path))), 7)
+            self.assertListEqual(read_trace(path).tolist(), u.records().tolist())
+            self.assertEqual(len(np.load(path)), 16)
+        finally:
+            os.remove(path)
+
+
+class TestStateTrace(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_seek(self):
+
+        for mem in [None, MMem()]:
+            path = os.path.join(self.dir, "flat" if mem is None else "paged")
+
+            p = build(mem=mem, lines=store_prog, size=0x4000)
+            w = StateTraceWriter(path, 50)
+            w.attach(p)
+            p.run(300)
+            w.detach(p)
+
+            # Untraced instructions in between.
+            p.run(10)
+            w.attach(p)
+            p.run(300)
+            w.close()
+
+            t = StateTrace(path)
+
+            self.assertEqual(len(t), 600)
+            self.assertEqual(t.starts[:3], [0, 50, 100])
+            self.assertEqual(t.full, [0, 6])
+
+            live = build(mem=None if mem is None else MMem(), lines=store_prog, size=0x4000)
+            done = 0
+
+            for n in [0, 1, 49, 50, 51, 123, 299, 300, 301, 555, 600]:
+                # Trace index n, from 300 on ten instructions later.
+                real = n if n < 300 else n + 10
+                live.run(real - done)
+                done = real
+
+                s = t.state_at(n)
+
+                self.assertListEqual(s.reg, live.reg.tolist())
+                self.assertEqual((s.hi, s.lo, s.pc), (int(live.hi), int(live.lo), int(live.pc)))
+                self.assertListEqual(list(s.mem[0:0x4000]), list(live.mem[0:0x4000]))
+
+            with self.assertRaises(IndexError):
+                t.state_at(601)
+
+    def test_index(self):
+
+        path = os.path.join(self.dir, "trace")
+        p = build(mem=MMem(), lines=store_prog, size=0x4000)
+        w = StateTraceWriter(path, 50, full_every=3)
+        w.attach(p)
+        p.run(400)
+        w.flush()
+
+        # Before close there is no index, and the segments are scanned.
+        t = StateTrace(path)
+        self.assertEqual(len(t), 400)
+        self.assertEqual(t.full, [0, 3, 6])
+        before = t.state_at(380)
+
+        w.close()
+        os.rename(os.path.join(path, "seg-000000000000.npz"), os.path.join(self.dir, "moved.npz"))
+
+        # Opening reads only the index, and seeking past the last full
+        # keyframe only the segments from it on.
+        t = StateTrace(path)
+        self.assertEqual(t.starts, list(range(0, 450, 50)))
+        self.assertEqual(t.full, [0, 3, 6])
+
+        s = t.state_at(380)
+        self.assertEqual((s.reg, s.pc), (before.reg, before.pc))
+        self.assertListEqual(list(s.mem[0:0x4000]), list(before.mem[0:0x4000]))
+
+if __name__ == "__main__":
+    unittest.main()